@@ -1,4 +1,5 @@
 import datetime
+import os
 from unittest import TestCase, mock
 
 import pandas as pd
@@ -744,6 +745,53 @@ class TestBuildMatrix(TestCase):
 
                 assert len(matrix_storage_engine.get_store(uuid).design_matrix) == 5
 
+    def test_identical_data_is_linked(self):
+        with testing.postgresql.Postgresql() as postgresql:
+            engine = create_engine(postgresql.url())
+            ensure_db(engine)
+            create_schemas(
+                engine=engine,
+                features_tables=features_tables,
+                labels=labels,
+                states=states,
+            )
+
+            with get_matrix_storage_engine() as matrix_storage_engine:
+                builder = MatrixBuilder(
+                    db_config=db_config,
+                    matrix_storage_engine=matrix_storage_engine,
+                    experiment_hash=experiment_hash,
+                    engine=engine,
+                )
+                uuids = []
+                # the same data, under metadata that differs only in name
+                for matrix_id in ("first", "second"):
+                    matrix_metadata = dict(self.good_metadata, matrix_id=matrix_id)
+                    uuid = filename_friendly_hash(matrix_metadata)
+                    uuids.append(uuid)
+                    builder.build_matrix(
+                        as_of_times=self.good_dates,
+                        label_name="booking",
+                        label_type="binary",
+                        feature_dictionary=self.good_feature_dictionary,
+                        matrix_metadata=matrix_metadata,
+                        matrix_uuid=uuid,
+                        matrix_type="train",
+                    )
+
+                first, second = (matrix_storage_engine.get_store(uuid) for uuid in uuids)
+                assert os.path.samefile(
+                    first.matrix_base_store.path, second.matrix_base_store.path
+                )
+                assert second.metadata["matrix_id"] == "second"
+                pd.testing.assert_frame_equal(first.design_matrix, second.design_matrix)
+                session = builder.sessionmaker()
+                fingerprints = {
+                    session.query(Matrix).get(uuid).data_fingerprint for uuid in uuids
+                }
+                session.close()
+                assert len(fingerprints) == 1 and None not in fingerprints
+
     def test_nullcheck(self):
         f0_dict = {(r[0], r[1]): r for r in features0_pre}
         f1_dict = {(r[0], r[1]): r for r in features1_pre}
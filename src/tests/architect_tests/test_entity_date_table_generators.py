@@ -243,3 +243,54 @@ def test_entity_date_table_generator_from_labels():
             )
         )
         assert results == expected_output
+
+
+def test_entity_date_table_generator_tasks_batch_dates():
+    input_data = [
+        (1, datetime(2016, 1, 1), True),
+        (2, datetime(2016, 1, 1), True),
+        (3, datetime(2016, 3, 1), True),
+    ]
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        utils.create_binary_outcome_events(engine, "events", input_data)
+        table_generator = EntityDateTableGenerator(
+            query="select entity_id from events where outcome_date < '{as_of_date}'::date",
+            db_engine=engine,
+            entity_date_table_name="exp_hash_entity_date",
+            replace=False,
+            batch_size=2,
+        )
+        table_generator.generate_entity_date_table([datetime(2016, 2, 1)])
+
+        as_of_dates = [
+            datetime(2016, 2, 1),
+            datetime(2016, 3, 1),
+            datetime(2016, 4, 1),
+            datetime(2016, 5, 1),
+        ]
+        assert table_generator.missing_as_of_dates(as_of_dates) == as_of_dates[1:]
+
+        tasks = table_generator.generate_entity_date_table_tasks(as_of_dates)
+        task = tasks[table_generator.entity_date_table_name]
+        assert task["prepare"] == []
+        assert len(task["inserts"]) == 2
+
+        for stage in ("prepare", "inserts", "finalize"):
+            table_generator.run_commands(task[stage])
+        table_generator.check_entity_date_table(as_of_dates)
+
+        results = list(
+            engine.execute(
+                f"""
+                select as_of_date, count(*) from {table_generator.entity_date_table_name}
+                group by as_of_date order by as_of_date
+            """
+            )
+        )
+        assert results == [
+            (datetime(2016, 2, 1), 2),
+            (datetime(2016, 3, 1), 2),
+            (datetime(2016, 4, 1), 3),
+            (datetime(2016, 5, 1), 3),
+        ]
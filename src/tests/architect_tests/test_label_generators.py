@@ -197,3 +197,59 @@ def test_generate_all_labels_errors_on_duplicates():
                 label_timespans=["6month", "3month"],
             )
 
+
+
+def test_missing_label_pairs():
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        create_binary_outcome_events(engine, "events", events_data)
+
+        label_generator = LabelGenerator(
+            db_engine=engine,
+            query=LABEL_GENERATE_QUERY,
+            replace=False
+        )
+        label_generator.generate_all_labels(
+            labels_table=LABELS_TABLE_NAME,
+            as_of_dates=["2014-09-30"],
+            label_timespans=["6month"],
+        )
+
+        assert label_generator.missing_label_pairs(
+            labels_table=LABELS_TABLE_NAME,
+            as_of_dates=["2014-09-30", "2015-03-30"],
+            label_timespans=["6month", "3month"],
+        ) == [
+            ("2014-09-30", "3month"),
+            ("2015-03-30", "6month"),
+            ("2015-03-30", "3month"),
+        ]
+
+
+def test_generate_all_label_tasks_batches_inserts():
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        create_binary_outcome_events(engine, "events", events_data)
+
+        label_generator = LabelGenerator(
+            db_engine=engine,
+            query=LABEL_GENERATE_QUERY,
+            replace=True,
+            batch_size=3,
+        )
+        tasks = label_generator.generate_all_label_tasks(
+            labels_table=LABELS_TABLE_NAME,
+            as_of_dates=["2014-09-30", "2015-03-30"],
+            label_timespans=["6month", "3month"],
+        )
+        assert list(tasks.keys()) == [LABELS_TABLE_NAME]
+        assert len(tasks[LABELS_TABLE_NAME]["inserts"]) == 2
+
+        for stage in ("prepare", "inserts", "finalize"):
+            label_generator.run_commands(tasks[LABELS_TABLE_NAME][stage])
+        label_generator.check_labels_table(LABELS_TABLE_NAME)
+
+        result = engine.execute(
+            f"select count(*) from {LABELS_TABLE_NAME}"
+        )
+        assert result.scalar() == 8
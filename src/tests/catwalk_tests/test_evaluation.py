@@ -1,7 +1,10 @@
 from triage.component.catwalk.evaluation import (
     SORT_TRIALS,
     ModelEvaluator,
+    audited_groups,
     generate_binary_at_x,
+    group_crosstabs,
+    protected_group_codes,
     query_subset_table,
     subset_labels_and_predictions,
 )
@@ -673,6 +676,69 @@ def test_ModelEvaluator_needs_evaluation_no_bias_audit(db_engine_with_results_sc
     session.remove()
 
 
+def test_ModelEvaluator_missing_evaluations(db_engine_with_results_schema):
+    model_evaluator = ModelEvaluator(
+        testing_metric_groups=[
+            {
+                "metrics": ["precision@"],
+                "thresholds": {"top_n": [100]},
+            }
+        ],
+        training_metric_groups=[
+            {
+                "metrics": ["precision@"],
+                "thresholds": {"top_n": [100]},
+            }
+        ],
+        db_engine=db_engine_with_results_schema,
+    )
+    model_with_evaluations = ModelFactory()
+    model_without_evaluations = ModelFactory()
+
+    eval_time = datetime.datetime(2016, 1, 1)
+    as_of_date_frequency = "3d"
+    subset_hash = filename_friendly_hash(SUBSETS[1])
+    for evaluated_subset_hash in ["", subset_hash]:
+        EvaluationFactory(
+            model_rel=model_with_evaluations,
+            evaluation_start_time=eval_time,
+            evaluation_end_time=eval_time,
+            as_of_date_frequency=as_of_date_frequency,
+            metric="precision@",
+            parameter="100_abs",
+            subset_hash=evaluated_subset_hash,
+        )
+    session.commit()
+
+    metadata_overrides = {
+        "as_of_date_frequency": as_of_date_frequency,
+        "as_of_times": [eval_time],
+    }
+    test_matrix_store = MockMatrixStore(
+        "test", "1234", 5, db_engine_with_results_schema, metadata_overrides=metadata_overrides
+    )
+    train_matrix_store = MockMatrixStore(
+        "train", "2345", 5, db_engine_with_results_schema, metadata_overrides=metadata_overrides
+    )
+    other_dates_matrix_store = MockMatrixStore(
+        "test",
+        "3456",
+        5,
+        db_engine_with_results_schema,
+        metadata_overrides=dict(metadata_overrides, as_of_times=[datetime.datetime(2016, 2, 1)]),
+    )
+    requests = [
+        (model_with_evaluations.model_id, test_matrix_store, ""),
+        (model_with_evaluations.model_id, test_matrix_store, subset_hash),
+        (model_with_evaluations.model_id, train_matrix_store, ""),
+        (model_with_evaluations.model_id, other_dates_matrix_store, ""),
+        (model_without_evaluations.model_id, test_matrix_store, ""),
+    ]
+
+    # only test evaluations were stored, for one window
+    assert model_evaluator.missing_evaluations(requests) == set(requests[2:])
+
+
 def test_ModelEvaluator_needs_evaluation_with_bias_audit(db_engine_with_results_schema):
     # test that if a bias audit config is passed, and there are no matching bias audits
     # in the database, needs_evaluation returns true
@@ -852,6 +918,51 @@ def test_evaluation_sorting_with_protected_df(db_engine_with_results_schema):
             assert record[col] == value
 
 
+def test_group_crosstabs():
+    protected_df = pd.DataFrame(
+        {
+            "race": ["a", "b", "a", "b", "a", None],
+            "age": [20, 30, 40, 50, 60, 70],
+        },
+        index=pd.Index([10, 11, 12, 13, 14, 15], name="entity_id"),
+    )
+    group_codes = protected_group_codes(protected_df)
+    assert set(group_codes) == {"race", "age"}
+    # the ages are binned into quartiles, as aequitas does
+    assert len(group_codes["age"][1]) == 4
+
+    # sorted by score, with the codes put in the same order
+    sorted_index = [13, 10, 15, 11, 14, 12]
+    positions = protected_df.index.get_indexer(sorted_index)
+    codes, values = group_codes["race"]
+    labels = np.array([1, 0, 1, np.nan, 1, 0])
+    crosstabs = group_crosstabs(
+        {"race": (codes[positions], values)},
+        labels,
+        model_id=1,
+        score_thresholds={"rank_abs": [2], "rank_pct": [0.5]},
+    )
+    crosstabs = crosstabs.set_index(["score_threshold", "attribute_value"])
+    assert crosstabs.index.tolist() == [
+        ("2_abs", "a"), ("2_abs", "b"), ("0.5_pct", "a"), ("0.5_pct", "b")
+    ]
+    # the top 2 are entities 13 (b, 1) and 10 (a, 0)
+    assert crosstabs.loc[("2_abs", "a"), ["k", "tp", "fp", "fn", "tn"]].tolist() == [2, 0, 1, 1, 1]
+    assert crosstabs.loc[("2_abs", "b"), ["tp", "fp", "fn", "tn"]].tolist() == [1, 0, 0, 0]
+    # the top 3 add entity 15, who has no race
+    assert crosstabs.loc[("0.5_pct", "a"), ["k", "pp", "ppr"]].tolist() == [3, 1, 1 / 3]
+    # entity 11's missing label is counted in the group but not in the confusion matrix
+    assert crosstabs.loc[("0.5_pct", "b"), ["group_size", "group_label_pos", "pn"]].tolist() == [2, 1, 0]
+    assert np.isnan(crosstabs.loc[("0.5_pct", "b"), "npv"])
+    assert (crosstabs["total_entities"] == 6).all()
+
+    audited_df = audited_groups({"race": (codes[positions], values)}, labels)
+    # entity 15 has no race
+    assert audited_df["race"].isna().tolist() == [False, False, True, False, False, False]
+    assert audited_df["race"].dropna().tolist() == ["b", "a", "b", "a", "a"]
+    assert np.array_equal(audited_df["label_value"], labels, equal_nan=True)
+
+
 def test_generate_binary_at_x():
     input_array = np.array([0.9, 0.8, 0.7, 0.7, 0.7, 0.7, 0.7, 0.7, 0.7, 0.6])
 
@@ -124,3 +124,47 @@ def test_calculate_and_save_noop():
         ]
         assert len(records) == len(new_records)
         assert records == new_records
+
+
+def test_calculate_and_save_all_dates_at_once():
+    with rig_engines() as (db_engine, project_storage):
+        train_store = get_matrix_store(
+            project_storage,
+            matrix_creator(),
+            matrix_metadata_creator(matrix_type="train"),
+        )
+        test_store = get_matrix_store(
+            project_storage,
+            matrix_creator(),
+            matrix_metadata_creator(matrix_type="test"),
+        )
+        _, model_id = fake_trained_model(db_engine, train_matrix_uuid=train_store.uuid)
+        for feature, importance in (("feature_one", 0.75), ("feature_two", 0.25)):
+            db_engine.execute(
+                "insert into train_results.feature_importances (model_id, feature, feature_importance) values (%s, %s, %s)",
+                model_id,
+                feature,
+                importance,
+            )
+        calculator = IndividualImportanceCalculator(
+            db_engine, n_ranks=2, methods=["uniform"], replace=False
+        )
+        calculator.calculate_and_save_all_methods_and_dates(model_id, test_store)
+
+        query = """select entity_id, as_of_date, feature, feature_value, importance_score
+            from test_results.individual_importances
+            where model_id = %s and method = 'uniform'
+            order by feature, entity_id"""
+        records = [tuple(row) for row in db_engine.execute(query, model_id)]
+        assert [(row[0], row[2], row[3], row[4]) for row in records] == [
+            (1, "feature_one", 3, 0.75),
+            (2, "feature_one", 4, 0.75),
+            (1, "feature_two", 5, 0.25),
+            (2, "feature_two", 6, 0.25),
+        ]
+
+        # and that when run again, has the same result
+        with patch.object(calculator, "save_frame") as save_frame:
+            calculator.calculate_and_save_all_methods_and_dates(model_id, test_store)
+            assert not save_frame.called
+        assert [tuple(row) for row in db_engine.execute(query, model_id)] == records
@@ -0,0 +1,115 @@
+import datetime
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import GradientBoostingClassifier, RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+
+from triage.component.catwalk.individual_importance.tree_path import tree_path_contributions
+from tests.utils import fake_trained_model, get_matrix_store, matrix_metadata_creator, rig_engines
+
+
+def _stored_model(db_engine, project_storage, model_class, **parameters):
+    random_state = np.random.RandomState(0)
+    matrix = pd.DataFrame({
+        "entity_id": range(40),
+        "as_of_date": ["2016-01-01"] * 20 + ["2016-02-01"] * 20,
+        "feature_one": random_state.rand(40),
+        "feature_two": random_state.rand(40),
+        "feature_three": random_state.rand(40),
+    })
+    matrix["label"] = (matrix["feature_one"] + 0.5 * random_state.rand(40) > 0.75).astype(int)
+    test_store = get_matrix_store(project_storage, matrix, matrix_metadata_creator())
+    model = model_class(random_state=0, **parameters).fit(
+        test_store.design_matrix, test_store.labels
+    )
+    model_storage_engine = project_storage.model_storage_engine()
+    model_storage_engine.write(model, "abcd")
+    _, model_id = fake_trained_model(db_engine, train_matrix_uuid=test_store.uuid)
+    return model, model_id, test_store, model_storage_engine
+
+
+def test_tree_path_contributions_add_up_to_scores():
+    with rig_engines() as (db_engine, project_storage):
+        model, model_id, test_store, model_storage_engine = _stored_model(
+            db_engine, project_storage, RandomForestClassifier, n_estimators=5, max_depth=3
+        )
+        importances = tree_path_contributions(
+            db_engine,
+            model_id,
+            test_store,
+            n_ranks=3,
+            model_storage_engine=model_storage_engine,
+        )
+        assert len(importances) == 40 * 3
+        assert set(importances["feature_name"]) <= {"feature_one", "feature_two", "feature_three"}
+
+        # with every feature ranked, the contributions and the trees' starting
+        # point add up to the predicted scores
+        bias = np.mean([
+            tree.tree_.value[0, 0, 1] / tree.tree_.value[0, 0].sum() for tree in model.estimators_
+        ])
+        scores = importances.groupby("entity_id")["score"].sum() + bias
+        np.testing.assert_allclose(
+            scores.sort_index().to_numpy(),
+            model.predict_proba(test_store.design_matrix)[:, 1],
+            rtol=1e-5,
+        )
+        row = importances.iloc[0]
+        assert row["feature_value"] == np.float32(
+            test_store.design_matrix.xs(row["entity_id"], level="entity_id")[row["feature_name"]].iloc[0]
+        )
+
+        # the same, a few rows at a time, in parallel, for one of the dates
+        with patch(
+            "triage.component.catwalk.individual_importance.tree_path.TREE_PATH_CHUNK_CELLS", 15
+        ):
+            chunked_importances = tree_path_contributions(
+                db_engine,
+                model_id,
+                test_store,
+                n_ranks=3,
+                as_of_dates=[datetime.date(2016, 2, 1)],
+                model_storage_engine=model_storage_engine,
+                n_jobs=2,
+            )
+        expected = importances[importances["as_of_date"] == pd.Timestamp(2016, 2, 1)]
+        sort_columns = ["entity_id", "feature_name"]
+        pd.testing.assert_frame_equal(
+            chunked_importances.sort_values(sort_columns).reset_index(drop=True),
+            expected.sort_values(sort_columns).reset_index(drop=True),
+        )
+
+
+def test_tree_path_contributions_gradient_boosting():
+    with rig_engines() as (db_engine, project_storage):
+        model, model_id, test_store, model_storage_engine = _stored_model(
+            db_engine, project_storage, GradientBoostingClassifier, n_estimators=5, max_depth=2
+        )
+        importances = tree_path_contributions(
+            db_engine,
+            model_id,
+            test_store,
+            n_ranks=3,
+            model_storage_engine=model_storage_engine,
+        )
+        # contributions to the log-odds, which start from the prior's
+        log_odds = importances.groupby("entity_id")["score"].sum()
+        starting_log_odds = model.decision_function(test_store.design_matrix) - log_odds.sort_index().to_numpy()
+        np.testing.assert_allclose(starting_log_odds, starting_log_odds[0], rtol=1e-5)
+
+
+def test_tree_path_contributions_other_models():
+    with rig_engines() as (db_engine, project_storage):
+        _, model_id, test_store, model_storage_engine = _stored_model(
+            db_engine, project_storage, LogisticRegression
+        )
+        importances = tree_path_contributions(
+            db_engine,
+            model_id,
+            test_store,
+            n_ranks=3,
+            model_storage_engine=model_storage_engine,
+        )
+        assert importances.empty
@@ -1,6 +1,11 @@
 import pandas as pd
+import pytest
 
-from triage.component.catwalk.individual_importance.uniform import uniform_distribution
+from triage.component.catwalk.individual_importance.uniform import (
+    _entity_feature_values,
+    uniform_distribution,
+    uniform_distribution_frame,
+)
 from tests.utils import rig_engines, get_matrix_store, matrix_metadata_creator
 import datetime
 
@@ -45,3 +50,72 @@ def test_uniform_distribution():
             assert result["score"] <= 1
             assert isinstance(result["feature_name"], str)
             assert result["entity_id"] in [1, 2]
+
+
+def test_uniform_distribution_frame():
+    with rig_engines() as (db_engine, project_storage):
+        model = ModelFactory()
+        feature_importances = [
+            FeatureImportanceFactory(model_rel=model, feature="feature_{}".format(i))
+            for i in range(0, 10)
+        ]
+        data_dict = {
+            "entity_id": [1, 2, 1, 2],
+            "as_of_date": ["2016-01-01", "2016-01-01", "2017-01-01", "2017-01-01"],
+            "label": [0, 1, 1, 0],
+        }
+        for i, imp in enumerate(feature_importances):
+            data_dict[imp.feature] = [i, i + 0.5, i + 1, i + 1.5]
+        test_store = get_matrix_store(
+            project_storage,
+            pd.DataFrame.from_dict(data_dict),
+            matrix_metadata_creator(),
+        )
+        frame = uniform_distribution_frame(
+            db_engine, model_id=model.model_id, test_matrix_store=test_store, n_ranks=5,
+        )
+        assert len(frame) == 20  # 5 features x 2 entities x 2 as_of_dates
+
+        # the same records as calculating each as_of_date by itself
+        for as_of_date in (datetime.date(2016, 1, 1), datetime.date(2017, 1, 1)):
+            records = uniform_distribution(
+                db_engine,
+                model_id=model.model_id,
+                as_of_date=as_of_date,
+                test_matrix_store=test_store,
+                n_ranks=5,
+            )
+            for record in records:
+                record["score"] = float(record["score"])
+            frame_records = (
+                frame[frame["as_of_date"] == pd.Timestamp(as_of_date)]
+                .drop(columns="as_of_date")
+                .to_dict("records")
+            )
+            sort_key = lambda record: (record["feature_name"], record["entity_id"])
+            assert sorted(frame_records, key=sort_key) == sorted(records, key=sort_key)
+
+        # or only some of them
+        frame = uniform_distribution_frame(
+            db_engine,
+            model_id=model.model_id,
+            test_matrix_store=test_store,
+            n_ranks=5,
+            as_of_dates=[datetime.date(2017, 1, 1)],
+        )
+        assert len(frame) == 10
+        assert (frame["as_of_date"] == pd.Timestamp(2017, 1, 1)).all()
+
+
+def test_entity_feature_values_rejects_datetimes():
+    matrix = pd.DataFrame(
+        {"feature_1": [0.5]},
+        index=pd.MultiIndex.from_tuples(
+            [(1, pd.Timestamp("2016-01-01"))], names=["entity_id", "as_of_date"]
+        ),
+    )
+    with pytest.raises(TypeError) as exc_info:
+        _entity_feature_values(matrix, "feature_1", datetime.datetime(2016, 1, 1))
+    message, = exc_info.value.args
+    assert "datetime64[ns]" in message
+    assert "<class 'datetime.datetime'>" in message
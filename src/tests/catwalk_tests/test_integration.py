@@ -1,4 +1,5 @@
 from triage.component.catwalk import ModelTrainTester, Predictor, ModelTrainer, ModelEvaluator, IndividualImportanceCalculator, ProtectedGroupsGenerator
+from triage.component.catwalk import BatchKey, IndividualImportanceCalculatorNoOp, TaskBatch
 from triage.component.catwalk.utils import save_experiment_and_get_hash
 from triage.component.catwalk.model_trainers import flatten_grid_config
 from triage.component.catwalk.storage import (
@@ -146,6 +147,36 @@ def test_ModelTrainTester_process_task_empty_train(project_storage):
     assert train_tester.model_evaluator.evaluate.call_count == 0
     assert train_tester.protected_groups_generator.as_dataframe.call_count == 0
 
+def test_ModelTrainTester_skip_completed_tasks(project_storage):
+    train_tester, train_test_task = setup_model_train_tester(project_storage, replace=False)
+    train_tester.model_trainer = MagicMock(replace=False, run_id=None)
+    train_tester.model_trainer.model_storage_engine.stored_model_hashes.return_value = {
+        "evaluated", "unevaluated"
+    }
+    train_tester.individual_importance_calculator = IndividualImportanceCalculatorNoOp()
+    # the model with id 2 is missing evaluations
+    train_tester.model_evaluator.missing_evaluations.side_effect = lambda requests: {
+        request for request in requests if request[0] == 2
+    }
+    tasks = [
+        dict(train_test_task, train_kwargs=dict(train_test_task['train_kwargs'], model_hash=model_hash))
+        for model_hash in ("evaluated", "unevaluated", "unstored", "untrained")
+    ]
+    batches = (TaskBatch(key=BatchKey.QUICKTRAIN, tasks=tasks, description="all"),)
+
+    with patch(
+        'triage.component.catwalk.retrieve_model_ids_from_hashes',
+        return_value={"evaluated": 1, "unevaluated": 2, "unstored": 3},
+    ):
+        remaining_batches = train_tester.skip_completed_tasks(batches)
+    assert [task['train_kwargs']['model_hash'] for task in remaining_batches[0].tasks] == [
+        "unevaluated", "unstored", "untrained"
+    ]
+
+    train_tester.replace = True
+    assert train_tester.skip_completed_tasks(batches) == batches
+
+
 def test_ModelTrainTester_order_and_batch_tasks(project_storage):
     train_tester, sample_train_test_task = setup_model_train_tester(project_storage, replace=True)
     train_classpaths = [
@@ -97,3 +97,40 @@ def test_model_grouping_custom_config(sample_metadata):
             )
             == 3
         )
+
+
+def test_model_grouping_bulk_and_cached(sample_metadata):
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        ensure_db(engine)
+        model_grouper = ModelGrouper()
+        assert model_grouper.get_model_group_ids(
+            [
+                ("module.Classifier", {"param1": "val1"}),
+                ("module.Classifier", {"param1": "val2"}),
+                ("module.Classifier", {"param1": "val1"}),
+            ],
+            sample_metadata,
+            engine,
+        ) == [1, 2, 1]
+
+        # resolved groups are answered without going back to the database
+        engine.execute("delete from triage_metadata.model_groups")
+        assert (
+            model_grouper.get_model_group_id(
+                "module.Classifier", {"param1": "val2"}, sample_metadata, engine
+            )
+            == 2
+        )
+
+        # the feature list order does not matter to the stored procedure
+        metadata_reordered = copy(sample_metadata)
+        metadata_reordered["feature_names"] = list(
+            reversed(sample_metadata["feature_names"])
+        )
+        assert (
+            model_grouper.get_model_group_id(
+                "module.Classifier", {"param1": "val1"}, metadata_reordered, engine
+            )
+            == 1
+        )
@@ -95,15 +95,18 @@ def test_model_trainer(grid_config, default_model_trainer):
     ]
     assert len(records) == 4
 
-    # 3. that the model sizes are saved in the table and all are < 1 kB
+    # 3. that the stored model sizes and write times are saved in the table
     records = [
         row
-        for row in db_engine.execute("select model_size from triage_metadata.models")
+        for row in db_engine.execute(
+            "select model_hash, model_size, model_write_time from triage_metadata.models"
+        )
     ]
     assert len(records) == 4
-    for i in records:
-        size = i[0]
-        assert size < 1
+    for model_hash, size, write_time in records:
+        stored_bytes = len(model_storage_engine._get_store(model_hash).load())
+        assert size == pytest.approx(stored_bytes / 1024)
+        assert write_time > 0
 
     # 4. that all four models are cached
     model_pickles = [model_storage_engine.load(model_hash) for model_hash in hashes]
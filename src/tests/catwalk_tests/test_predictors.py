@@ -2,7 +2,7 @@ from contextlib import contextmanager
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm.session import make_transient
 import datetime
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 from numpy.testing import assert_array_almost_equal
 import pandas as pd
 
@@ -230,6 +230,34 @@ def test_predictor_get_train_columns(predict_setup_args):
         assert len(records) > 0
 
 
+def test_predictor_records_load_time_once(predict_setup_args):
+    (project_storage, db_engine, model_id) = predict_setup_args
+    model_storage_engine = project_storage.model_storage_engine()
+    predictor = Predictor(model_storage_engine, db_engine, rank_order='worst')
+
+    def recorded_load_time():
+        return db_engine.execute(
+            "select model_load_time from triage_metadata.models where model_id = %s",
+            model_id,
+        ).scalar()
+
+    assert predictor.load_model(model_id) is not None
+    first_load_time = recorded_load_time()
+    assert first_load_time is not None
+
+    # loading from storage again, or from memory, leaves it alone
+    predictor.load_model(model_id)
+    db_engine.execute(
+        "update triage_metadata.models set model_load_time = null where model_id = %s",
+        model_id,
+    )
+    predictor.load_model(model_id)
+    assert recorded_load_time() is None
+    with patch.object(model_storage_engine, "is_cached", return_value=True):
+        assert Predictor(model_storage_engine, db_engine, rank_order='worst').load_model(model_id)
+    assert recorded_load_time() is None
+
+
 def test_predictor_retrieve(predict_setup_args):
     """Test the predictions retrieved from the database match the output from predict_proba"""
     (project_storage, db_engine, model_id) = predict_setup_args
@@ -2,7 +2,7 @@ from datetime import datetime, date
 
 import testing.postgresql
 from sqlalchemy.engine import create_engine
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
 from triage.component.catwalk.protected_groups_generators import ProtectedGroupsGenerator
 
@@ -156,15 +156,20 @@ def test_protected_groups_generator_noreplace():
             cohort_hash='abcdef'
         )
         assert_data(table_generator)
-        table_generator.generate = MagicMock()
+        table_generator.generate_dates = MagicMock()
         table_generator.generate_all_dates(
             as_of_dates,
             cohort_table_name='cohort_abcdef',
             cohort_hash='abcdef'
         )
-        table_generator.generate.assert_not_called()
+        table_generator.generate_dates.assert_not_called()
         assert_data(table_generator)
 
+        assert table_generator.missing_as_of_dates(
+            [datetime(2016, 3, 1), datetime(2016, 5, 1)],
+            cohort_hash='abcdef'
+        ) == [datetime(2016, 5, 1)]
+
 
 def test_as_dataframe():
     attribute_columns = ['race', 'sex', 'age_bucket']
@@ -200,4 +205,64 @@ def test_as_dataframe():
         assert(protected_df.shape == (15, 3))
         assert(set(attribute_columns).issubset(protected_df.columns))
         for attr_col in attribute_columns:
-            assert(protected_df[attr_col].dtype == 'object')
\ No newline at end of file
+            assert(protected_df[attr_col].dtype == 'category')
+
+
+def test_as_dataframe_cached():
+    demographics_data = default_demographics()
+    cohort_data = default_cohort()
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url())
+        create_demographics_table(engine, demographics_data)
+        create_cohort_table(engine, cohort_data)
+        table_generator = ProtectedGroupsGenerator(
+            from_obj="demographics",
+            attribute_columns=['race', 'sex', 'age_bucket'],
+            entity_id_column="person_id",
+            knowledge_date_column="event_date",
+            db_engine=engine,
+            protected_groups_table_name="protected_groups_abcdef",
+            replace=True
+        )
+        as_of_dates = [datetime(2016, 1, 1), datetime(2016, 3, 1)]
+        table_generator.generate_all_dates(
+            as_of_dates,
+            cohort_table_name='cohort_abcdef',
+            cohort_hash='abcdef'
+        )
+        first_df = table_generator.as_dataframe(as_of_dates, cohort_hash='abcdef')
+        with patch.object(table_generator, '_query_dataframe') as query_mock, \
+                patch.object(table_generator, '_generation_stamp') as stamp_mock:
+            second_df = table_generator.as_dataframe(
+                list(reversed(as_of_dates)),
+                cohort_hash='abcdef'
+            )
+            query_mock.assert_not_called()
+            # the generator knows the generation it wrote
+            stamp_mock.assert_not_called()
+        assert second_df is first_df
+
+        # regenerating the table invalidates the cache
+        table_generator.generate_all_dates(
+            as_of_dates,
+            cohort_table_name='cohort_abcdef',
+            cohort_hash='abcdef'
+        )
+        with patch.object(table_generator, '_query_dataframe') as query_mock:
+            table_generator.as_dataframe(as_of_dates, cohort_hash='abcdef')
+            query_mock.assert_called_once()
+
+        # a generator that did not write the rows reads the current generation, so
+        # sees another process changing them without clearing this one's cache
+        engine.execute("update protected_groups_abcdef set race = 'other'")
+        reading_generator = ProtectedGroupsGenerator(
+            from_obj="demographics",
+            attribute_columns=['race', 'sex', 'age_bucket'],
+            entity_id_column="person_id",
+            knowledge_date_column="event_date",
+            db_engine=engine,
+            protected_groups_table_name="protected_groups_abcdef",
+            replace=True
+        )
+        updated_df = reading_generator.as_dataframe(as_of_dates, cohort_hash='abcdef')
+        assert set(updated_df['race']) == {'other'}
@@ -1,9 +1,11 @@
 import datetime
 import os
+import pickle
 import tempfile
 from collections import OrderedDict
 
 import boto3
+import numpy as np
 import pandas as pd
 import pytest
 import yaml
@@ -15,10 +17,14 @@ from unittest import mock
 from triage.component.catwalk.storage import (
     MatrixStore,
     CSVMatrixStore,
+    SparseMatrixStore,
     FSStore,
     S3Store,
+    LocalStoreCache,
+    ModelCache,
     ProjectStorage,
     ModelStorageEngine,
+    shared_model_cache,
 )
 
 from tests.utils import CallSpy
@@ -47,6 +53,74 @@ def test_S3Store():
     assert not store.exists()
 
 
+@mock_s3
+def test_S3Store_local_cache():
+    client = boto3.client("s3")
+    client.create_bucket(
+        Bucket="test_bucket",
+        ACL="public-read-write",
+        CreateBucketConfiguration={"LocationConstraint": "us-east-2"},
+    )
+    with tempfile.TemporaryDirectory() as tmpdir:
+        project_storage = ProjectStorage("s3://test_bucket/project", local_cache_directory=tmpdir)
+        store = project_storage.get_store(["models"], "a_model")
+        store.write("val".encode("utf-8"))
+        assert store.load() == b"val"
+        assert len(os.listdir(tmpdir)) == 1
+
+        with mock.patch.object(store, "download") as download:
+            assert store.load() == b"val"
+            assert not download.called
+
+        # rewriting the object changes its ETag, so it is copied again
+        store.write("newval".encode("utf-8"))
+        assert store.load() == b"newval"
+        assert len(os.listdir(tmpdir)) == 1
+
+
+@mock_s3
+def test_LocalStoreCache_eviction():
+    client = boto3.client("s3")
+    client.create_bucket(
+        Bucket="test_bucket",
+        ACL="public-read-write",
+        CreateBucketConfiguration={"LocationConstraint": "us-east-2"},
+    )
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache = LocalStoreCache(tmpdir, max_bytes=25)
+        stores = [S3Store("s3://test_bucket", f"file{i}", cache=cache) for i in range(3)]
+        for store in stores:
+            store.write(b"0123456789")
+            assert store.load() == b"0123456789"
+            # make sure the files are ordered by their last reads
+            for filename in os.listdir(tmpdir):
+                path = os.path.join(tmpdir, filename)
+                os.utime(path, (os.path.getmtime(path) - 1, os.path.getmtime(path) - 1))
+        # only the two most recently read files fit
+        assert len(os.listdir(tmpdir)) == 2
+        with mock.patch.object(stores[0], "download", wraps=stores[0].download) as download:
+            assert stores[0].load() == b"0123456789"
+            assert download.called
+
+
+@mock_s3
+def test_LocalStoreCache_failed_copy():
+    client = boto3.client("s3")
+    client.create_bucket(
+        Bucket="test_bucket",
+        ACL="public-read-write",
+        CreateBucketConfiguration={"LocationConstraint": "us-east-2"},
+    )
+    with tempfile.TemporaryDirectory() as tmpdir:
+        store = S3Store("s3://test_bucket", "file", cache=LocalStoreCache(tmpdir))
+        store.write(b"0123456789")
+        with mock.patch.object(store, "download", side_effect=OSError("No space left")):
+            with pytest.raises(OSError):
+                store.load()
+        # no partial copy is left outside the size limit
+        assert os.listdir(tmpdir) == []
+
+
 @mock_s3
 def test_S3Store_large():
     client = boto3.client("s3")
@@ -56,35 +130,12 @@ def test_S3Store_large():
         CreateBucketConfiguration={"LocationConstraint": "us-east-2"},
     )
 
-    store = S3Store("s3://test_bucket/a_path")
+    one_mb = 2**20
+    store = S3Store("s3://test_bucket/a_path", part_size=5 * one_mb, max_concurrency=2)
     assert not store.exists()
 
-    # NOTE: The issue under test (currently) arises when too large a "part"
-    # NOTE: is sent to S3 for upload -- greater than its 5 GiB limit on any
-    # NOTE: single upload request.
-    #
-    # NOTE: Though s3fs uploads file parts as soon as its buffer reaches
-    # NOTE: 5+ MiB, it does not ensure that its buffer -- and resulting
-    # NOTE: upload "parts" -- remain under this limit (as the result of a
-    # NOTE: single "write()").
-    #
-    # NOTE: Therefore, until s3fs adds handling to ensure it never attempts
-    # NOTE: to upload such large payloads, we'll handle this in S3Store,
-    # NOTE: by chunking out writes to s3fs.
-    #
-    # NOTE: This is all not only to explain the raison d'etre of this test,
-    # NOTE: but also as context for the following warning: The
-    # NOTE: payload we'll attempt to write, below, is far less than 5 GiB!!
-    # NOTE: (Attempting to provision a 5 GiB string in RAM just for this
-    # NOTE: test would be an ENORMOUS drag on test runs, and a conceivable
-    # NOTE: disruption, depending on the test environment's resources.)
-    #
-    # NOTE: As such, this test *may* fall out of sync with either the code
-    # NOTE: that it means to test or with the reality of the S3 API -- even
-    # NOTE: to the point of self-invalidation. (But, this should do the
-    # NOTE: trick; and, we can always increase the payload size here, or
-    # NOTE: otherwise tweak configuration, as necessary.)
-    one_mb = 2**20
+    # Large files are uploaded and downloaded in parts of part_size bytes,
+    # max_concurrency of them at a time.
     payload = b"0" * (10 * one_mb)  # 10MiB text of all zeros
 
     with CallSpy("botocore.client.BaseClient._make_api_call") as spy:
@@ -99,17 +150,20 @@ def test_S3Store_large():
         "UploadPart",
         "CompleteMultipartUpload",
     ]
-
-    upload_args = call_args[1]
-    upload_body = upload_args[2]["Body"]
-
-    # NOTE: Why is this a BufferIO rather than the underlying buffer?!
-    # NOTE: (Would have expected the result of BufferIO.read() -- str.)
-    body_length = len(upload_body.getvalue())
-    assert body_length == 5 * one_mb
+    assert [len(args[2]["Body"]) for args in call_args[1:3]] == [5 * one_mb, 5 * one_mb]
 
     assert store.exists()
-    assert store.load() == payload
+    with CallSpy("botocore.client.BaseClient._make_api_call") as spy:
+        assert store.load() == payload
+    ranged_gets = [call[0][2] for call in spy.calls if call[0][1] == "GetObject"]
+    assert len(ranged_gets) == 2
+    assert all(get["Range"].startswith("bytes=") for get in ranged_gets)
+
+    # files written through open() are uploaded when they are closed
+    with store.open("wb") as fd:
+        fd.write(b"val")
+    with store.local_file() as fd:
+        assert fd.read() == b"val"
 
     store.delete()
     assert not store.exists()
@@ -136,6 +190,52 @@ def test_ModelStorageEngine_nocaching(project_storage):
     assert "myhash" not in mse.cache
 
 
+@pytest.mark.parametrize("compression", ["none", "zlib", "lz4:1"])
+def test_ModelStorageEngine_compression(project_storage, compression):
+    if compression.startswith("lz4"):
+        pytest.importorskip("lz4")
+    mse = ModelStorageEngine(project_storage, compression=compression)
+    stored_bytes = mse.write(list(range(1000)), "myhash")
+    assert stored_bytes == os.path.getsize(mse._get_store("myhash").path)
+    # any engine can load models whatever codec they were written with
+    assert ModelStorageEngine(project_storage).load("myhash") == list(range(1000))
+
+
+def test_ModelStorageEngine_unknown_compression(project_storage):
+    with pytest.raises(ValueError):
+        ModelStorageEngine(project_storage, compression="nonsense:3")
+
+
+def test_ModelStorageEngine_mmap(project_storage):
+    mse = ModelStorageEngine(project_storage, compression="none", mmap_mode="r")
+    mse.write({"coef": np.arange(1000.0)}, "myhash")
+    model = mse.load("myhash")
+    assert isinstance(model["coef"], np.memmap)
+    assert_almost_equal(model["coef"], np.arange(1000.0))
+
+
+def test_ModelStorageEngine_stored_model_hashes(project_storage):
+    mse = ModelStorageEngine(project_storage)
+    assert mse.stored_model_hashes() == set()
+    mse.write("testobject", "myhash")
+    mse.write("testobject", "otherhash")
+    assert mse.stored_model_hashes() == {"myhash", "otherhash"}
+
+
+@mock_s3
+def test_ModelStorageEngine_stored_model_hashes_s3():
+    client = boto3.client("s3")
+    client.create_bucket(
+        Bucket="test_bucket",
+        ACL="public-read-write",
+        CreateBucketConfiguration={"LocationConstraint": "us-east-2"},
+    )
+    mse = ModelStorageEngine(ProjectStorage("s3://test_bucket/project"))
+    assert mse.stored_model_hashes() == set()
+    mse.write("testobject", "myhash")
+    assert mse.stored_model_hashes() == {"myhash"}
+
+
 def test_ModelStorageEngine_caching(project_storage):
     mse = ModelStorageEngine(project_storage)
     with mse.cache_models():
@@ -148,6 +248,47 @@ def test_ModelStorageEngine_caching(project_storage):
     assert "myhash" not in mse.cache
 
 
+def test_ModelCache_eviction():
+    cache = ModelCache(max_models=2, max_bytes=100)
+    cache.put("a", "model a", 10)
+    cache.put("b", "model b", 10)
+    assert cache.get("a") == "model a"
+    # b is now the least recently used
+    cache.put("c", "model c", 10)
+    assert "b" not in cache
+    # too large to keep anything else
+    cache.put("d", "model d", 95)
+    assert "a" not in cache and "c" not in cache
+    assert cache.get("d") == "model d"
+    assert cache.get("b") is None
+    assert cache.stats == {"models": 1, "bytes": 95, "hits": 2, "misses": 1, "evictions": 3}
+
+
+def test_ModelStorageEngine_model_cache(project_storage):
+    model_cache = ModelCache(max_models=10)
+    mse = ModelStorageEngine(project_storage, model_cache=model_cache)
+    mse.write("testobject", "myhash")
+    assert not mse.is_cached("myhash")
+    assert mse.load("myhash") == "testobject"
+    assert mse.is_cached("myhash")
+
+    # other engines sharing the cache get the model without loading it
+    other_mse = ModelStorageEngine(project_storage, model_cache=model_cache)
+    with mock.patch("triage.component.catwalk.storage.joblib.load") as joblib_load:
+        assert other_mse.load("myhash") == "testobject"
+        assert not joblib_load.called
+    assert model_cache.hits == 1
+
+    # rewriting the model drops the cached version
+    mse.write("newobject", "myhash")
+    assert mse.load("myhash") == "newobject"
+
+    # pickled engines bring their process's shared cache along, without its models
+    unpickled_cache = pickle.loads(pickle.dumps(mse)).model_cache
+    assert unpickled_cache is shared_model_cache(max_models=10)
+    assert not unpickled_cache.models
+
+
 DATA_DICT = OrderedDict(
     [
         ("entity_id", [1, 2]),
@@ -179,6 +320,18 @@ def matrix_stores():
         # and this last version will not have any cache
         yield csv
 
+        SparseMatrixStore(
+            project_storage,
+            [],
+            "df",
+            matrix=df.reset_index().astype({"as_of_date": "datetime64[ns]"}),
+            metadata=METADATA,
+        ).save()
+        sparse = SparseMatrixStore(project_storage, [], "df")
+        with sparse.cache():
+            yield sparse
+        yield sparse
+
 
 def test_MatrixStore_empty():
     for matrix_store in matrix_stores():
@@ -260,6 +413,32 @@ def test_MatrixStore_save():
         assert_frame_equal(matrix_store.design_matrix, df)
 
 
+def test_CSVMatrixStore_save_blocks(project_storage):
+    index = pd.MultiIndex.from_arrays(
+        [list(range(7)), [pd.Timestamp(2017, 1, 1)] * 7], names=MatrixStore.indices
+    )
+    feature_blocks = [
+        pd.DataFrame({"feature_one": [0.5] * 7, "feature_two": range(7)}, index=index),
+        pd.DataFrame({"feature_three": [1.0] * 7}, index=index),
+    ]
+    labels = pd.Series([0, 1, 0, 1, 0, 1, 0], index=index)
+    matrix_store = CSVMatrixStore(project_storage, [], "blocks", metadata=METADATA)
+    # four values a chunk, so one row (with its label) per chunk
+    with mock.patch("triage.component.catwalk.storage.CSV_WRITE_CHUNK_CELLS", 4):
+        matrix_store.save_blocks(feature_blocks, labels)
+
+    stored = CSVMatrixStore(project_storage, [], "blocks")
+    assert stored.columns(include_label=True) == [
+        "feature_one", "feature_two", "feature_three", "label"
+    ]
+    assert_frame_equal(
+        stored.design_matrix,
+        pd.concat(feature_blocks, axis=1),
+        check_dtype=False,
+    )
+    assert stored.labels.tolist() == labels.tolist()
+
+
 def test_MatrixStore_caching():
     for matrix_store in matrix_stores():
         with matrix_store.cache():
@@ -269,6 +448,43 @@ def test_MatrixStore_caching():
                 assert not load_mock.called
 
 
+def test_SparseMatrixStore_roundtrip(project_storage):
+    data = {
+        "entity_id": [1, 2, 3],
+        "as_of_date": [pd.Timestamp(2017, 1, 1)] * 3,
+        "category_a": [1.0, 0.0, 0.0],
+        "category_b": [0.0, 0.0, 1.0],
+        "numeric": [0.5, 0.0, 2.5],
+        "label": [1, 0, 1],
+    }
+    metadata = {"indices": MatrixStore.indices, "label_name": "label"}
+    SparseMatrixStore(
+        project_storage, [], "sparse", matrix=pd.DataFrame.from_dict(data), metadata=metadata
+    ).save()
+
+    matrix_store = SparseMatrixStore(project_storage, [], "sparse")
+    assert matrix_store.columns() == ["category_a", "category_b", "numeric"]
+    assert all(isinstance(dtype, pd.SparseDtype) for dtype in matrix_store.design_matrix.dtypes)
+    assert matrix_store.design_matrix.sparse.density == 4 / 9
+    assert matrix_store.design_matrix.sparse.to_dense().values.tolist() == [
+        [1.0, 0.0, 0.5],
+        [0.0, 0.0, 0.0],
+        [0.0, 1.0, 2.5],
+    ]
+    assert matrix_store.labels.tolist() == [1, 0, 1]
+    assert matrix_store.as_of_dates == [datetime.date(2017, 1, 1)]
+    assert not matrix_store.empty
+
+    # the column names and shape are read without loading the whole file
+    fresh_store = SparseMatrixStore(project_storage, [], "sparse")
+    with mock.patch.object(fresh_store.matrix_base_store, "load") as load_mock:
+        assert fresh_store.columns(include_label=True) == [
+            "category_a", "category_b", "numeric", "label"
+        ]
+        assert not fresh_store.empty
+        assert not load_mock.called
+
+
 def test_as_of_dates(project_storage):
     data = {
         "entity_id": [1, 2, 1, 2],
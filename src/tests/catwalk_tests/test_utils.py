@@ -6,7 +6,10 @@ from triage.component.catwalk.utils import (
     missing_model_hashes,
     missing_matrix_uuids,
     sort_predictions_and_labels,
+    RankedPredictions,
+    estimator_input,
 )
+from triage.component.catwalk.estimators.classifiers import ScaledLogisticRegression
 from triage.component.results_schema.schema import Matrix, Model
 from triage.component.catwalk.db import ensure_db
 from sqlalchemy import create_engine
@@ -14,8 +17,11 @@ import testing.postgresql
 import datetime
 import re
 import numpy as np
+import pandas as pd
+import scipy.sparse
 from numpy.testing import assert_array_equal
 import pytest
+from sklearn.tree import DecisionTreeClassifier
 
 
 def test_filename_friendly_hash():
@@ -151,3 +157,51 @@ def test_sort_predictions_and_labels():
     assert_array_equal(sorted_predictions, np.array([0.6, 0.6, 0.5, 0.5, 0.4]))
     assert_array_equal(sorted_labels, np.array([None, 1, 0, 1, 0]))
     assert_array_equal(sorted_entities.to_numpy(), np.array([4, 2, 0, 3, 1]))
+
+
+def test_ranked_predictions():
+    predictions = np.array([0.5, 0.4, 0.6, 0.5, 0.6, 0.5])
+    labels = np.array([0, 0, 1, 1, np.nan, 1])
+    ranked = RankedPredictions(predictions, labels, pd.Index(range(10, 16), name="entity_id"))
+
+    # the same ranks pandas gives the rows once sorted
+    ranks = ranked.ranks(tiebreaker="worst")
+    assert ranks.index.tolist() == [14, 12, 10, 13, 15, 11]
+    assert ranks["rank_abs_no_ties"].tolist() == [1, 2, 3, 4, 5, 6]
+    assert ranks["rank_abs_with_ties"].tolist() == [1, 1, 3, 3, 3, 6]
+    assert_array_equal(ranks["rank_pct_no_ties"], np.arange(1, 7) / 6)
+    assert_array_equal(ranks["rank_pct_with_ties"], np.array([1, 1, 2, 2, 2, 3]) / 3)
+    assert_array_equal(ranks["label_value"], np.array([np.nan, 1, 0, 1, 1, 0]))
+    assert ranked.ranks(tiebreaker="best").index.tolist() == [12, 14, 13, 15, 10, 11]
+
+    # a subset keeps the sort, in its own order
+    subset = ranked.subset([5, 0, 1])
+    sorted_predictions, sorted_labels, sorted_entities = subset.sorted(tiebreaker="best")
+    assert_array_equal(sorted_predictions, np.array([0.5, 0.5, 0.4]))
+    assert_array_equal(sorted_labels, np.array([1, 0, 0]))
+    assert sorted_entities.tolist() == [15, 10, 11]
+    assert subset.sorted(tiebreaker="worst")[2].tolist() == [10, 15, 11]
+
+
+def test_estimator_input():
+    dense = pd.DataFrame({"a": [0.0, 1.0], "b": [2.0, 0.0]})
+    sparse = dense.astype(pd.SparseDtype(float, 0.0))
+
+    # dense matrices are untouched
+    assert estimator_input(dense, DecisionTreeClassifier()) is dense
+
+    # sparse matrices go to estimators that accept them as CSR
+    csr = estimator_input(sparse, DecisionTreeClassifier())
+    assert scipy.sparse.isspmatrix_csr(csr)
+    assert_array_equal(csr.toarray(), dense.values)
+
+    # and are densified for the others
+    densified = estimator_input(sparse, ScaledLogisticRegression())
+    assert not any(isinstance(dtype, pd.SparseDtype) for dtype in densified.dtypes)
+    assert_array_equal(densified.values, dense.values)
+
+    # compact integer columns are given to estimators as float32
+    compact = pd.DataFrame({"a": np.array([0, 1], dtype=np.uint8), "b": [2.0, 0.0]})
+    converted = estimator_input(compact, DecisionTreeClassifier())
+    assert (converted.dtypes == np.float32).all()
+    assert_array_equal(converted.values, dense.values)
@@ -0,0 +1,96 @@
+from datetime import date
+
+import pytest
+
+from triage.component.collate import Aggregate, IndexAdvisor, SpacetimeAggregation
+
+
+events_data = [
+    # entity id, event_date, outcome
+    [1, date(2014, 1, 1), True],
+    [1, date(2014, 11, 10), False],
+    [2, date(2013, 6, 8), True],
+    [3, date(2015, 3, 3), True],
+    [4, date(2015, 12, 13), False],
+]
+
+
+@pytest.fixture(name="db_engine_with_events_table", scope="function")
+def db_engine_with_events_table(db_engine):
+    db_engine.execute(
+        "create table events (entity_id int, event_date date, outcome bool)"
+    )
+    for event in events_data:
+        db_engine.execute("insert into events values (%s, %s, %s::bool)", event)
+    return db_engine
+
+
+def aggregation(from_obj, join_with_cohort_table=True):
+    return SpacetimeAggregation(
+        aggregates=[Aggregate("outcome::int", ["sum"], {})],
+        from_obj=from_obj,
+        groups=["entity_id"],
+        intervals=["1y", "all"],
+        dates=["2016-01-01", "2015-01-01"],
+        state_table="states",
+        state_group="entity_id",
+        date_column="event_date",
+        prefix="events",
+        join_with_cohort_table=join_with_cohort_table,
+    )
+
+
+def test_source_table():
+    advisor = IndexAdvisor(db_engine=None)
+    assert advisor.source_table("events") == "events"
+    assert advisor.source_table("public.events as e") == "public.events"
+    assert advisor.source_table("events where event_date < '2016-01-01'") == "events"
+    assert advisor.source_table("(select * from events) events") is None
+
+
+def test_is_usable():
+    groups = ["entity_id"]
+    assert IndexAdvisor.is_usable("btree", ["event_date"], groups, "event_date")
+    assert IndexAdvisor.is_usable("btree", ["entity_id", "event_date"], groups, "event_date")
+    assert IndexAdvisor.is_usable("brin", ["event_date"], groups, "event_date")
+    assert not IndexAdvisor.is_usable("btree", ["entity_id"], groups, "event_date")
+    assert not IndexAdvisor.is_usable("btree", ["outcome", "event_date"], groups, "event_date")
+    assert not IndexAdvisor.is_usable("hash", ["event_date"], groups, "event_date")
+
+
+def test_check_reports_missing_index(db_engine_with_events_table):
+    report = IndexAdvisor(db_engine_with_events_table).check(aggregation("events"))
+    assert report.table == "events"
+    assert report.usable_indexes == []
+    assert report.missing_index_sql == "create index on events (entity_id, event_date)"
+    assert report.scan_cost > 0
+    assert report.seq_scan
+    # nothing was created
+    assert IndexAdvisor(db_engine_with_events_table).existing_indexes("events") == []
+
+
+def test_check_creates_missing_index(db_engine_with_events_table):
+    advisor = IndexAdvisor(db_engine_with_events_table, create_missing=True)
+    report = advisor.check(aggregation("events", join_with_cohort_table=False))
+    assert len(report.usable_indexes) == 1
+    assert report.missing_index_sql is None
+    assert [
+        (access_method, columns) for _, access_method, columns in advisor.existing_indexes("events")
+    ] == [("btree", ["event_date"])]
+
+
+def test_check_finds_existing_index(db_engine_with_events_table):
+    db_engine_with_events_table.execute(
+        "create index events_date_brin on events using brin (event_date)"
+    )
+    report = IndexAdvisor(db_engine_with_events_table).check(aggregation("events"))
+    assert report.usable_indexes == ["events_date_brin"]
+    assert report.missing_index_sql is None
+
+
+def test_check_skips_subqueries(db_engine_with_events_table):
+    report = IndexAdvisor(db_engine_with_events_table, create_missing=True).check(
+        aggregation("(select * from events) events")
+    )
+    assert report.table is None
+    assert report.missing_index_sql is None
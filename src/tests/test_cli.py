@@ -76,3 +76,10 @@ def test_cli_retrain_predict():
         assert mock.call_args[0][0].url
         assert mock.call_args[0][1]
         assert mock.call_args[0][2] == 3
+
+
+def test_cli_trace():
+    with patch('triage.cli.export_chrome_trace', autospec=True) as mock:
+        try_command('trace', '5', '-o', os.devnull)
+        mock.assert_called_once()
+        assert mock.call_args[0][0] == 5
@@ -15,6 +15,7 @@ from sqlalchemy.orm import sessionmaker
 from tests.utils import sample_config, populate_source_data, open_side_effect
 from triage.component.catwalk.storage import CSVMatrixStore
 from triage.component.results_schema.schema import Experiment
+from triage.component.catwalk.utils import missing_matrix_uuids, missing_model_hashes
 
 from triage.experiments import (
     MultiCoreExperiment,
@@ -274,6 +275,54 @@ def test_simple_experiment(experiment_class):
         assert len(linked_matrices) == len(matrices)
 
 
+@parametrize_experiment_classes
+def test_pipelined_experiment(experiment_class):
+    with testing.postgresql.Postgresql() as postgresql, TemporaryDirectory() as temp_dir, mock.patch(
+        "triage.util.conf.open", side_effect=open_side_effect
+    ) as mock_file:
+        db_engine = create_engine(postgresql.url())
+        populate_source_data(db_engine)
+        experiment = experiment_class(
+            config=sample_config(),
+            db_engine=db_engine,
+            project_path=os.path.join(temp_dir, "inspections"),
+            pipeline=True,
+        )
+        experiment.run()
+
+        # every matrix was built and every model was trained, tested and evaluated
+        assert len(experiment.matrix_build_tasks) > 0
+        assert missing_matrix_uuids(experiment.experiment_hash, db_engine) == []
+        assert missing_model_hashes(experiment.experiment_hash, db_engine) == []
+        assert num_linked_evaluations(db_engine) > 0
+
+
+@pytest.mark.parametrize("pipeline", [False, True])
+def test_memory_budgeted_experiment(pipeline):
+    with testing.postgresql.Postgresql() as postgresql, TemporaryDirectory() as temp_dir, mock.patch(
+        "triage.util.conf.open", side_effect=open_side_effect
+    ) as mock_file:
+        db_engine = create_engine(postgresql.url())
+        populate_source_data(db_engine)
+        experiment = MultiCoreExperiment(
+            config=sample_config(),
+            db_engine=db_engine,
+            project_path=os.path.join(temp_dir, "inspections"),
+            n_processes=2,
+            n_db_processes=2,
+            memory_budget=2 ** 34,
+            pipeline=pipeline,
+        )
+        experiment.run()
+
+        assert missing_model_hashes(experiment.experiment_hash, db_engine) == []
+        assert num_linked_evaluations(db_engine) > 0
+        assert experiment.memory_budget.reserved == {}
+        # built matrices have a known shape, so tasks get a nonzero estimate
+        task = next(task for batch in experiment._all_train_test_batches() for task in batch.tasks)
+        assert experiment.memory_budget.estimate(task) > 0
+
+
 @parametrize_experiment_classes
 def test_validate_default(experiment_class):
     with testing.postgresql.Postgresql() as postgresql, TemporaryDirectory() as temp_dir, mock.patch(
@@ -0,0 +1,106 @@
+import os
+import threading
+from unittest import mock
+
+from triage.experiments.memory import MemoryBudget, TrainTestMemoryEstimator
+from triage.experiments.multicore import WorkerPool, parallelize
+
+
+def pid_of_worker(task):
+    return os.getpid()
+
+
+def fail_on_odd(task):
+    if task % 2:
+        raise ValueError("odd task")
+    return task
+
+
+def test_parallelize_reuses_pool_workers():
+    with WorkerPool(2) as pool:
+        first_pids = parallelize(pid_of_worker, range(6), n_processes=2, pool=pool)
+        second_pids = parallelize(pid_of_worker, range(6), n_processes=2, pool=pool)
+    # the same two workers run every task of both batches
+    assert len(set(first_pids + second_pids)) <= 2
+    assert os.getpid() not in first_pids
+
+
+def test_parallelize_recycles_workers_by_task_count():
+    with WorkerPool(1, max_tasks_per_worker=2) as pool:
+        pids = parallelize(pid_of_worker, range(6), n_processes=1, pool=pool)
+    assert len(set(pids)) == 3
+
+
+def test_parallelize_recycles_workers_by_rss():
+    # every worker is over a 1 byte limit, so each task gets a fresh pool
+    with WorkerPool(1, max_worker_rss=1) as pool:
+        pids = parallelize(pid_of_worker, range(3), n_processes=1, pool=pool)
+    assert len(set(pids)) == 3
+
+
+def test_parallelize_without_pool_skips_failures():
+    assert parallelize(fail_on_odd, range(5), n_processes=2) == [0, 2, 4]
+
+
+def test_parallelize_waits_for_memory_budget():
+    # every task needs most of the budget, so they run one at a time
+    budget = MemoryBudget(10, estimate=lambda task: 6)
+    with WorkerPool(3) as pool:
+        results = parallelize(
+            pid_of_worker, range(4), n_processes=3, pool=pool, memory_budget=budget
+        )
+    assert len(results) == 4
+    assert budget.reserved == {}
+
+
+def test_memory_budget_admits_within_headroom():
+    budget = MemoryBudget(10, estimate=lambda task: task)
+    assert budget.reserve("a", 4)
+    assert budget.reserve("b", 6)
+    assert not budget.reserve("c", 1)
+    budget.release("b")
+    assert budget.reserve("c", 1)
+
+
+def test_train_test_memory_estimate_uses_float32_values():
+    db_engine = mock.Mock()
+    db_engine.execute.return_value.scalar.return_value = 100
+    store = mock.Mock(uuid="abcd", metadata={"feature_names": ["f1", "f2", "f3"]})
+    estimator = TrainTestMemoryEstimator(db_engine)
+    task = {
+        "train_kwargs": {"class_path": "sklearn.tree.DecisionTreeClassifier"},
+        "train_store": store,
+        "test_store": store,
+    }
+    # 100 rows of 3 features and a label, 4 bytes each, twice over a factor of 2
+    assert estimator(task) == 2 * 2 * 100 * 4 * 4
+
+
+def test_memory_budget_counts_live_rss():
+    budget = MemoryBudget(10, estimate=lambda task: task, live_rss=lambda: 9)
+    assert budget.reserve("a", 1)
+    assert not budget.reserve("b", 2)
+
+
+def test_memory_budget_runs_oversized_task_alone():
+    budget = MemoryBudget(10, estimate=lambda task: task)
+    assert budget.reserve("a", 20)
+    assert not budget.reserve("b", 1)
+
+
+def test_worker_pool_live_rss():
+    with WorkerPool(1) as pool:
+        parallelize(pid_of_worker, range(2), n_processes=1, pool=pool)
+        assert pool.live_rss() > 0
+
+
+def test_worker_progress_merged_by_waiting_thread():
+    main_thread = threading.current_thread()
+    merging_threads = []
+    with mock.patch(
+        "triage.experiments.multicore.add_progress",
+        side_effect=lambda pending: merging_threads.append(threading.current_thread()),
+    ):
+        with WorkerPool(2) as pool:
+            parallelize(pid_of_worker, range(4), n_processes=2, pool=pool)
+    assert merging_threads == [main_thread] * 4
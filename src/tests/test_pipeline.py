@@ -0,0 +1,49 @@
+from unittest import mock
+
+from triage.component.catwalk import BatchKey, TaskBatch
+from triage.experiments.pipeline import TaskGraph, MATRIX_BUILD, TRAIN_TEST, matrix_and_model_graph
+
+
+def test_task_graph_releases_tasks_once_dependencies_complete():
+    graph = TaskGraph()
+    graph.add("train_matrix", "build train")
+    graph.add("test_matrix", "build test")
+    graph.add("model", "train model", depends_on=["train_matrix", "test_matrix"])
+    graph.add("other_model", "train other model", depends_on=["prebuilt_matrix"])
+
+    assert graph.ready() == [
+        ("train_matrix", "build train"),
+        ("test_matrix", "build test"),
+        ("other_model", "train other model"),
+    ]
+    assert graph.ready() == []
+
+    graph.complete("train_matrix")
+    assert graph.ready() == []
+    graph.complete("test_matrix")
+    assert graph.ready() == [("model", "train model")]
+
+    assert not graph.done
+    graph.complete("other_model")
+    graph.complete("model")
+    assert graph.done
+
+
+def test_matrix_and_model_graph():
+    train_store = mock.Mock(uuid="train")
+    test_store = mock.Mock(uuid="test")
+    task = {"train_store": train_store, "test_store": test_store, "train_kwargs": {}}
+    batches = [
+        TaskBatch(key=BatchKey.QUICKTRAIN, tasks=[task], description="quick"),
+        TaskBatch(key=BatchKey.BIGTRAIN, tasks=[task], description="big"),
+    ]
+    graph = matrix_and_model_graph({"train": {"uuid": "train"}, "test": {"uuid": "test"}}, batches)
+
+    assert [task.kind for _, task in graph.ready()] == [MATRIX_BUILD, MATRIX_BUILD]
+    graph.complete((MATRIX_BUILD, "train"))
+    graph.complete((MATRIX_BUILD, "test"))
+    ready = graph.ready()
+    assert [(task.kind, task.batch_key) for _, task in ready] == [
+        (TRAIN_TEST, BatchKey.QUICKTRAIN),
+        (TRAIN_TEST, BatchKey.BIGTRAIN),
+    ]
@@ -0,0 +1,96 @@
+import os
+from collections import defaultdict
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+import fakeredis
+import pytest
+import testing.postgresql
+from pandas.testing import assert_frame_equal
+
+from triage import create_engine
+from triage.component.catwalk.storage import CSVMatrixStore, ProjectStorage
+from triage.component.catwalk.utils import missing_model_hashes
+from triage.experiments.rq import RQExperiment, local_matrix_store
+
+from tests.utils import (
+    matrix_creator,
+    matrix_metadata_creator,
+    open_side_effect,
+    populate_source_data,
+    sample_config,
+)
+
+
+def saved_matrix_store(project_path, matrix_uuid):
+    matrix = matrix_creator().set_index(CSVMatrixStore.indices)
+    matrix_store = CSVMatrixStore(ProjectStorage(project_path), ["matrices"], matrix_uuid)
+    matrix_store.metadata = matrix_metadata_creator()
+    labels = matrix.pop(matrix_store.label_column_name)
+    matrix_store.matrix_label_tuple = matrix, labels
+    matrix_store.save()
+    matrix_store.clear_cache()
+    return matrix_store
+
+
+def test_local_matrix_store_copies_and_evicts():
+    with TemporaryDirectory() as project_path, TemporaryDirectory() as local_path:
+        first = saved_matrix_store(project_path, "first")
+        second = saved_matrix_store(project_path, "second")
+
+        local_first = local_matrix_store(first, local_path, max_matrices=1)
+        assert str(local_first.matrix_base_store.path).startswith(local_path)
+        assert_frame_equal(local_first.design_matrix, first.design_matrix)
+        assert local_first.metadata == first.metadata
+        assert sorted(os.listdir(local_path)) == ["first.csv.gz", "first.yaml"]
+
+        local_matrix_store(second, local_path, max_matrices=1)
+        assert sorted(os.listdir(local_path)) == ["second.csv.gz", "second.yaml"]
+
+
+def test_local_matrix_store_failed_copy():
+    with TemporaryDirectory() as project_path, TemporaryDirectory() as local_path:
+        matrix_store = saved_matrix_store(project_path, "first")
+        with mock.patch.object(
+            matrix_store.matrix_base_store, "download", side_effect=OSError("No space left")
+        ):
+            with pytest.raises(OSError):
+                local_matrix_store(matrix_store, local_path)
+        assert not any(filename.endswith(".tmp") for filename in os.listdir(local_path))
+
+
+def test_local_matrix_store_already_local():
+    with TemporaryDirectory() as project_path:
+        matrix_store = saved_matrix_store(project_path, "first")
+        local_path = os.path.join(project_path, "matrices")
+        assert local_matrix_store(matrix_store, local_path) is matrix_store
+
+
+def test_rq_experiment_with_matrix_affinity():
+    with testing.postgresql.Postgresql() as postgresql, TemporaryDirectory() as temp_dir, mock.patch(
+        "triage.util.conf.open", side_effect=open_side_effect
+    ):
+        db_engine = create_engine(postgresql.url())
+        populate_source_data(db_engine)
+        local_path = os.path.join(temp_dir, "local")
+        experiment = RQExperiment(
+            config=sample_config(),
+            db_engine=db_engine,
+            project_path=os.path.join(temp_dir, "inspections"),
+            redis_connection=fakeredis.FakeStrictRedis(),
+            queue_kwargs={"is_async": False},
+            affinity_queues=["triage-0", "triage-1"],
+            local_matrix_directory=local_path,
+            max_local_matrices=2,
+        )
+        experiment.run()
+
+        assert missing_model_hashes(experiment.experiment_hash, db_engine) == []
+        # every task using a train matrix went to the same queue
+        queues_by_train_matrix = defaultdict(set)
+        for batch in experiment._all_train_test_batches():
+            for task in batch.tasks:
+                queue = experiment.train_test_queue(task)
+                queues_by_train_matrix[task["train_store"].uuid].add(queue.name)
+        assert all(len(queues) == 1 for queues in queues_by_train_matrix.values())
+        assert 0 < len(os.listdir(local_path)) <= 4
@@ -1,16 +1,25 @@
 from sqlalchemy.orm import Session
 import pytest
 import datetime
+import io
+import json
+import os
 from unittest import mock
 
 from triage.tracking import (
     initialize_tracking_and_get_run_id,
     get_run_for_update,
     increment_field,
+    ProgressReporter,
+    export_chrome_trace,
+    flush_progress,
+    recording_run,
+    span,
+    spans_over,
 )
 from triage.util.db import scoped_session
 from triage.experiments import MultiCoreExperiment, SingleThreadedExperiment
-from triage.component.results_schema import TriageRun, TriageRunStatus
+from triage.component.results_schema import TriageRun, TriageRunSpan, TriageRunStatus
 from tests.results_tests.factories import (
     ExperimentFactory,
     TriageRunFactory,
@@ -73,8 +82,19 @@ def test_experiment_tracker(test_engine, project_path):
     assert isinstance(experiment_run.matrix_building_started, datetime.datetime)
     assert isinstance(experiment_run.model_building_started, datetime.datetime)
     assert isinstance(experiment_run.last_updated_time, datetime.datetime)
+    assert experiment_run.matrices_per_minute > 0
+    assert experiment_run.models_per_minute > 0
     assert not experiment_run.stacktrace
     assert experiment_run.current_status == TriageRunStatus.completed
+    span_names = set(
+        name for (name,) in Session(bind=test_engine)
+        .query(TriageRunSpan.name)
+        .filter_by(run_id=experiment.run_id)
+    )
+    assert {
+        "run", "generate_labels", "generate_cohort", "table_task", "run_commands",
+        "build_matrix", "train_test", "train", "predict", "evaluate",
+    } <= span_names
 
 
 def test_experiment_tracker_exception(db_engine, project_path):
@@ -163,3 +183,97 @@ def test_increment_field(db_engine_with_results_schema):
     with scoped_session(db_engine_with_results_schema) as session:
         experiment_run_from_db = session.query(TriageRun).get(experiment_run.run_id)
         assert experiment_run_from_db.matrices_made == 2
+
+
+def test_progress_reporter_buffers_until_flush(db_engine_with_results_schema):
+    experiment_run = TriageRunFactory(
+        model_building_started=datetime.datetime.now() - datetime.timedelta(minutes=2)
+    )
+    factory_session.commit()
+    run_id = experiment_run.run_id
+    reporter = ProgressReporter(flush_interval=3600)
+    for _ in range(3):
+        reporter.increment("models_made", run_id, db_engine_with_results_schema)
+    reporter.increment("models_errored", run_id, db_engine_with_results_schema)
+
+    with scoped_session(db_engine_with_results_schema) as session:
+        assert session.query(TriageRun).get(run_id).models_made == 0
+
+    # counts taken from a worker's reporter are written by the parent's
+    worker_reporter = ProgressReporter(flush_interval=3600)
+    worker_reporter.increment("models_made", run_id, db_engine_with_results_schema)
+    reporter.add(worker_reporter.take())
+    assert worker_reporter.take() == {}
+
+    reporter.flush()
+    with scoped_session(db_engine_with_results_schema) as session:
+        experiment_run_from_db = session.query(TriageRun).get(run_id)
+        assert experiment_run_from_db.models_made == 4
+        assert experiment_run_from_db.models_errored == 1
+        assert experiment_run_from_db.models_per_minute == pytest.approx(2, rel=0.1)
+        assert experiment_run_from_db.matrices_per_minute is None
+
+
+def test_progress_reporter_lock_released_in_forked_child():
+    reporter = ProgressReporter(flush_interval=3600)
+    with reporter.lock:
+        pid = os.fork()
+        if pid == 0:
+            # would block forever on a lock inherited while held
+            os._exit(0 if reporter.take() == {} else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.WEXITSTATUS(status) == 0
+
+
+def test_span_recorded_on_current_run(db_engine_with_results_schema):
+    experiment_run = TriageRunFactory()
+    factory_session.commit()
+    with span("unrecorded"):
+        pass
+    with recording_run(experiment_run.run_id, db_engine_with_results_schema):
+        with span("outer", table="features.a") as outer_span:
+            outer_span.add_rows(3)
+            db_engine_with_results_schema.execute("select pg_sleep(0.01)")
+            with pytest.raises(ValueError):
+                with span("inner"):
+                    raise ValueError()
+    flush_progress()
+
+    with scoped_session(db_engine_with_results_schema) as session:
+        spans = {
+            run_span.name: run_span
+            for run_span in session.query(TriageRunSpan).filter_by(run_id=experiment_run.run_id)
+        }
+        assert spans["outer"].rows_processed == 3
+        assert spans["outer"].attributes == {"table": "features.a"}
+        assert spans["outer"].db_time >= 0.01
+        assert spans["outer"].wall_time >= spans["outer"].db_time
+        assert spans["outer"].rss_start > 0
+        assert spans["outer"].rss_end > 0
+        assert spans["inner"].attributes == {"failed": True}
+        assert spans["inner"].rows_processed is None
+
+    trace = io.StringIO()
+    export_chrome_trace(experiment_run.run_id, db_engine_with_results_schema, trace)
+    events = json.loads(trace.getvalue())["traceEvents"]
+    assert [event["name"] for event in events] == ["outer", "inner"]
+    assert events[0]["ph"] == "X"
+    assert events[0]["args"]["table"] == "features.a"
+    assert events[0]["args"]["rows_processed"] == 3
+
+
+def test_spans_over(db_engine_with_results_schema):
+    experiment_run = TriageRunFactory()
+    factory_session.commit()
+    with recording_run(experiment_run.run_id, db_engine_with_results_schema):
+        for table_name, rows in spans_over("table_task", {"a": 1, "b": 2}.items(), "table"):
+            assert table_name in ("a", "b")
+    flush_progress()
+
+    with scoped_session(db_engine_with_results_schema) as session:
+        assert sorted(
+            run_span.attributes["table"]
+            for run_span in session.query(TriageRunSpan).filter_by(
+                run_id=experiment_run.run_id, name="table_task"
+            )
+        ) == ["a", "b"]
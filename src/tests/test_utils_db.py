@@ -0,0 +1,112 @@
+import pickle
+
+import pytest
+import testing.postgresql
+
+from triage import create_engine
+from triage.component.catwalk.db import ensure_db
+from triage.component.results_schema import QueryStats, SlowQuery
+from triage.experiments.multicore import WorkerPool, parallelize
+from triage.util.db import scoped_session, statement_fingerprint
+
+
+def test_statement_fingerprint_ignores_literals():
+    assert statement_fingerprint(
+        "insert into features.a select * from events where d = '2016-01-01' and id in (1, 2)"
+    ) == statement_fingerprint(
+        "insert into features.a  select * from events\n where d = '2017-01-01' and id in (3)"
+    )
+    assert statement_fingerprint(
+        "select * from features.a where id = 1"
+    ) != statement_fingerprint(
+        "select * from features.b where id = 1"
+    )
+
+
+@pytest.fixture(name="instrumented_engine")
+def fixture_instrumented_engine():
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url(), slow_query_threshold=0.1)
+        ensure_db(engine)
+        yield engine
+        engine.dispose()
+
+
+def test_query_instrumentation(instrumented_engine):
+    instrumented_engine.execute("create table events (entity_id int)")
+    for entity_id in range(3):
+        instrumented_engine.execute(f"insert into events values ({entity_id})")
+    with instrumented_engine.begin() as conn:
+        conn.execute(
+            "insert into events select 100 from (select pg_sleep(0.2)) sleep"
+        )
+    instrumented_engine.query_instrumentation.flush()
+
+    with scoped_session(instrumented_engine) as session:
+        inserts = (
+            session.query(QueryStats)
+            .filter_by(fingerprint=statement_fingerprint("insert into events values (0)"))
+            .one()
+        )
+        assert inserts.calls == 3
+        assert inserts.rows == 3
+        assert inserts.component == f"{__name__}.test_query_instrumentation"
+
+        slow_query = session.query(SlowQuery).one()
+        assert slow_query.duration >= 0.2
+        assert slow_query.rows == 1
+        assert slow_query.query_plan[0]["Plan"]["Node Type"] == "ModifyTable"
+        # plain EXPLAIN does not run the statement again
+        assert "Actual Rows" not in slow_query.query_plan[0]["Plan"]
+
+    # the explained insert was rolled back
+    assert instrumented_engine.execute(
+        "select count(*) from events where entity_id = 100"
+    ).scalar() == 1
+
+
+def test_query_instrumentation_explain_analyze():
+    with testing.postgresql.Postgresql() as postgresql:
+        engine = create_engine(postgresql.url(), slow_query_threshold=0.1, explain_analyze=True)
+        ensure_db(engine)
+        engine.execute("create table events (entity_id int)")
+        with engine.begin() as conn:
+            conn.execute(
+                "insert into events select 100 from (select pg_sleep(0.2)) sleep"
+            )
+
+        with scoped_session(engine) as session:
+            slow_query = session.query(SlowQuery).one()
+            assert slow_query.query_plan[0]["Plan"]["Actual Rows"] == 1
+
+        # the explained insert was rolled back
+        assert engine.execute(
+            "select count(*) from events where entity_id = 100"
+        ).scalar() == 1
+        engine.dispose()
+
+
+def count_events(db_engine):
+    return db_engine.execute("select count(*) from events").scalar()
+
+
+def test_query_instrumentation_flushed_by_workers(instrumented_engine):
+    instrumented_engine.execute("create table events (entity_id int)")
+    with WorkerPool(1) as pool:
+        parallelize(count_events, [instrumented_engine] * 2, n_processes=1, pool=pool)
+
+        # stored at the end of each task, long before the worker exits or the
+        # periodic flush is due
+        with scoped_session(instrumented_engine) as session:
+            counts = (
+                session.query(QueryStats)
+                .filter_by(fingerprint=statement_fingerprint("select count(*) from events"))
+                .all()
+            )
+            assert sum(count.calls for count in counts) == 2
+            assert all(count.pid in pool.worker_pids for count in counts)
+
+
+def test_query_instrumentation_survives_pickling(instrumented_engine):
+    reconstructed_engine = pickle.loads(pickle.dumps(instrumented_engine))
+    assert reconstructed_engine.query_instrumentation.slow_query_threshold == 0.1
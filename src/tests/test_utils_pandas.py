@@ -1,4 +1,7 @@
-from triage.util.pandas import downcast_matrix
+import numpy as np
+import pandas as pd
+
+from triage.util.pandas import compact_dtype, downcast_matrix, is_sparse_matrix, to_sparse_matrix
 from triage.component.catwalk.storage import MatrixStore
 from .utils import matrix_creator
 
@@ -12,3 +15,61 @@ def test_downcast_matrix():
 
     # make sure the memory usage is lower because there would be no point of this otherwise
     assert downcasted_df.memory_usage().sum() < df.memory_usage().sum()
+
+
+def test_compact_dtype():
+    assert compact_dtype(np.array([0.0, 1.0, 1.0])) == np.uint8
+    assert compact_dtype(np.array([True, False])) == np.uint8
+    assert compact_dtype(np.array([0.0, 3.0, 120.0])) == np.int8
+    assert compact_dtype(np.array([-1, 300])) == np.int16
+    assert compact_dtype(np.array([0, 2 ** 20])) == np.int32
+    assert compact_dtype(np.array([0.0, 2.0 ** 40])) == np.float32
+    assert compact_dtype(np.array([0.0, 1.5])) == np.float32
+    assert compact_dtype(np.array([0.0, np.nan])) == np.float32
+    assert compact_dtype(np.array([], dtype=float)) == np.float32
+
+
+def test_downcast_matrix_compacts_columns():
+    df = pd.DataFrame({
+        "flag": [0.0, 1.0, 0.0],
+        "count": [2, 0, 40],
+        "continuous": [0.5, 0.0, 1.5],
+        "label": [1.0, np.nan, 0.0],
+    })
+    downcasted_df = downcast_matrix(df)
+    assert downcasted_df.dtypes.to_dict() == {
+        "flag": np.uint8,
+        "count": np.int8,
+        "continuous": np.float32,
+        "label": np.float32,
+    }
+    pd.testing.assert_frame_equal(downcasted_df, df, check_dtype=False)
+
+
+def test_downcast_matrix_keeps_sparse_columns():
+    df = pd.DataFrame({
+        "dense": [0.5, 0.0, 1.5],
+        "sparse": pd.arrays.SparseArray([0.0, 0.0, 1.5], fill_value=0.0),
+        "sparse_flag": pd.arrays.SparseArray([0.0, 0.0, 1.0], fill_value=0.0),
+    })
+    downcasted_df = downcast_matrix(df)
+    assert downcasted_df.dtypes["dense"] == np.float32
+    assert downcasted_df.dtypes["sparse"] == pd.SparseDtype(np.float32, 0.0)
+    assert downcasted_df.dtypes["sparse_flag"] == pd.SparseDtype(np.uint8, 0)
+
+
+def test_to_sparse_matrix():
+    df = pd.DataFrame({
+        "dense": [0.5, 0.0, 1.5],
+        "sparse": pd.arrays.SparseArray([0.0, 0.0, 1.0], fill_value=0.0),
+        "nan_filled": pd.arrays.SparseArray([np.nan, 3.0, np.nan]),
+    })
+    assert is_sparse_matrix(df)
+    assert not is_sparse_matrix(df[["dense"]])
+
+    sparse_matrix = to_sparse_matrix(df, sparse_format="csc")
+    assert sparse_matrix.format == "csc"
+    np.testing.assert_array_equal(
+        sparse_matrix.toarray(),
+        [[0.5, 0.0, np.nan], [0.0, 0.0, 3.0], [1.5, 1.0, np.nan]],
+    )
@@ -24,13 +24,24 @@ from triage.component.results_schema import (
 )
 from triage.component.postmodeling.crosstabs import CrosstabsConfigLoader, run_crosstabs
 from triage.component.timechop.plotting import visualize_chops
-from triage.component.catwalk.storage import CSVMatrixStore, Store, ProjectStorage
+from triage.component.catwalk.storage import (
+    DEFAULT_LOCAL_CACHE_SIZE,
+    DEFAULT_MODEL_COMPRESSION,
+    DEFAULT_S3_MAX_CONCURRENCY,
+    DEFAULT_S3_PART_SIZE,
+    CSVMatrixStore,
+    SparseMatrixStore,
+    Store,
+    ProjectStorage,
+)
 from triage.experiments import (
     CONFIG_VERSION,
     MultiCoreExperiment,
     SingleThreadedExperiment,
 )
+from triage.experiments.multicore import DEFAULT_MAX_TASKS_PER_WORKER
 from triage.predictlist import predict_forward_with_existed_model, Retrainer
+from triage.tracking import export_chrome_trace
 from triage.component.postmodeling.crosstabs import CrosstabsConfigLoader, run_crosstabs
 from triage.component.postmodeling.utils.add_predictions import add_predictions
 from triage.util.conf import load_query_if_needed
@@ -169,6 +180,7 @@ class Experiment(Command):
 
     matrix_storage_map = {
         "csv": CSVMatrixStore,
+        "sparse": SparseMatrixStore,
     }
     matrix_storage_default = "csv"
 
@@ -197,6 +209,24 @@ class Experiment(Command):
             default=1,
             help="number of cores to use for big, computationally-intensive classifiers (e.g. Random Forests)",
         )
+        parser.add_argument(
+            "--max-tasks-per-worker",
+            type=int,
+            default=DEFAULT_MAX_TASKS_PER_WORKER,
+            help="number of tasks a worker process runs before it is replaced, 0 to never replace "
+            f"them (multi core mode only) [default: {DEFAULT_MAX_TASKS_PER_WORKER}]",
+        )
+        parser.add_argument(
+            "--max-worker-rss",
+            type=natural_number,
+            help="peak memory in bytes over which worker processes are replaced (multi core mode only)",
+        )
+        parser.add_argument(
+            "--memory-budget",
+            type=natural_number,
+            help="memory in bytes that training may use; train/test tasks then start when their "
+            "estimated memory fits, in place of the --n-bigtrain-processes limit (multi core mode only)",
+        )
         parser.add_argument(
             "--add-bigtrain-classes",
             nargs="*",
@@ -208,6 +238,42 @@ class Experiment(Command):
             default=self.matrix_storage_default,
             help=f"The matrix storage format to use. [default: {self.matrix_storage_default}]",
         )
+        parser.add_argument(
+            "--model-compression",
+            default=DEFAULT_MODEL_COMPRESSION,
+            help="How to compress stored models: 'none', or a joblib codec with an optional "
+            f"level like 'lz4:1' [default: {DEFAULT_MODEL_COMPRESSION}]",
+        )
+        parser.add_argument(
+            "--mmap-models",
+            action="store_true",
+            help="Memory map the arrays of models stored uncompressed on the local "
+            "filesystem instead of reading them into memory when loading them",
+        )
+        parser.add_argument(
+            "--local-cache-directory",
+            help="A local directory in which to keep copies of the matrices and models "
+            "read from an S3 project path, so they are only downloaded once",
+        )
+        parser.add_argument(
+            "--local-cache-size",
+            type=natural_number,
+            default=DEFAULT_LOCAL_CACHE_SIZE,
+            help=f"bytes the local copies may take up [default: {DEFAULT_LOCAL_CACHE_SIZE}]",
+        )
+        parser.add_argument(
+            "--s3-part-size",
+            type=natural_number,
+            default=DEFAULT_S3_PART_SIZE,
+            help="bytes in each part of the matrices and models uploaded to and downloaded "
+            f"from an S3 project path [default: {DEFAULT_S3_PART_SIZE}]",
+        )
+        parser.add_argument(
+            "--s3-max-concurrency",
+            type=natural_number,
+            default=DEFAULT_S3_MAX_CONCURRENCY,
+            help=f"number of parts to transfer to or from S3 at once [default: {DEFAULT_S3_MAX_CONCURRENCY}]",
+        )
         parser.add_argument("--replace", dest="replace", action="store_true")
         parser.add_argument(
             "-v",
@@ -232,6 +298,24 @@ class Experiment(Command):
             dest="profile",
             help="Record the time spent in various functions using cProfile",
         )
+        parser.add_argument(
+            "--instrument-queries",
+            action="store_true",
+            help="Record how long each kind of SQL statement takes, "
+            "in triage_metadata.query_stats",
+        )
+        parser.add_argument(
+            "--slow-query-threshold",
+            type=float,
+            help="Capture the EXPLAIN plan of SQL statements taking "
+            "longer than this many seconds, in triage_metadata.slow_queries",
+        )
+        parser.add_argument(
+            "--explain-analyze",
+            action="store_true",
+            help="Capture slow statements' plans with EXPLAIN (ANALYZE, BUFFERS), "
+            "which runs each of them a second time",
+        )
 
         parser.add_argument(
             "--no-materialize-fromobjs",
@@ -266,6 +350,24 @@ class Experiment(Command):
             + "features across different cohorts",
         )
 
+        parser.add_argument(
+            "--create-fromobj-indexes",
+            action="store_true",
+            default=False,
+            dest="create_fromobj_indexes",
+            help="Index (and analyze) any feature 'from obj' table that has no index "
+            + "usable by the feature queries before building features",
+        )
+
+        parser.add_argument(
+            "--pipeline",
+            action="store_true",
+            default=False,
+            dest="pipeline",
+            help="Start training models as soon as their train and test matrices "
+            + "are built, instead of after all matrices are built",
+        )
+
         parser.add_argument(
             "--show-timechop",
             action="store_true",
@@ -286,7 +388,12 @@ class Experiment(Command):
         self.root.setup()  # Loading configuration (if exists)
         db_url = self.root.db_url
         config = self._load_config()
-        db_engine = create_engine(db_url)
+        db_engine = create_engine(
+            db_url,
+            instrument_queries=self.args.instrument_queries,
+            slow_query_threshold=self.args.slow_query_threshold,
+            explain_analyze=self.args.explain_analyze,
+        )
         common_kwargs = {
             "db_engine": db_engine,
             "project_path": self.args.project_path,
@@ -294,11 +401,19 @@ class Experiment(Command):
             "replace": self.args.replace,
             "materialize_subquery_fromobjs": self.args.materialize_fromobjs,
             "features_ignore_cohort": self.args.features_ignore_cohort,
+            "create_fromobj_indexes": self.args.create_fromobj_indexes,
+            "pipeline": self.args.pipeline,
             "matrix_storage_class": self.matrix_storage_map[self.args.matrix_format],
             "profile": self.args.profile,
             "save_predictions": self.args.save_predictions,
             "skip_validation": not self.args.validate,
             "additional_bigtrain_classnames": self.args.add_bigtrain_classes,
+            "model_compression": self.args.model_compression,
+            "mmap_models": self.args.mmap_models,
+            "local_cache_directory": self.args.local_cache_directory,
+            "local_cache_size": self.args.local_cache_size,
+            "s3_part_size": self.args.s3_part_size,
+            "s3_max_concurrency": self.args.s3_max_concurrency,
         }
         logger.info(f"Setting up the experiment")
         logger.info(f"Configuration file: {self.args.config}")
@@ -314,6 +429,9 @@ class Experiment(Command):
                     n_db_processes=self.args.n_db_processes,
                     n_processes=self.args.n_processes,
                     n_bigtrain_processes=self.args.n_bigtrain_processes,
+                    max_tasks_per_worker=self.args.max_tasks_per_worker,
+                    max_worker_rss=self.args.max_worker_rss,
+                    memory_budget=self.args.memory_budget,
                     **common_kwargs,
                 )
                 logger.info(
@@ -606,6 +724,31 @@ class Db(Command):
             logger.info(self.local["docker"]["start", "triage_db"])
 
 
+@Triage.register
+class Trace(Command):
+    """Export the timed stages and tasks of a run as a Chrome trace"""
+
+    def __init__(self, parser):
+        parser.add_argument(
+            "run_id",
+            type=natural_number,
+            help="id of the run (in triage_metadata.triage_runs) to export",
+        )
+        parser.add_argument(
+            "-o",
+            "--output",
+            type=argparse.FileType("w"),
+            default="-",
+            help="file to write the trace JSON to, to open in chrome://tracing "
+            "or https://ui.perfetto.dev (default: standard output)",
+        )
+
+    def __call__(self, args):
+        db_engine = create_engine(self.root.db_url)
+        with args.output:
+            export_chrome_trace(args.run_id, db_engine, args.output)
+
+
 @Triage.register
 class AddPredictions(Command):
     """Save test predictions of selected model groups"""
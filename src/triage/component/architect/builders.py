@@ -7,9 +7,10 @@ import pandas as pd
 
 from sqlalchemy.orm import sessionmaker
 
+from triage.component.catwalk.utils import matrix_data_fingerprint
 from triage.component.results_schema import Matrix
 from triage.database_reflection import table_has_data
-from triage.tracking import built_matrix, skipped_matrix, errored_matrix
+from triage.tracking import built_matrix, skipped_matrix, errored_matrix, span
 from triage.util.pandas import downcast_matrix
 
 
@@ -224,6 +225,30 @@ class MatrixBuilder(BuilderBase):
         :return: none
         :rtype: none
         """
+        with span("build_matrix", matrix_uuid=matrix_uuid, matrix_type=matrix_type) as build_span:
+            self._build_matrix(
+                as_of_times,
+                label_name,
+                label_type,
+                feature_dictionary,
+                matrix_metadata,
+                matrix_uuid,
+                matrix_type,
+                build_span,
+            )
+
+    def _build_matrix(
+        self,
+        as_of_times,
+        label_name,
+        label_type,
+        feature_dictionary,
+        matrix_metadata,
+        matrix_uuid,
+        matrix_type,
+        build_span,
+    ):
+        """Build the matrix as build_matrix describes, counting its rows on build_span"""
         logger.spam(f"popped matrix {matrix_uuid} build off the queue")
         if not table_has_data(
             self.db_config["cohort_table_name"], self.db_engine
@@ -298,17 +323,27 @@ class MatrixBuilder(BuilderBase):
             labels_df = pd.DataFrame(index=dataframes[0].index, columns=[label_name])
             dataframes.insert(0, labels_df)
 
-        # stitch together the csvs
-        logger.spam(f"Merging feature files for matrix {matrix_uuid}")
-        output = self.merge_feature_csvs(dataframes, matrix_uuid)
-        logger.debug(f"Features data merged for matrix {matrix_uuid}")
+        # line up the feature and label data, without merging them into one copy
+        logger.spam(f"Aligning feature data for matrix {matrix_uuid}")
+        feature_blocks, labels = self.align_feature_dataframes(dataframes, matrix_uuid)
+        logger.debug(f"Features data aligned for matrix {matrix_uuid}")
 
+        build_span.add_rows(len(labels))
         matrix_store.metadata = matrix_metadata
-        # store the matrix
-        labels = output.pop(matrix_store.label_column_name)
-        matrix_store.matrix_label_tuple = output, labels
-        matrix_store.save()
-        logger.info(f"Matrix {matrix_uuid} saved in {matrix_store.matrix_base_store.path}")
+        data_fingerprint = matrix_data_fingerprint(
+            feature_blocks, labels.rename(matrix_store.label_column_name)
+        )
+        identical_store = self.find_identical_matrix(data_fingerprint, matrix_uuid)
+        # store the matrix, or point at an identical one that is already stored
+        if identical_store is not None:
+            matrix_store.link_from(identical_store)
+            logger.info(
+                f"Matrix {matrix_uuid} has the same data as {identical_store.uuid}, "
+                f"linked in {matrix_store.matrix_base_store.path}"
+            )
+        else:
+            matrix_store.save_blocks(feature_blocks, labels)
+            logger.info(f"Matrix {matrix_uuid} saved in {matrix_store.matrix_base_store.path}")
         # If completely archived, save its information to matrices table
         # At this point, existence of matrix already tested, so no need to delete from db
         if matrix_type == "train":
@@ -321,12 +356,13 @@ class MatrixBuilder(BuilderBase):
             matrix_uuid=matrix_uuid,
             matrix_type=matrix_type,
             labeling_window=matrix_metadata["label_timespan"],
-            num_observations=len(output),
+            num_observations=len(labels),
             lookback_duration=lookback,
             feature_start_time=matrix_metadata["feature_start_time"],
             feature_dictionary=feature_dictionary,
             matrix_metadata=matrix_metadata,
-            built_by_experiment=self.experiment_hash
+            built_by_experiment=self.experiment_hash,
+            data_fingerprint=data_fingerprint,
         )
         session = self.sessionmaker()
         session.merge(matrix)
@@ -336,6 +372,34 @@ class MatrixBuilder(BuilderBase):
             built_matrix(self.run_id, self.db_engine)
 
 
+    def find_identical_matrix(self, data_fingerprint, matrix_uuid):
+        """Find an already stored matrix with the same data as the one being built
+
+        :param data_fingerprint: the fingerprint of the matrix's data
+        :param matrix_uuid: the uuid of the matrix being built, which is not a match
+        :type data_fingerprint: str
+        :type matrix_uuid: str
+
+        :return: the store of a matrix with identical data, in this builder's
+            storage format, or None if there is none
+        :rtype: triage.component.catwalk.storage.MatrixStore
+        """
+        session = self.sessionmaker()
+        candidate_uuids = [
+            row.matrix_uuid
+            for row in session.query(Matrix.matrix_uuid).filter(
+                Matrix.data_fingerprint == data_fingerprint,
+                Matrix.matrix_uuid != matrix_uuid,
+            )
+        ]
+        session.close()
+        for candidate_uuid in candidate_uuids:
+            candidate_store = self.matrix_storage_engine.get_store(candidate_uuid)
+            # the matrix may since have been deleted, or stored in another format
+            if candidate_store.matrix_base_store.exists():
+                return candidate_store
+        return None
+
     def load_labels_data(
         self,
         label_name,
@@ -472,6 +536,46 @@ class MatrixBuilder(BuilderBase):
         :raises: ValueError if the first two columns in every CSV don't match
         """
 
+        self.check_feature_dataframes(dataframes)
+        big_df = dataframes[1].join(dataframes[2:] + [dataframes[0]])
+        return big_df
+
+    def align_feature_dataframes(self, dataframes, matrix_uuid):
+        """Line up the feature dataframes and labels on one index, without joining them
+
+        Takes the same dataframes, with the same assumptions, as merge_feature_csvs, but
+        returns the feature dataframes and the labels separately so that matrix stores can
+        write them without first building a merged copy. The rows of the first feature
+        dataframe decide the order; the others are only reindexed if their rows differ.
+
+        :param dataframes: the label dataframe, then the feature dataframes
+        :param matrix_uuid: a unique id for the matrix
+        :type dataframes: list
+        :type matrix_uuid: str
+
+        :return: the feature dataframes and the label series
+        :rtype: tuple
+
+        :raises: ValueError if the dataframes are not indexed by entity_id and as_of_date,
+            or a feature has nulls
+        """
+        self.check_feature_dataframes(dataframes)
+        index = dataframes[1].index
+        feature_blocks = [
+            df if df.index.equals(index) else df.reindex(index)
+            for df in dataframes[1:]
+        ]
+        labels_df = dataframes[0]
+        if not labels_df.index.equals(index):
+            labels_df = labels_df.reindex(index)
+        return feature_blocks, labels_df.iloc[:, 0]
+
+    def check_feature_dataframes(self, dataframes):
+        """Check that the label and feature dataframes are indexed by entity_id and
+        as_of_date, and that no feature has nulls
+
+        :raises: ValueError if not
+        """
         for i, df in enumerate(dataframes):
             if df.index.names != ["entity_id", "as_of_date"]:
                 raise ValueError(
@@ -488,6 +592,3 @@ class MatrixBuilder(BuilderBase):
                         "Imputation failed for the following features: {columns_with_nulls}"
                     )
             i += 1
-
-        big_df = dataframes[1].join(dataframes[2:] + [dataframes[0]])
-        return big_df
@@ -1,10 +1,12 @@
 import verboselogs
 
+from triage.component.catwalk.utils import Batch
 from triage.database_reflection import table_has_data, table_row_count, table_exists, table_has_duplicates
 
 
 logger = verboselogs.VerboseLogger(__name__)
 DEFAULT_ACTIVE_STATE = "active"
+DEFAULT_DATE_BATCH_SIZE = 10
 
 
 class EntityDateTableGenerator:
@@ -22,16 +24,21 @@ class EntityDateTableGenerator:
         query (string) SQL query string to select entities for a given as_of_date
             The as_of_date should be parameterized with brackets: {as_of_date}
         replace (boolean) Whether or not to overwrite old rows.
-            If false, each as-of-date will query to see if there are existing rows
-                and not run the query if so.
+            If false, as-of-dates with existing rows are found with a single query
+                and the query is not run for them.
             If true, the existing table will be dropped and recreated.
+        batch_size (int) How many as-of-dates to run the query for in each
+            insert statement
     """
-    def __init__(self, query, db_engine, entity_date_table_name, labels_table_name=None, replace=True):
+    def __init__(self, query, db_engine, entity_date_table_name, labels_table_name=None, replace=True, batch_size=DEFAULT_DATE_BATCH_SIZE):
+        if batch_size < 1:
+            raise ValueError("batch_size must be 1 or greater")
         self.db_engine = db_engine
         self.query = query
         self.entity_date_table_name = entity_date_table_name
         self.labels_table_name = labels_table_name
         self.replace = replace
+        self.batch_size = batch_size
 
     def generate_entity_date_table(self, as_of_dates):
         """Convert the object's input table
@@ -51,6 +58,17 @@ class EntityDateTableGenerator:
             raise ValueError("Neither query not labels table name is available, cannot compute cohort")
         logger.spam(f"Table {self.entity_date_table_name} created and populated")
 
+        self.check_entity_date_table(as_of_dates)
+
+    def check_entity_date_table(self, as_of_dates):
+        """Check that a freshly populated entity_date table is non-empty and duplicate-free
+
+        Args:
+            as_of_dates (list of datetime.dates) Dates the table was populated
+                for, only used to build the error message
+
+        Raises: ValueError if the table is empty or contains duplicate entity-dates
+        """
         if not table_has_data(self.entity_date_table_name, self.db_engine):
             raise ValueError(self._empty_table_message(as_of_dates))
 
@@ -65,73 +83,168 @@ class EntityDateTableGenerator:
         logger.spam(f"Generating stats on {self.entity_date_table_name}")
         logger.spam(f"Row count of {self.entity_date_table_name}: {table_row_count(self.entity_date_table_name, self.db_engine)}")
 
+    def generate_entity_date_table_tasks(self, as_of_dates):
+        """Generates SQL commands for creating, populating, and indexing
+        the entity_date table
+
+        When a query is present, each insert command runs it for up to
+        `batch_size` as-of-dates, so the commands can either be run in order
+        or have their inserts spread across database processes.
+
+        Args:
+            as_of_dates (list of datetime.dates) Dates to include in the
+                state table
+
+        Returns: (dict) keyed on the entity_date table name, with a dict value
+            having keys for the different stages of table creation
+            (prepare, inserts, finalize) and values being lists of SQL commands
+        """
+        prepare, finalize = self._maybe_create_entity_date_table_commands()
+        if self.query:
+            if prepare:
+                # the table is about to be (re)created, so no dates are populated yet
+                missing_dates = list(as_of_dates)
+            else:
+                missing_dates = self.missing_as_of_dates(as_of_dates)
+            inserts = [
+                self._insert_query_for_dates(list(date_batch))
+                for date_batch in Batch(missing_dates, self.batch_size)
+            ]
+        elif self.labels_table_name:
+            inserts = self._inserts_from_labels(table_is_new=bool(prepare))
+        else:
+            raise ValueError("Neither query not labels table name is available, cannot compute cohort")
+
+        return {
+            self.entity_date_table_name: {
+                "prepare": prepare,
+                "inserts": inserts,
+                "finalize": finalize,
+            }
+        }
+
+    def run_commands(self, command_list):
+        with self.db_engine.begin() as conn:
+            for command in command_list:
+                logger.spam(f"Executing entity_date query: {command}")
+                conn.execute(command)
 
-    def _maybe_create_entity_date_table(self):
+    def _maybe_create_entity_date_table_commands(self):
+        """Commands to (re)create the entity_date table and to index it once populated
+
+        Returns: (tuple) of prepare and finalize command lists, both empty
+            if the existing table is kept
+        """
         if self.replace or not table_exists(self.entity_date_table_name, self.db_engine):
             logger.spam(f"Creating entity_date table {self.entity_date_table_name}")
-            self.db_engine.execute(f"drop table if exists {self.entity_date_table_name}")
-            self.db_engine.execute(
-                f"""create table {self.entity_date_table_name} (
-                    entity_id integer,
-                    as_of_date timestamp,
-                    {DEFAULT_ACTIVE_STATE} boolean
-                )
-                """
+            return (
+                [
+                    f"drop table if exists {self.entity_date_table_name}",
+                    f"""create table {self.entity_date_table_name} (
+                        entity_id integer,
+                        as_of_date timestamp,
+                        {DEFAULT_ACTIVE_STATE} boolean
+                    )
+                    """,
+                ],
+                [f"create index on {self.entity_date_table_name} (entity_id, as_of_date)"],
             )
+        logger.notice(
+            f"Not dropping and recreating entity_date {self.entity_date_table_name} table because "
+            f"replace flag was set to False and table was found to exist"
+        )
+        return [], []
+
+    def missing_as_of_dates(self, as_of_dates):
+        """Find the as-of-dates that have no rows in the entity_date table
+
+        Uses a single anti-join between the requested dates and the table,
+        instead of probing the table once per date.
+
+        Args:
+            as_of_dates (list of datetime.date) Dates to look for
+
+        Returns: (list) of the given as-of-dates without any rows, in their given order
+        """
+        as_of_dates = list(as_of_dates)
+        if not as_of_dates or not table_exists(self.entity_date_table_name, self.db_engine):
+            return as_of_dates
 
-            logger.spam(f"Creating indices on entity_id and as_of_date for entity_date table {self.entity_date_table_name}")
-            self.db_engine.execute(
-                f"create index on {self.entity_date_table_name} (entity_id, as_of_date)"
+        logger.spam(f"Looking for existing entity_date rows for {len(as_of_dates)} as of dates")
+        requested = ",\n".join(
+            f"({date_num}, '{as_of_date.isoformat()}'::timestamp)"
+            for date_num, as_of_date in enumerate(as_of_dates)
+        )
+        missing_dates = [
+            as_of_dates[row[0]]
+            for row in self.db_engine.execute(
+                f"""select requested.date_num
+                from (values {requested}) as requested (date_num, as_of_date)
+                where not exists (
+                    select 1 from {self.entity_date_table_name} as existing
+                    where existing.as_of_date = requested.as_of_date
+                )
+                order by requested.date_num
+                """
             )
-        else:
+        ]
+        if len(missing_dates) < len(as_of_dates):
             logger.notice(
-                f"Not dropping and recreating entity_date {self.entity_date_table_name} table because "
-                f"replace flag was set to False and table was found to exist"
+                f"Since >0 entity_date rows found for {len(as_of_dates) - len(missing_dates)} "
+                f"of {len(as_of_dates)} as of dates, skipping them"
             )
+        return missing_dates
+
+    def _insert_query_for_dates(self, as_of_dates):
+        selects = "\n            union all\n".join(
+            f"""select q.entity_id, '{as_of_date.isoformat()}'::timestamp, true
+                from ({self.query.format(as_of_date=as_of_date.isoformat())}) q
+                group by 1, 2, 3"""
+            for as_of_date in as_of_dates
+        )
+        return f"""insert into {self.entity_date_table_name}
+            {selects}
+            """
 
     def _create_and_populate_entity_date_table_from_query(self, as_of_dates):
-        """Create an entity_date table by sequentially running a
-            given date-parameterized query for all known dates.
+        """Create an entity_date table by running a given date-parameterized
+            query for all known dates, `batch_size` dates per statement.
 
         Args:
         as_of_dates (list of datetime.date): Dates to calculate entity states as of
         """
-        self._maybe_create_entity_date_table()
+        task = self.generate_entity_date_table_tasks(as_of_dates)[self.entity_date_table_name]
+        self.run_commands(task["prepare"])
         logger.spam(f"Inserting rows into entity_date table {self.entity_date_table_name}")
-        for as_of_date in as_of_dates:
-            formatted_date = f"{as_of_date.isoformat()}"
-            logger.spam(f"Looking for existing entity_date rows for as of date {as_of_date}")
-            any_existing = list(self.db_engine.execute(
-                f"""select 1 from {self.entity_date_table_name}
-                where as_of_date = '{formatted_date}'
-                limit 1
-                """
-            ))
-            if len(any_existing) == 1:
-                logger.notice(f"Since >0 entity_date rows found for date {as_of_date}, skipping")
-                continue
-            dated_query = self.query.format(as_of_date=formatted_date)
-            full_query = f"""insert into {self.entity_date_table_name}
-                select q.entity_id, '{formatted_date}'::timestamp, true
-                from ({dated_query}) q
-                group by 1, 2, 3
-            """
-            logger.spam(f"Running entity_date query for date: {as_of_date}, {full_query}")
-            self.db_engine.execute(full_query)
+        for insert in task["inserts"]:
+            self.run_commands([insert])
+        self.run_commands(task["finalize"])
 
-    def _create_and_populate_entity_date_table_from_labels(self):
-        """Create an entity_date table by storing all distinct entity-id/as-of-date pairs
+    def _inserts_from_labels(self, table_is_new):
+        """Insert commands storing all distinct entity-id/as-of-date pairs
         from the labels table
+
+        Args:
+            table_is_new (bool) Whether the entity_date table is about to be
+                (re)created, in which case there are no existing rows to look for
         """
-        self._maybe_create_entity_date_table()
         logger.spam(f"Populating entity_date table {self.entity_date_table_name} from labels table {self.labels_table_name}")
         if not table_exists(self.labels_table_name, self.db_engine):
             logger.warning("Labels table does not exist, cannot populate entity-dates")
-            return
+            return []
+
+        if table_is_new:
+            return [
+                f"""
+                insert into {self.entity_date_table_name}
+                select distinct entity_id, as_of_date, true
+                from {self.labels_table_name}
+                """
+            ]
 
         # If any rows exist in the entity_date table, don't insert any for dates
         # already in the table. This replicates the logic used above by
-        # _create_and_populate_entity_date_table_from_query
+        # missing_as_of_dates
         logger.spam(f"Looking for existing entity_date rows for label as of dates")
         existing_dates = list(self.db_engine.execute(
             f"""
@@ -151,7 +264,8 @@ class EntityDateTableGenerator:
             logger.notice(f'Existing entity_dates records found for the following dates, '
                 f'so new records will not be inserted for these dates {existing_dates}')
 
-        insert_query = f"""
+        return [
+            f"""
             insert into {self.entity_date_table_name}
             select distinct entity_id, as_of_date, true
             from (
@@ -161,9 +275,18 @@ class EntityDateTableGenerator:
                     on l.as_of_date::DATE = c.as_of_date::DATE
                 where c.as_of_date IS NULL
             ) as sub
+            """
+        ]
+
+    def _create_and_populate_entity_date_table_from_labels(self):
+        """Create an entity_date table by storing all distinct entity-id/as-of-date pairs
+        from the labels table
         """
-        logger.spam(f"Running entity_date query from labels table: {insert_query}")
-        self.db_engine.execute(insert_query)
+        task = self.generate_entity_date_table_tasks([])[self.entity_date_table_name]
+        self.run_commands(task["prepare"])
+        logger.spam(f"Running entity_date query from labels table: {task['inserts']}")
+        self.run_commands(task["inserts"])
+        self.run_commands(task["finalize"])
 
     def _empty_table_message(self, as_of_dates):
         return """Query does not return any rows for the given as_of_dates:
@@ -192,6 +315,15 @@ class CohortTableGeneratorNoOp(EntityDateTableGenerator):
         )
         return
 
+    def generate_entity_date_table_tasks(self, as_of_dates):
+        logger.warning(
+            "No cohort configuration is available, so no cohort will be created"
+        )
+        return {}
+
+    def check_entity_date_table(self, as_of_dates):
+        return
+
     def clean_up(self):
         logger.warning("No cohort configuration is available, so no cohort will be tear down")
         return
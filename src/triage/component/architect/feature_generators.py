@@ -8,13 +8,15 @@ import sqlparse
 
 from triage.util.conf import convert_str_to_relativedelta
 from triage.database_reflection import table_exists
+from triage.tracking import span
 
 from triage.component.collate import (
     Aggregate,
     Categorical,
     Compare,
     SpacetimeAggregation,
-    FromObj
+    FromObj,
+    IndexAdvisor
 )
 
 class FeatureGenerator:
@@ -26,6 +28,7 @@ class FeatureGenerator:
         feature_start_time=None,
         materialize_subquery_fromobjs=True,
         features_ignore_cohort=False,
+        create_fromobj_indexes=False,
     ):
         """Generates aggregate features using collate
 
@@ -40,6 +43,9 @@ class FeatureGenerator:
             features_ignore_cohort (boolean, optional) Whether or not features should be built
                 independently of the cohort. Takes longer but means that features can be reused
                 for different cohorts.
+            create_fromobj_indexes (boolean, optional) Whether or not to create an index
+                (and analyze the table) on each from_obj table found to lack one usable
+                by the feature queries. Either way, missing indexes are reported.
         """
         self.db_engine = db_engine
         self.features_schema_name = features_schema_name
@@ -48,6 +54,7 @@ class FeatureGenerator:
         self.feature_start_time = feature_start_time
         self.materialize_subquery_fromobjs = materialize_subquery_fromobjs
         self.features_ignore_cohort = features_ignore_cohort
+        self.index_advisor = IndexAdvisor(db_engine, create_missing=create_fromobj_indexes)
         self.entity_id_column = "entity_id"
         self.from_objs = {}
 
@@ -355,6 +362,7 @@ class FeatureGenerator:
             )
             from_obj.maybe_materialize(self.db_engine)
             aggregation.from_obj = from_obj.table
+        self.index_advisor.check(aggregation)
         return aggregation
 
     def generate_all_table_tasks(self, aggregations, task_type):
@@ -478,7 +486,8 @@ class FeatureGenerator:
 
     def process_table_tasks(self, table_tasks):
         for table_name, task in table_tasks.items():
-            self.process_table_task(task)
+            with span("table_task", table=table_name):
+                self.process_table_task(task)
         return table_tasks.keys()
 
     def _explain_selects(self, aggregations):
@@ -509,10 +518,16 @@ class FeatureGenerator:
             return True
 
     def run_commands(self, command_list):
-        with self.db_engine.begin() as conn:
-            for command in command_list:
-                logger.spam(f"Executing feature generation query: {command}")
-                conn.execute(command)
+        if not command_list:
+            return
+        with span("run_commands", statements=len(command_list)) as commands_span:
+            with self.db_engine.begin() as conn:
+                for command in command_list:
+                    logger.spam(f"Executing feature generation query: {command}")
+                    result = conn.execute(command)
+                    # -1 for statements without a row count, like CREATE TABLE
+                    if result.rowcount > 0:
+                        commands_span.add_rows(result.rowcount)
 
     def _aggregation_index_query(self, aggregation, imputed=False):
         return f"CREATE INDEX ON {aggregation.get_table_name(imputed=imputed)} ({self.entity_id_column}, {aggregation.output_date_column})"
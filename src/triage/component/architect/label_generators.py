@@ -1,10 +1,13 @@
 import verboselogs, logging
 logger = verboselogs.VerboseLogger(__name__)
 
+import itertools
 import textwrap
+from triage.component.catwalk.utils import Batch
 from triage.database_reflection import table_row_count, table_exists, table_has_duplicates
 
 DEFAULT_LABEL_NAME = "outcome"
+DEFAULT_LABEL_BATCH_SIZE = 10
 
 
 class LabelGeneratorNoOp:
@@ -13,6 +16,15 @@ class LabelGeneratorNoOp:
             "No label configuration is available, so no labels will be created"
         )
 
+    def generate_all_label_tasks(self, labels_table, as_of_dates, label_timespans):
+        logger.warning(
+            "No label configuration is available, so no labels will be created"
+        )
+        return {}
+
+    def check_labels_table(self, labels_table):
+        pass
+
     def generate(self, start_date, label_timespan, labels_table):
         logger.warning(
             "No label configuration is available, so no labels will be created"
@@ -23,18 +35,37 @@ class LabelGeneratorNoOp:
 
 
 class LabelGenerator:
-    def __init__(self, db_engine, query, label_name=None, replace=True):
+    """Generates a labels table by running a date-parameterized label query
+
+    Args:
+        db_engine (sqlalchemy.engine)
+        query (string) SQL query selecting entity ids and an outcome for each,
+            parameterized with brackets: {as_of_date} and {label_timespan}
+        label_name (string, optional) name stored in the label_name column
+        replace (boolean) Whether or not to overwrite an existing labels table.
+            If false, labels are only generated for (as of date, label timespan)
+                pairs not already found in the table
+        batch_size (int) How many (as of date, label timespan) pairs to
+            generate labels for in each insert statement
+    """
+    def __init__(self, db_engine, query, label_name=None, replace=True, batch_size=DEFAULT_LABEL_BATCH_SIZE):
+        if batch_size < 1:
+            raise ValueError("batch_size must be 1 or greater")
         self.db_engine = db_engine
         self.replace = replace
+        self.batch_size = batch_size
         # query is expected to select a number of entity ids
         # and an outcome for each given an as-of-date
         self.query = query
         self.label_name = label_name or DEFAULT_LABEL_NAME
 
     def _create_labels_table(self, labels_table_name):
+        self.run_commands(self._create_labels_table_commands(labels_table_name))
+
+    def _create_labels_table_commands(self, labels_table_name):
         if self.replace or not table_exists(labels_table_name, self.db_engine):
-            self.db_engine.execute(f"drop table if exists {labels_table_name}")
-            self.db_engine.execute(
+            return [
+                f"drop table if exists {labels_table_name}",
                 f"""
                 create table {labels_table_name} (
                 entity_id int,
@@ -43,45 +74,108 @@ class LabelGenerator:
                 label_name varchar,
                 label_type varchar,
                 label smallint
-                )"""
+                )""",
+            ]
+        logger.notice(f"Not dropping and recreating {labels_table_name} table because "
+                      f"replace flag was set to False and table was found to exist")
+        return []
+
+    def missing_label_pairs(self, labels_table, as_of_dates, label_timespans):
+        """Find the (as of date, label timespan) pairs without labels
+
+        Uses a single anti-join between the requested pairs and the labels
+        table, instead of probing the table once per pair.
+
+        Args:
+            labels_table (str) name of labels table
+            as_of_dates (list) as of dates
+            label_timespans (list) postgresql readable time intervals
+
+        Returns: (list) of (as_of_date, label_timespan) tuples, in the form
+            they were passed in
+        """
+        all_pairs = list(itertools.product(as_of_dates, label_timespans))
+        if self.replace or not all_pairs or not table_exists(labels_table, self.db_engine):
+            return all_pairs
+
+        requested = ",\n".join(
+            f"({pair_num}, '{as_of_date}'::date, '{label_timespan}'::interval)"
+            for pair_num, (as_of_date, label_timespan) in enumerate(all_pairs)
+        )
+        logger.spam(f"Looking for existing labels for {len(all_pairs)} as of date/label timespan pairs")
+        missing_pair_nums = self.db_engine.execute(
+            f"""select requested.pair_num
+            from (values {requested}) as requested (pair_num, as_of_date, label_timespan)
+            where not exists (
+                select 1 from {labels_table} as labels
+                where labels.as_of_date = requested.as_of_date
+                and labels.label_timespan = requested.label_timespan
+                and labels.label_name = '{self.label_name}'
             )
+            order by requested.pair_num
+            """
+        )
+        missing_pairs = [all_pairs[row[0]] for row in missing_pair_nums]
+        logger.spam(f"{len(all_pairs) - len(missing_pairs)} pairs already have labels, skipping them")
+        return missing_pairs
+
+    def generate_all_label_tasks(self, labels_table, as_of_dates, label_timespans):
+        """Generates SQL commands for creating, populating, and indexing
+        the labels table
+
+        Each insert command generates the labels for up to `batch_size`
+        (as of date, label timespan) pairs in a single statement, so the
+        commands can be run sequentially or spread across database processes.
+
+        Args:
+            labels_table (str) name of labels table
+            as_of_dates (list) as of dates
+            label_timespans (list) postgresql readable time intervals
+
+        Returns: (dict) keyed on the labels table name, with a dict value
+            having keys for the different stages of table creation
+            (prepare, inserts, finalize) and values being lists of SQL commands
+        """
+        prepare = self._create_labels_table_commands(labels_table)
+        if prepare:
+            # the table is about to be (re)created, so no labels exist yet
+            missing_pairs = list(itertools.product(as_of_dates, label_timespans))
         else:
-            logger.notice(f"Not dropping and recreating {labels_table_name} table because "
-                          f"replace flag was set to False and table was found to exist")
+            missing_pairs = self.missing_label_pairs(labels_table, as_of_dates, label_timespans)
+        logger.spam(f"Creating labels for {len(missing_pairs)} as of date/label timespan pairs")
+
+        return {
+            labels_table: {
+                "prepare": prepare,
+                "inserts": [
+                    self._insert_query(list(pair_batch), labels_table)
+                    for pair_batch in Batch(missing_pairs, self.batch_size)
+                ],
+                "finalize": [f"create index on {labels_table} (entity_id, as_of_date)"],
+            }
+        }
+
+    def run_commands(self, command_list):
+        with self.db_engine.begin() as conn:
+            for command in command_list:
+                logger.spam(f"Executing label generation query: {command}")
+                conn.execute(command)
 
     def generate_all_labels(self, labels_table, as_of_dates, label_timespans):
-        self._create_labels_table(labels_table)
         logger.spam(f"Creating labels for {len(as_of_dates)} as of dates and {len(label_timespans)} label timespans")
-        for as_of_date in as_of_dates:
-            for label_timespan in label_timespans:
-                if not self.replace:
-                    logger.spam(f"Looking for existing labels for as of date {as_of_date} and label timespan {label_timespan}")
-                    any_existing_labels = list(self.db_engine.execute(
-                        f"""select 1 from {labels_table}
-                        where as_of_date = '{as_of_date}'
-                        and label_timespan = '{label_timespan}'::interval
-                        and label_name = '{self.label_name}'
-                        limit 1
-                        """)
-                    )
-                    if len(any_existing_labels) == 1:
-                        logger.spam("Since nonzero existing labels found, skipping")
-                        continue
-
-                logger.debug(
-                    f"Generating labels for as of date {as_of_date} and label timespan {label_timespan}",
-                )
-                self.generate(
-                    start_date=as_of_date,
-                    label_timespan=label_timespan,
-                    labels_table=labels_table,
-                )
-
-        self.db_engine.execute(
-            f"create index on {labels_table} (entity_id, as_of_date)"
-        )
+        for task in self.generate_all_label_tasks(labels_table, as_of_dates, label_timespans).values():
+            self.run_commands(task["prepare"])
+            for insert in task["inserts"]:
+                self.run_commands([insert])
+            self.run_commands(task["finalize"])
         logger.spam("Added index to labels table")
+        self.check_labels_table(labels_table)
 
+    def check_labels_table(self, labels_table):
+        """Check that a freshly generated labels table is non-empty and duplicate-free
+
+        Raises: ValueError if the table is empty or has duplicate labels
+        """
         nrows = table_row_count(labels_table, self.db_engine)
 
         if nrows == 0:
@@ -98,31 +192,18 @@ class LabelGenerator:
         logger.debug(f"Labels table generated at {labels_table}")
         logger.spam(f"Row count of {labels_table}: {nrows}")
 
-    def generate(self, start_date, label_timespan, labels_table):
-        """Generate labels table using a query
-
-        Parameters
-        ----------
-        start_date: str
-            as of date
-        label_timespan: str
-            postgresql readable time interval
-        labels_table: str
-            name of labels table
-        """
+    def _label_select(self, start_date, label_timespan):
         # we want to apply the as-of-date and label in the database driver,
         # so replace the user {as_of_date} with the SQL %(as_of_date)
-
         query_with_db_variables = self.query.format(
             as_of_date=start_date, label_timespan=label_timespan
         )
 
-        full_insert_query = textwrap.dedent(
+        return textwrap.dedent(
             f"""
-            insert into {labels_table}
             select
                 entities_and_outcomes.entity_id,
-                '{start_date}' as as_of_date,
+                '{start_date}'::date as as_of_date,
                 '{label_timespan}'::interval as label_timespan,
                 '{self.label_name}' as label_name,
                 'binary' as label_type,
@@ -131,6 +212,27 @@ class LabelGenerator:
             """
         )
 
+    def _insert_query(self, pairs, labels_table):
+        selects = "union all".join(
+            self._label_select(start_date, label_timespan)
+            for start_date, label_timespan in pairs
+        )
+        return f"insert into {labels_table}{selects}"
+
+    def generate(self, start_date, label_timespan, labels_table):
+        """Generate labels table using a query
+
+        Parameters
+        ----------
+        start_date: str
+            as of date
+        label_timespan: str
+            postgresql readable time interval
+        labels_table: str
+            name of labels table
+        """
+        full_insert_query = self._insert_query([(start_date, label_timespan)], labels_table)
+
         logger.spam("Running label insertion query")
         logger.spam(full_insert_query)
         self.db_engine.execute(full_insert_query)
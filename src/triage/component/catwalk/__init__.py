@@ -7,7 +7,8 @@ from .individual_importance import IndividualImportanceCalculator, IndividualImp
 from .model_grouping import ModelGrouper
 from .subsetters import Subsetter, SubsetterNoOp
 from .protected_groups_generators import ProtectedGroupsGenerator, ProtectedGroupsGeneratorNoOp
-from .utils import filename_friendly_hash
+from .utils import filename_friendly_hash, retrieve_model_ids_from_hashes
+from triage.tracking import skipped_model, span
 
 import verboselogs, logging
 logger = verboselogs.VerboseLogger(__name__)
@@ -59,11 +60,30 @@ class ModelTrainTester:
 
         self.cohort_hash = cohort_hash
 
-    def generate_task_batches(self, splits, grid_config, model_comment=None):
+    def _get_store(self, matrix_uuid, matrix_metadata):
+        matrix_store = self.matrix_storage_engine.get_store(matrix_uuid)
+        if matrix_uuid in matrix_metadata:
+            matrix_store.metadata = matrix_metadata[matrix_uuid]
+        return matrix_store
+
+    def generate_task_batches(self, splits, grid_config, model_comment=None, matrix_metadata=None):
+        """Generate batches of train/test tasks for the given splits
+
+        Args:
+            splits (list) split definitions with train and test matrix uuids
+            grid_config (dict) of format {classpath: hyperparameter dicts}
+            model_comment (string, optional) comment to store with each model
+            matrix_metadata (dict, optional) metadata of matrices that may not be
+                stored yet, keyed on matrix uuid. Other matrices' metadata is loaded
+                from storage.
+
+        Returns: (tuple) of TaskBatches
+        """
+        matrix_metadata = matrix_metadata or {}
         train_test_tasks = []
         logger.debug(f"Generating train/test tasks for {len(splits)} splits")
         for split in splits:
-            train_store = self.matrix_storage_engine.get_store(split["train_uuid"])
+            train_store = self._get_store(split["train_uuid"], matrix_metadata)
             train_tasks = self.model_trainer.generate_train_tasks(
                 grid_config=grid_config,
                 misc_db_parameters=dict(test=False, model_comment=model_comment),
@@ -73,7 +93,7 @@ class ModelTrainTester:
             for test_matrix_def, test_uuid in zip(
                 split["test_matrices"], split["test_uuids"]
             ):
-                test_store = self.matrix_storage_engine.get_store(test_uuid)
+                test_store = self._get_store(test_uuid, matrix_metadata)
 
                 for train_task in train_tasks:
                     train_test_tasks.append(
@@ -129,6 +149,99 @@ class ModelTrainTester:
         return batches
 
 
+    def skip_completed_tasks(self, task_batches):
+        """Drop the tasks that would find their model trained and evaluated already
+
+        Instead of each task looking up its model and evaluations when it runs,
+        the model ids, stored models and evaluations of all tasks are looked up
+        at once. Nothing is dropped if models or evaluations are to be replaced,
+        or if individual importances are to be calculated.
+
+        Args:
+            task_batches (tuple) of TaskBatches
+
+        Returns: (tuple) of TaskBatches with only the tasks that have work to do
+        """
+        if (
+            self.replace
+            or self.model_trainer.replace
+            or self.individual_importance_calculator.methods
+        ):
+            return task_batches
+
+        with span("skip_completed_tasks") as planning_span:
+            tasks = [task for batch in task_batches for task in batch.tasks]
+            planning_span.add_rows(len(tasks))
+            model_hashes = {task["train_kwargs"]["model_hash"] for task in tasks}
+            model_ids = retrieve_model_ids_from_hashes(
+                self.model_trainer.db_engine, model_hashes
+            )
+            stored_model_hashes = self.model_trainer.model_storage_engine.stored_model_hashes()
+            subset_hashes = [""] + [filename_friendly_hash(subset) for subset in self.subsets]
+
+            task_evaluation_requests = {
+                id(task): [
+                    (model_ids[task["train_kwargs"]["model_hash"]], store, subset_hash)
+                    for store in (task["test_store"], task["train_store"])
+                    for subset_hash in subset_hashes
+                ]
+                for task in tasks
+                if task["train_kwargs"]["model_hash"] in model_ids
+                and task["train_kwargs"]["model_hash"] in stored_model_hashes
+            }
+            missing_evaluations = self.model_evaluator.missing_evaluations(
+                [request for requests in task_evaluation_requests.values() for request in requests]
+            )
+            completed_tasks = {
+                task_id
+                for task_id, requests in task_evaluation_requests.items()
+                if not any(request in missing_evaluations for request in requests)
+            }
+
+        logger.notice(
+            f"Skipping {len(completed_tasks)} of {len(tasks)} train/test tasks, "
+            f"whose models are already trained and evaluated"
+        )
+        if self.model_trainer.run_id:
+            for _ in completed_tasks:
+                skipped_model(self.model_trainer.run_id, self.model_trainer.db_engine)
+        return tuple(
+            batch._replace(tasks=[task for task in batch.tasks if id(task) not in completed_tasks])
+            for batch in task_batches
+        )
+
+    def _process_train_task(self, train_store, train_kwargs):
+        with span(
+            "train",
+            model_hash=train_kwargs.get("model_hash"),
+            class_path=train_kwargs.get("class_path"),
+        ) as train_span:
+            train_span.add_rows(len(train_store.labels))
+            return self.model_trainer.process_train_task(**train_kwargs)
+
+    def _calculate_individual_importances(self, model_id, test_store):
+        with span("individual_importances", model_id=model_id):
+            self.individual_importance_calculator.calculate_and_save_all_methods_and_dates(
+                model_id, test_store
+            )
+
+    def _predict(self, model_id, matrix_store, **kwargs):
+        with span("predict", model_id=model_id, matrix_uuid=matrix_store.uuid) as predict_span:
+            ranked_predictions = self.predictor.predict_ranked(model_id, matrix_store, **kwargs)
+            predict_span.add_rows(len(ranked_predictions))
+        return ranked_predictions
+
+    def _evaluate(self, matrix_store, model_id, subset, **kwargs):
+        attributes = dict(model_id=model_id, matrix_uuid=matrix_store.uuid)
+        if subset:
+            attributes["subset_hash"] = filename_friendly_hash(subset)
+        with span("evaluate", **attributes) as evaluate_span:
+            if not subset:
+                evaluate_span.add_rows(len(kwargs["predictions_proba"]))
+            self.model_evaluator.evaluate(
+                matrix_store=matrix_store, model_id=model_id, subset=subset, **kwargs
+            )
+
     def process_all_batches(self, task_batches):
         for n_batch, batch in enumerate(task_batches, start=1):
             logger.verbose(f"Processing '{batch.description}' [{n_batch} of {len(task_batches)} batches]")
@@ -142,7 +255,13 @@ class ModelTrainTester:
         logger.verbose(f"Training {train_kwargs.get('class_path')}({train_kwargs.get('parameters')}) [{train_kwargs.get('model_hash')}] on train matrix {train_store.uuid}")
 
         # If the matrices and train labels are OK, train and test the model!
-        with self.model_trainer.cache_models(), test_store.cache(), train_store.cache():
+        task_span = span(
+            "train_test",
+            model_hash=train_kwargs.get("model_hash"),
+            train_matrix_uuid=train_store.uuid,
+            test_matrix_uuid=test_store.uuid,
+        )
+        with task_span, self.model_trainer.cache_models(), test_store.cache(), train_store.cache():
             # will cache any trained models until it goes out of scope (at the end of the task)
             # this way we avoid loading the model pickle again for predictions
 
@@ -172,7 +291,7 @@ class ModelTrainTester:
                 )
                 return
 
-            model_id = self.model_trainer.process_train_task(**train_kwargs)
+            model_id = self._process_train_task(train_store, train_kwargs)
 
             if not model_id:
                 logger.warning("Training unsuccessful for {train_kwargs.get('class_path')}({train_kwargs.get('parameters')}) [{train_kwargs.get('model_hash')}] on train matrix {train_store.uuid}. "
@@ -182,7 +301,7 @@ class ModelTrainTester:
             logger.success(f"Trained model id {model_id}: {train_kwargs.get('class_path')}({train_kwargs.get('parameters')}) [{train_kwargs.get('model_hash')}] on train matrix {train_store.uuid}. ")
 
             # Storing individual importances (if any)
-            self.individual_importance_calculator.calculate_and_save_all_methods_and_dates(
+            self._calculate_individual_importances(
                 model_id, test_store
             )
 
@@ -201,12 +320,14 @@ class ModelTrainTester:
                         f"{store.matrix_type.string_name} matrix {store.uuid}, and model {model_id} to make evaluation",
                     )
 
-                    predictions_proba = self.predictor.predict(
+                    # sorted by score once, for the ranks and every evaluation
+                    ranked_predictions = self._predict(
                         model_id,
                         store,
                         misc_db_parameters=dict(),
                         train_matrix_columns=train_store.columns(),
                     )
+                    predictions_proba = ranked_predictions.predictions_proba
 
                     logger.debug(f"Predictions generated for {store.matrix_type.string_name} matrix {store.uuid} using model {model_id}")
 
@@ -220,12 +341,13 @@ class ModelTrainTester:
                         f"Evaluating model {model_id} on {store.matrix_type.string_name} matrix {store.uuid} "
                     )
 
-                    self.model_evaluator.evaluate(
+                    self._evaluate(
                         predictions_proba=predictions_proba,
                         matrix_store=store,
                         model_id=model_id,
                         subset=None,
-                        protected_df=protected_df
+                        protected_df=protected_df,
+                        ranked_predictions=ranked_predictions,
                     )
 
                     logger.info(
@@ -249,12 +371,13 @@ class ModelTrainTester:
                         )
 
 
-                        self.model_evaluator.evaluate(
+                        self._evaluate(
                             predictions_proba=predictions_proba,
                             matrix_store=store,
                             model_id=model_id,
                             subset=subset,
-                            protected_df=protected_df
+                            protected_df=protected_df,
+                            ranked_predictions=ranked_predictions,
                         )
 
                         logger.info(
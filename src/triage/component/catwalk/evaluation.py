@@ -15,17 +15,18 @@ from sqlalchemy.orm import sessionmaker
 
 from aequitas.bias import Bias
 from aequitas.fairness import Fairness
-from aequitas.group import Group
-from aequitas.preprocessing import preprocess_input_df
+from aequitas.group import COLUMN_ORDER as CROSSTAB_COLUMNS
+from aequitas.preprocessing import discretize
 
 from . import metrics
 from .utils import (
     db_retry,
-    sort_predictions_and_labels,
+    RankedPredictions,
     get_subset_table_name,
     filename_friendly_hash,
 )
 from triage.util.db import scoped_session
+from triage.tracking import span
 from triage.util.random import generate_python_random_seed
 from triage.component.catwalk.storage import MatrixStore
 
@@ -135,6 +136,151 @@ def generate_binary_at_x(test_predictions, x_value, unit="top_n"):
     return test_predictions_binary
 
 
+# columns aequitas never treats as protected attributes
+NON_ATTRIBUTE_COLUMNS = (
+    "score", "model_id", "as_of_date", "entity_id", "rank_abs", "rank_pct", "id", "label_value"
+)
+
+
+def protected_group_codes(protected_df):
+    """Code each protected attribute's groups, once for all the audits of a set of predictions
+
+    Attributes are turned into groups the way aequitas preprocesses them: categories
+    and strings are used as they are, and other columns are binned into quartiles.
+
+    Args:
+        protected_df (pandas.DataFrame) protected attributes, indexed like the predictions
+
+    Returns: (dict) each attribute's name mapped to a tuple of an array of group codes
+        (one per row of protected_df, -1 where it has none) and the groups' values
+    """
+    attributes = protected_df.drop(
+        columns=[column for column in NON_ATTRIBUTE_COLUMNS if column in protected_df.columns]
+    )
+    categorical_cols = attributes.select_dtypes(include="category").columns
+    attributes[categorical_cols] = attributes[categorical_cols].astype(str)
+    attributes = discretize(attributes, attributes.columns[attributes.dtypes != object])
+    codes = {}
+    for column in attributes.columns:
+        column_codes, values = pd.factorize(attributes[column], sort=True)
+        codes[column] = (column_codes, values.to_numpy())
+    return codes
+
+
+def audited_groups(group_codes, labels):
+    """The protected groups and labels of a set of predictions, as aequitas expects them
+
+    Args:
+        group_codes (dict) attribute names mapped to (group codes, group values), as
+            made by protected_group_codes, with the codes in the order of the labels
+        labels (np.array) labels, sorted by score descending and tiebreak
+
+    Returns: (pandas.DataFrame) with each attribute's group (missing where it has
+        none) and a label_value column, one row per label
+    """
+    audited_df = pd.DataFrame({
+        attribute_name: pd.Categorical.from_codes(codes, values)
+        for attribute_name, (codes, values) in group_codes.items()
+    })
+    audited_df["label_value"] = labels
+    return audited_df
+
+
+def _divide(numerator, denominator):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denominator != 0, numerator / denominator, np.nan)
+
+
+def group_crosstabs(group_codes, labels, model_id, score_thresholds):
+    """Count each protected group's predictions and labels above each threshold
+
+    The vectorised equivalent of aequitas' Group.get_crosstabs. Each rank threshold
+    is a number of top rows, so for every group and label the rows are coded by group
+    and position, sorted once, and the count within the top k rows of every
+    threshold read with a single searchsorted.
+
+    Args:
+        group_codes (dict) attribute names mapped to (group codes, group values), as
+            made by protected_group_codes, with the codes in the order of the labels
+        labels (np.array) labels, sorted by score descending and tiebreak
+        model_id (int) The database identifier of the model
+        score_thresholds (dict) 'rank_abs' mapped to a list of top n, 'rank_pct'
+            to a list of top fractions
+
+    Returns: (pandas.DataFrame) with the columns of aequitas' crosstabs, one row per
+        attribute, threshold and group
+    """
+    num_rows = len(labels)
+    ranks = np.arange(1, num_rows + 1)
+    ranks_by_unit = {"rank_abs": ranks, "rank_pct": ranks / num_rows}
+    thresholds = [
+        (f"{value}_{unit[-3:]}", np.count_nonzero(ranks_by_unit[unit] <= value))
+        for unit, values in score_thresholds.items()
+        for value in values
+    ]
+    if not thresholds or not num_rows:
+        return pd.DataFrame(columns=CROSSTAB_COLUMNS)
+    top_ks = np.array([k for _, k in thresholds] + [num_rows])
+    positive_labels = labels == 1
+    negative_labels = labels == 0
+
+    crosstabs = []
+    for attribute_name, (codes, values) in group_codes.items():
+        num_groups = len(values)
+        has_group = codes >= 0
+
+        def counts_in_top(mask):
+            # rows coded by group, then position, so each group's rows are a sorted run
+            mask = mask & has_group
+            keys = np.sort(codes[mask].astype(np.int64) * (num_rows + 1) + np.flatnonzero(mask))
+            group_starts = np.arange(num_groups, dtype=np.int64) * (num_rows + 1)
+            return (
+                np.searchsorted(keys, group_starts[:, np.newaxis] + top_ks)
+                - np.searchsorted(keys, group_starts)[:, np.newaxis]
+            )
+
+        positives, negatives = counts_in_top(positive_labels), counts_in_top(negative_labels)
+        # groups x thresholds, then flattened threshold by threshold
+        tp, fp = positives[:, :-1].T.ravel(), negatives[:, :-1].T.ravel()
+        group_label_pos = np.tile(positives[:, -1], len(thresholds))
+        group_label_neg = np.tile(negatives[:, -1], len(thresholds))
+        fn, tn = group_label_pos - tp, group_label_neg - fp
+        group_size = np.tile(np.bincount(codes[has_group], minlength=num_groups), len(thresholds))
+        k = np.repeat([k for _, k in thresholds], num_groups)
+        crosstab = pd.DataFrame({
+            "model_id": model_id,
+            "score_threshold": np.repeat([name for name, _ in thresholds], num_groups),
+            "k": k,
+            "attribute_name": attribute_name,
+            "attribute_value": np.tile(values, len(thresholds)),
+            "tpr": _divide(tp, fn + tp),
+            "tnr": _divide(tn, fp + tn),
+            "for": _divide(fn, fn + tn),
+            "fdr": _divide(fp, tp + fp),
+            "fpr": _divide(fp, fp + tn),
+            "fnr": _divide(fn, fn + tp),
+            "npv": _divide(tn, fn + tn),
+            "precision": _divide(tp, tp + fp),
+            "pp": fp + tp,
+            "pn": fn + tn,
+            "ppr": _divide(fp + tp, k),
+            "pprev": _divide(fp + tp, fn + tn + fp + tp),
+            "fp": fp,
+            "fn": fn,
+            "tn": tn,
+            "tp": tp,
+            "group_label_pos": group_label_pos,
+            "group_label_neg": group_label_neg,
+            "group_size": group_size,
+            "total_entities": num_rows,
+            "prev": _divide(group_label_pos, group_size),
+        })
+        crosstabs.append(crosstab[group_size > 0])
+    if not crosstabs:
+        return pd.DataFrame(columns=CROSSTAB_COLUMNS)
+    return pd.concat(crosstabs, ignore_index=True)[CROSSTAB_COLUMNS]
+
+
 class MetricDefinition(typing.NamedTuple):
     """A single metric, bound to a particular threshold and parameter combination"""
 
@@ -462,6 +608,69 @@ class ModelEvaluator:
         # at present to check whether all the needed records are needed.
         return True
 
+    def missing_evaluations(self, evaluation_requests):
+        """Finds which of many model/matrix/subset combinations are missing evaluations
+
+        Like needs_evaluations, but with one query per matrix type for all of them,
+        and taking the evaluated as-of-dates of each matrix from its metadata
+        instead of loading the matrix. A matrix whose metadata dates differ from
+        the dates actually in it is reported as missing evaluations.
+
+        Args:
+            evaluation_requests (list) of (model_id, matrix_store, subset_hash) tuples
+
+        Returns:
+            (set) the given tuples which are missing any evaluations in the db
+        """
+        if self.bias_config:
+            # as in needs_evaluations, audits are always redone
+            return set(evaluation_requests)
+
+        requests_by_matrix_type = defaultdict(list)
+        for request in evaluation_requests:
+            requests_by_matrix_type[request[1].matrix_type].append(request)
+
+        missing = set()
+        for matrix_type, requests in requests_by_matrix_type.items():
+            eval_obj = matrix_type.evaluation_obj
+            needed_metrics = {
+                (met.metric, met.parameter_string)
+                for met in self.metric_definitions_from_matrix_type(matrix_type)
+            }
+            with scoped_session(self.db_engine) as session:
+                rows = (
+                    session.query(
+                        eval_obj.model_id,
+                        eval_obj.evaluation_start_time,
+                        eval_obj.evaluation_end_time,
+                        eval_obj.as_of_date_frequency,
+                        eval_obj.subset_hash,
+                        eval_obj.metric,
+                        eval_obj.parameter,
+                    )
+                    .filter(eval_obj.model_id.in_({request[0] for request in requests}))
+                    .distinct()
+                    .all()
+                )
+            metrics_in_db = defaultdict(set)
+            for model_id, start_time, end_time, frequency, subset_hash, metric, parameter in rows:
+                key = (model_id, pd.Timestamp(start_time), pd.Timestamp(end_time), frequency, subset_hash)
+                metrics_in_db[key].add((metric, parameter))
+
+            for request in requests:
+                model_id, matrix_store, subset_hash = request
+                as_of_times = [pd.Timestamp(as_of_time) for as_of_time in matrix_store.metadata["as_of_times"]]
+                key = (
+                    model_id,
+                    min(as_of_times),
+                    max(as_of_times),
+                    matrix_store.metadata["as_of_date_frequency"],
+                    subset_hash,
+                )
+                if needed_metrics - metrics_in_db[key]:
+                    missing.add(request)
+        return missing
+
     def _compute_evaluations(self, predictions_proba, labels, metric_definitions):
         """Compute evaluations for a set of predictions and labels
 
@@ -527,7 +736,13 @@ class ModelEvaluator:
         return evals
 
     def evaluate(
-        self, predictions_proba, matrix_store, model_id, protected_df=None, subset=None
+        self,
+        predictions_proba,
+        matrix_store,
+        model_id,
+        protected_df=None,
+        subset=None,
+        ranked_predictions=None,
     ):
         """Evaluate a model based on predictions, and save the results
 
@@ -539,6 +754,9 @@ class ModelEvaluator:
             subset (dict) A dictionary containing a query and a
                 name for the subset to evaluate on, if any
             protected_df (pandas.DataFrame) A dataframe with protected group attributes
+            ranked_predictions (catwalk.utils.RankedPredictions, optional) The same
+                predictions, with the matrix's labels, already sorted by score (as
+                returned by Predictor.predict_ranked), so they are not sorted again
         """
         # If we are evaluating on a subset, we want to get just the labels and
         # predictions for the included entity-date pairs
@@ -571,8 +789,12 @@ class ModelEvaluator:
             ):
                 raise ValueError("Mismatch between protected_df and labels indices")
 
-        df_index = labels.index
-        labels = np.array(labels)
+        if ranked_predictions is None:
+            ranked_predictions = RankedPredictions(predictions_proba, labels, labels.index)
+        elif subset:
+            ranked_predictions = ranked_predictions.subset(
+                matrix_store.labels.index.get_indexer(labels.index)
+            )
 
         matrix_type = matrix_store.matrix_type
         metric_defs = self.metric_definitions_from_matrix_type(matrix_type)
@@ -584,12 +806,7 @@ class ModelEvaluator:
             predictions_proba_worst,
             labels_worst,
             df_index_worst,
-        ) = sort_predictions_and_labels(
-            predictions_proba=predictions_proba,
-            labels=labels,
-            df_index=df_index,
-            tiebreaker="worst",
-        )
+        ) = ranked_predictions.sorted(tiebreaker="worst")
         worst_lookup = {
             (eval.metric, eval.parameter): eval
             for eval in self._compute_evaluations(
@@ -605,12 +822,7 @@ class ModelEvaluator:
             predictions_proba_best,
             labels_best,
             df_index_best,
-        ) = sort_predictions_and_labels(
-            predictions_proba=predictions_proba_worst,
-            labels=labels_worst,
-            df_index=df_index_worst,
-            tiebreaker="best",
-        )
+        ) = ranked_predictions.sorted(tiebreaker="best")
         best_lookup = {
             (eval.metric, eval.parameter): eval
             for eval in self._compute_evaluations(
@@ -654,13 +866,7 @@ class ModelEvaluator:
                 predictions_proba_random,
                 labels_random,
                 df_index_random,
-            ) = sort_predictions_and_labels(
-                predictions_proba=predictions_proba_worst,
-                labels=labels_worst,
-                df_index=df_index_worst,
-                tiebreaker="random",
-                sort_seed=sort_seed,
-            )
+            ) = ranked_predictions.sorted(tiebreaker="random", sort_seed=sort_seed)
             for random_eval in self._compute_evaluations(
                 predictions_proba_random, labels_random, metric_defs_to_trial
             ):
@@ -725,37 +931,35 @@ class ModelEvaluator:
             evaluations,
             matrix_type.evaluation_obj,
         )
-        if protected_df is not None:
-            self._write_audit_to_db(
-                model_id=model_id,
-                protected_df=protected_df.reindex(df_index_worst),
-                predictions_proba=predictions_proba_worst,
-                labels=labels_worst,
-                tie_breaker="worst",
-                subset_hash=subset_hash,
-                matrix_type=matrix_type,
-                evaluation_start_time=evaluation_start_time,
-                evaluation_end_time=evaluation_end_time,
-                matrix_uuid=matrix_store.uuid,
-            )
-            self._write_audit_to_db(
-                model_id=model_id,
-                protected_df=protected_df.reindex(df_index_best),
-                predictions_proba=predictions_proba_best,
-                labels=labels_best,
-                tie_breaker="best",
-                subset_hash=subset_hash,
-                matrix_type=matrix_type,
-                evaluation_start_time=evaluation_start_time,
-                evaluation_end_time=evaluation_end_time,
-                matrix_uuid=matrix_store.uuid,
-            )
+        if protected_df is not None and not protected_df.empty:
+            with span("audit", model_id=model_id, matrix_uuid=matrix_store.uuid) as audit_span:
+                audit_span.add_rows(len(labels_worst))
+                # the groups are coded once, then put in the order of each sort
+                group_codes = protected_group_codes(protected_df)
+                for tie_breaker, sorted_index, sorted_labels in (
+                    ("worst", df_index_worst, labels_worst),
+                    ("best", df_index_best, labels_best),
+                ):
+                    positions = protected_df.index.get_indexer(sorted_index)
+                    self._write_audit_to_db(
+                        model_id=model_id,
+                        group_codes={
+                            attribute_name: (np.where(positions >= 0, codes[positions], -1), values)
+                            for attribute_name, (codes, values) in group_codes.items()
+                        },
+                        labels=sorted_labels,
+                        tie_breaker=tie_breaker,
+                        subset_hash=subset_hash,
+                        matrix_type=matrix_type,
+                        evaluation_start_time=evaluation_start_time,
+                        evaluation_end_time=evaluation_end_time,
+                        matrix_uuid=matrix_store.uuid,
+                    )
 
     def _write_audit_to_db(
         self,
         model_id,
-        protected_df,
-        predictions_proba,
+        group_codes,
         labels,
         tie_breaker,
         subset_hash,
@@ -769,10 +973,10 @@ class ModelEvaluator:
 
         Args:
             model_id (int) primary key of the model
-            protected_df (pandas.DataFrame) A dataframe with protected group attributes:
-            predictions_proba (np.array) List of prediction probabilities
-            labels (pandas.Series): List of labels
-            tie_breaker: 'best' or 'worst' case tiebreaking rule that the predictions and labels were sorted by
+            group_codes (dict) protected attributes' group codes, as made by
+                protected_group_codes, in the order of the labels
+            labels (np.array) List of labels, sorted by score and the tie_breaker
+            tie_breaker: 'best' or 'worst' case tiebreaking rule that the labels were sorted by
             subset_hash (str) the hash of the subset, if any, that the
                 evaluation is made on
             matrix_type (triage.component.catwalk.storage.MatrixType)
@@ -785,20 +989,6 @@ class ModelEvaluator:
         Returns:
 
         """
-        if protected_df.empty:
-            return
-
-        # to preprocess aequitas requires the following columns:
-        # score, label value, model_id, protected attributes
-        # fill out the protected_df, which just has protected attributes at this point
-        protected_df = protected_df.copy()
-        protected_df["model_id"] = model_id
-        protected_df["score"] = predictions_proba
-        protected_df["label_value"] = labels
-        aequitas_df, attr_cols_input = preprocess_input_df(protected_df)
-
-        # create group crosstabs
-        g = Group()
         score_thresholds = {}
         score_thresholds["rank_abs"] = self.bias_config["thresholds"].get("top_n", [])
         # convert 0-100 percentile to 0-1 that Aequitas expects
@@ -806,20 +996,27 @@ class ModelEvaluator:
             value / 100.0
             for value in self.bias_config["thresholds"].get("percentiles", [])
         ]
-        groups_model, attr_cols = g.get_crosstabs(
-            aequitas_df, score_thresholds=score_thresholds, attr_cols=attr_cols_input
-        )
+        # create group crosstabs
+        groups_model = group_crosstabs(group_codes, labels, model_id, score_thresholds)
+        if groups_model.empty:
+            raise ValueError(
+                f"""
+            Bias audit: aequitas_audit() failed.
+            Returned empty dataframe for model_id = {model_id}, and subset_hash = {subset_hash}
+            and matrix_type = {matrix_type}"""
+            )
         # analyze bias from reference groups
+        audited_df = audited_groups(group_codes, labels)
         bias = Bias()
         ref_groups_method = self.bias_config.get("ref_groups_method", None)
         if ref_groups_method == "predefined" and self.bias_config["ref_groups"]:
             bias_df = bias.get_disparity_predefined_groups(
-                groups_model, aequitas_df, self.bias_config["ref_groups"]
+                groups_model, audited_df, self.bias_config["ref_groups"]
             )
         elif ref_groups_method == "majority":
-            bias_df = bias.get_disparity_major_group(groups_model, aequitas_df)
+            bias_df = bias.get_disparity_major_group(groups_model, audited_df)
         else:
-            bias_df = bias.get_disparity_min_metric(groups_model, aequitas_df)
+            bias_df = bias.get_disparity_min_metric(groups_model, audited_df)
 
         # analyze fairness for each group
         f = Fairness(tau=0.8)  # the default fairness threshold is 0.8
@@ -839,21 +1036,23 @@ class ModelEvaluator:
             Returned empty dataframe for model_id = {model_id}, and subset_hash = {subset_hash}
             and matrix_type = {matrix_type}"""
             )
+        aequitas_obj = matrix_type.aequitas_obj
         with scoped_session(self.db_engine) as session:
-            for index, row in group_value_df.iterrows():
-                session.query(matrix_type.aequitas_obj).filter_by(
-                    model_id=row["model_id"],
-                    evaluation_start_time=row["evaluation_start_time"],
-                    evaluation_end_time=row["evaluation_end_time"],
-                    subset_hash=row["subset_hash"],
-                    parameter=row["parameter"],
-                    tie_breaker=row["tie_breaker"],
-                    matrix_uuid=row["matrix_uuid"],
-                    attribute_name=row["attribute_name"],
-                    attribute_value=row["attribute_value"],
-                ).delete()
+            # one delete for all the audited attributes and thresholds
+            session.query(aequitas_obj).filter(
+                aequitas_obj.model_id == model_id,
+                aequitas_obj.evaluation_start_time == evaluation_start_time,
+                aequitas_obj.evaluation_end_time == evaluation_end_time,
+                aequitas_obj.subset_hash == subset_hash,
+                aequitas_obj.tie_breaker == tie_breaker,
+                aequitas_obj.matrix_uuid == matrix_uuid,
+                aequitas_obj.parameter.in_(group_value_df["parameter"].unique().tolist()),
+                aequitas_obj.attribute_name.in_(
+                    group_value_df["attribute_name"].unique().tolist()
+                ),
+            ).delete(synchronize_session=False)
             session.bulk_insert_mappings(
-                matrix_type.aequitas_obj, group_value_df.to_dict(orient="records")
+                aequitas_obj, group_value_df.to_dict(orient="records")
             )
 
     @db_retry
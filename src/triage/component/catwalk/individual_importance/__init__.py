@@ -1,16 +1,29 @@
 import verboselogs, logging
 logger = verboselogs.VerboseLogger(__name__)
 
+import ohio.ext.pandas
+import pandas as pd
+
 from triage.component.catwalk.utils import save_db_objects
 from triage.component.results_schema import IndividualImportance
 
-from .uniform import uniform_distribution
+from .tree_path import tree_path_contributions
+from .uniform import uniform_distribution, uniform_distribution_frame
 
 
 CALCULATE_STRATEGIES = {"uniform": uniform_distribution}
 
+# methods that can calculate every as_of_date at once, returning a dataframe with
+# entity_id, as_of_date, feature_name, feature_value and score columns
+CALCULATE_ALL_DATES_STRATEGIES = {
+    "uniform": uniform_distribution_frame,
+    "tree_path": tree_path_contributions,
+}
+
 
 class IndividualImportanceCalculatorNoOp:
+    methods = []
+
     def calculate_and_save_all_methods_and_dates(self, model_id, test_matrix_store):
         logger.notice(
             "No individual feature importance configuration is available, so no individual feature importance will be created"
@@ -27,6 +40,11 @@ class IndividualImportanceCalculatorNoOp:
             "No individual feature importance configuration is available, so no individual feature importance will be created"
         )
 
+    def save_frame(self, importances, model_id, as_of_dates, method_name):
+        logger.notice(
+            "No individual feature importance configuration is available, so no individual feature importance will be created"
+        )
+
 
 
 class IndividualImportanceCalculator:
@@ -39,13 +57,26 @@ class IndividualImportanceCalculator:
             present in CALCULATE_STRATEGIES that should be called.
             Defaults to ['uniform']
         replace (bool) Whether to replace old records or reuse them.
+        model_storage_engine (catwalk.storage.ModelStorageEngine, optional) Where to load
+            models from, for methods that need the model itself (like 'tree_path')
+        n_jobs (int) How many threads methods may use. Defaults to 1
     """
 
-    def __init__(self, db_engine, n_ranks=5, methods=["uniform"], replace=True):
+    def __init__(
+        self,
+        db_engine,
+        n_ranks=5,
+        methods=["uniform"],
+        replace=True,
+        model_storage_engine=None,
+        n_jobs=1,
+    ):
         self.db_engine = db_engine
         self.n_ranks = n_ranks
         self.methods = methods
         self.replace = replace
+        self.model_storage_engine = model_storage_engine
+        self.n_jobs = n_jobs
 
     def _num_existing_importances(self, model_id, as_of_date, method):
         return [
@@ -102,8 +133,42 @@ class IndividualImportanceCalculator:
             test_matrix_store (catwalk.storage.MatrixStore) The test matrix
         """
         for method in self.methods:
-            for as_of_date in test_matrix_store.as_of_dates:
-                self.calculate_and_save(model_id, test_matrix_store, method, as_of_date)
+            if method not in CALCULATE_ALL_DATES_STRATEGIES:
+                for as_of_date in test_matrix_store.as_of_dates:
+                    self.calculate_and_save(model_id, test_matrix_store, method, as_of_date)
+                continue
+            as_of_dates = [
+                as_of_date
+                for as_of_date in test_matrix_store.as_of_dates
+                if self.replace
+                or self._needs_new_importances(model_id, as_of_date, method, test_matrix_store)
+            ]
+            if not as_of_dates:
+                logger.debug(
+                    "Found as many or more individual importances "
+                    + "for model_id=%s/method=%s on every as_of_date, skipping",
+                    model_id,
+                    method,
+                )
+                continue
+            self._calculate_and_save_dates(model_id, test_matrix_store, method, as_of_dates)
+
+    def _calculate_and_save_dates(self, model_id, test_matrix_store, method, as_of_dates):
+        importances = CALCULATE_ALL_DATES_STRATEGIES[method](
+            self.db_engine,
+            model_id,
+            test_matrix_store,
+            self.n_ranks,
+            as_of_dates,
+            model_storage_engine=self.model_storage_engine,
+            n_jobs=self.n_jobs,
+        )
+        self.save_frame(
+            importances=importances,
+            model_id=model_id,
+            as_of_dates=as_of_dates,
+            method_name=method,
+        )
 
     def calculate_and_save(self, model_id, test_matrix_store, method, as_of_date):
         """Calculate and save importances for a given model, test matrix, method, and date
@@ -112,7 +177,7 @@ class IndividualImportanceCalculator:
             model_id (int) A model id, expected to be present in test_results.models
             test_matrix_store (catwalk.storage.MatrixStore) The test matrix
             method_name (string) The name of a method to use to produce individual importances
-                Expected to be present in CALCULATE_STRATEGIES
+                Expected to be present in CALCULATE_STRATEGIES or CALCULATE_ALL_DATES_STRATEGIES
             as_of_date (datetime or string) The date to produce individual importances as of
         """
         if not self.replace and not self._needs_new_importances(
@@ -125,6 +190,8 @@ class IndividualImportanceCalculator:
                 as_of_date,
                 method,
             )
+        elif method in CALCULATE_ALL_DATES_STRATEGIES:
+            self._calculate_and_save_dates(model_id, test_matrix_store, method, [as_of_date])
         else:
             importance_records = CALCULATE_STRATEGIES[method](
                 self.db_engine, model_id, as_of_date, test_matrix_store, self.n_ranks
@@ -172,3 +239,41 @@ class IndividualImportanceCalculator:
             for importance_record in importance_records
         )
         save_db_objects(self.db_engine, record_stream)
+
+    def save_frame(self, importances, model_id, as_of_dates, method_name):
+        """Saves individual feature importances for several as_of_dates with one COPY.
+        Will delete any records beforehand matching the model_id, as_of_dates, and method_name
+
+        Args:
+            importances (pandas.DataFrame) Individual importances, with columns
+                entity_id, as_of_date, feature_name, feature_value and score
+            model_id (int) A model id, expected to be present in test_results.models
+            as_of_dates (list) The as_of_dates the importances were calculated for
+            method_name (string) The name of the method that produced the importances
+        """
+        self.db_engine.execute(
+            """delete from test_results.individual_importances
+            where model_id = %s
+            and as_of_date = any(%s)
+            and method = %s""",
+            model_id,
+            list(as_of_dates),
+            method_name,
+        )
+        if importances.empty:
+            return
+        pd.DataFrame({
+            "model_id": int(model_id),
+            "entity_id": importances["entity_id"].to_numpy(),
+            "as_of_date": importances["as_of_date"].to_numpy(),
+            "feature": importances["feature_name"].to_numpy(),
+            "method": method_name,
+            "feature_value": importances["feature_value"].to_numpy(),
+            "importance_score": importances["score"].to_numpy(dtype=float),
+        }).pg_copy_to(
+            schema=IndividualImportance.__table_args__["schema"],
+            name=IndividualImportance.__tablename__,
+            con=self.db_engine,
+            if_exists="append",
+            index=False,
+        )
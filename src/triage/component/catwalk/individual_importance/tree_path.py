@@ -0,0 +1,216 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse
+from sklearn.utils import parallel_backend
+from joblib import Parallel, delayed
+
+import verboselogs, logging
+logger = verboselogs.VerboseLogger(__name__)
+
+from triage.component.catwalk.utils import estimator_input, retrieve_model_hash_from_id
+
+from .uniform import _date_positions
+
+
+# how many contributions (rows x features) each chunk of the matrix may hold at once
+TREE_PATH_CHUNK_CELLS = 10 ** 7
+
+
+def _trees(model):
+    """The trees of a tree-based model, each with the weight of its
+    predictions in the model's, or None for other models"""
+    if hasattr(model, "tree_"):
+        return [(model, 1.0)]
+    estimators = getattr(model, "estimators_", None)
+    if estimators is None or hasattr(model, "estimator_weights_"):
+        # boosted ensembles that vote (like AdaBoost) have no additive paths
+        return None
+    if hasattr(model, "estimators_features_"):
+        # bagged trees each see their own subset of the features
+        return None
+    if isinstance(estimators, np.ndarray):
+        # gradient boosting: stages of regression trees, summed on the log-odds scale
+        if estimators.ndim != 2 or estimators.shape[1] != 1:
+            return None
+        return [(tree, model.learning_rate) for tree in estimators[:, 0]]
+    if not all(hasattr(tree, "tree_") for tree in estimators):
+        return None
+    return [(tree, 1.0 / len(estimators)) for tree in estimators]
+
+
+def _leaf_contributions(tree, weight, n_features):
+    """How much each feature's splits change a tree's prediction on the way to each leaf
+
+    Walks up from all leaves at once, one level per step, attributing the change in the
+    mean prediction between each node and its parent to the feature the parent splits on.
+
+    Returns: (scipy.sparse.csr_matrix) nodes x features, with rows only for the leaves
+    """
+    tree_ = tree.tree_
+    values = tree_.value[:, 0, :]
+    if values.shape[1] > 1:
+        # classification trees hold (weighted) class counts, the positive class last
+        node_means = values[:, -1] / values.sum(axis=1)
+    else:
+        node_means = values[:, 0]
+    parents = np.full(tree_.node_count, -1)
+    for children in (tree_.children_left, tree_.children_right):
+        is_split = children >= 0
+        parents[children[is_split]] = np.flatnonzero(is_split)
+
+    leaves = current = np.flatnonzero(tree_.children_left < 0)
+    rows, columns, contributions = [], [], []
+    while True:
+        has_parent = parents[current] >= 0
+        leaves, current = leaves[has_parent], current[has_parent]
+        if not len(current):
+            break
+        parent = parents[current]
+        rows.append(leaves)
+        columns.append(tree_.feature[parent])
+        contributions.append(weight * (node_means[current] - node_means[parent]))
+        current = parent
+    if not rows:
+        return scipy.sparse.csr_matrix((tree_.node_count, n_features))
+    # duplicate entries (features split on more than once on a path) are summed
+    return scipy.sparse.csr_matrix(
+        (np.concatenate(contributions), (np.concatenate(rows), np.concatenate(columns))),
+        shape=(tree_.node_count, n_features),
+    )
+
+
+def _chunk_importances(trees, leaf_contributions, node_offsets, chunk, n_ranks):
+    """The n_ranks largest (by absolute value) contributions of each row of a chunk
+
+    Returns: (tuple) of (rows x n_ranks) arrays of feature positions, contributions
+        and feature values
+    """
+    if scipy.sparse.issparse(chunk):
+        features = chunk.astype(np.float32).tocsr()
+    else:
+        features = np.asarray(chunk, dtype=np.float32)
+    num_rows, num_trees = features.shape[0], len(trees)
+    leaves = np.empty((num_rows, num_trees), dtype=np.int64)
+    for position, (tree, _) in enumerate(trees):
+        leaves[:, position] = tree.apply(features, check_input=False)
+    # one entry per row and tree, picking out the contributions of the leaf it lands in
+    reached_leaves = scipy.sparse.csr_matrix(
+        (
+            np.ones(num_rows * num_trees),
+            (leaves + node_offsets).ravel(),
+            np.arange(0, num_rows * num_trees + 1, num_trees),
+        ),
+        shape=(num_rows, leaf_contributions.shape[0]),
+    )
+    contributions = (reached_leaves @ leaf_contributions).toarray()
+
+    num_ranks = min(n_ranks, contributions.shape[1])
+    top_features = np.argpartition(-np.abs(contributions), num_ranks - 1, axis=1)[:, :num_ranks]
+    row_positions = np.arange(num_rows)[:, np.newaxis]
+    if scipy.sparse.issparse(features):
+        feature_values = np.asarray(
+            features[np.repeat(np.arange(num_rows), num_ranks), top_features.ravel()]
+        ).reshape(num_rows, num_ranks)
+    else:
+        feature_values = features[row_positions, top_features]
+    return top_features, contributions[row_positions, top_features], feature_values
+
+
+def tree_path_contributions(
+    db_engine,
+    model_id,
+    test_matrix_store,
+    n_ranks,
+    as_of_dates=None,
+    model_storage_engine=None,
+    n_jobs=1,
+):
+    """Calculates individual feature importances as each feature's contribution to the
+    entity's score along its paths through a tree-based model's trees
+
+    Each tree's prediction for an entity is split between the features its path through
+    the tree splits on, as the change in the mean prediction at each split (as in Saabas'
+    treeinterpreter). The contributions of every leaf are computed once, then the matrix
+    is scored a chunk of rows at a time, in parallel threads, so memory is bounded by
+    TREE_PATH_CHUNK_CELLS per thread.
+
+    Scores are contributions to the predicted probability for decision trees and random or
+    extra trees forests, and to the log-odds for gradient boosting. Models that are not
+    made of trees get no importances.
+
+    Args:
+        db_engine (sqlalchemy.engine)
+        model_id (int) A model id, expected to be present in triage_metadata.models
+        test_matrix_store (catwalk.storage.MatrixStore) The test matrix
+        n_ranks (int) Number of ranks to calculate and save
+        as_of_dates (list of datetime.date, optional) The dates to produce individual
+            importances as of. Defaults to all of the matrix's as_of_dates
+        model_storage_engine (catwalk.storage.ModelStorageEngine) Where the model is stored
+        n_jobs (int, optional) How many chunks to calculate at once. Defaults to 1
+
+    Returns: (pandas.DataFrame) with columns entity_id, as_of_date, feature_name,
+        feature_value and score, n_ranks rows per entity and as_of_date
+    """
+    if model_storage_engine is None:
+        raise ValueError("The tree_path method needs the model storage engine to load models")
+    model = model_storage_engine.load(retrieve_model_hash_from_id(db_engine, model_id))
+    trees = _trees(model)
+    if trees is None:
+        logger.warning(
+            f"Model {model_id} ({model.__class__.__name__}) is not made of trees, "
+            "so it gets no tree_path individual importances"
+        )
+        return pd.DataFrame(
+            columns=["entity_id", "as_of_date", "feature_name", "feature_value", "score"]
+        )
+
+    design_matrix = test_matrix_store.design_matrix
+    # the columns in the order the model was trained on, if it knows them
+    feature_names = getattr(model, "feature_names_in_", design_matrix.columns)
+    column_positions = design_matrix.columns.get_indexer(feature_names)
+    if (column_positions < 0).any() or len(column_positions) != len(design_matrix.columns):
+        raise ValueError(
+            f"The columns of matrix {test_matrix_store.uuid} are not those model {model_id} "
+            "was trained on"
+        )
+    feature_names = np.array(feature_names, dtype=object)
+    positions, dates = _date_positions(design_matrix, as_of_dates)
+    entity_ids = design_matrix.index.get_level_values("entity_id")[positions].to_numpy()
+
+    leaf_contributions = scipy.sparse.vstack(
+        [_leaf_contributions(tree, weight, len(feature_names)) for tree, weight in trees],
+        format="csr",
+    )
+    node_offsets = np.cumsum([0] + [tree.tree_.node_count for tree, _ in trees[:-1]])
+    chunk_rows = max(1, TREE_PATH_CHUNK_CELLS // max(len(feature_names), len(trees)))
+    chunks = [positions[start:start + chunk_rows] for start in range(0, len(positions), chunk_rows)]
+    logger.debug(
+        f"Calculating tree_path importances of model {model_id} for {len(positions)} rows "
+        f"in {len(chunks)} chunks"
+    )
+
+    # threads, like prediction, as experiments may already run in subprocesses
+    with parallel_backend("threading", n_jobs=n_jobs):
+        results = Parallel()(
+            delayed(_chunk_importances)(
+                trees,
+                leaf_contributions,
+                node_offsets,
+                estimator_input(design_matrix.iloc[chunk, column_positions], model),
+                n_ranks,
+            )
+            for chunk in chunks
+        )
+    if not results:
+        return pd.DataFrame(
+            columns=["entity_id", "as_of_date", "feature_name", "feature_value", "score"]
+        )
+    top_features, scores, feature_values = (np.concatenate(arrays) for arrays in zip(*results))
+    num_ranks = top_features.shape[1]
+    return pd.DataFrame({
+        "entity_id": np.repeat(entity_ids, num_ranks),
+        "as_of_date": np.repeat(dates.to_numpy(), num_ranks),
+        "feature_name": feature_names[top_features.ravel()],
+        "feature_value": feature_values.ravel(),
+        "score": scores.ravel(),
+    })
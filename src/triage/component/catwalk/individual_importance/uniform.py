@@ -1,33 +1,115 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
 from triage.component.catwalk.model_trainers import NO_FEATURE_IMPORTANCE
 
 
+def _top_feature_importances(db_engine, model_id, n_ranks):
+    """The model's n_ranks most important features, as (feature, feature_importance) rows"""
+    return [
+        row
+        for row in db_engine.execute(
+            """select feature, feature_importance
+        from train_results.feature_importances where model_id = %s
+        order by feature_importance desc limit %s""",
+            model_id,
+            n_ranks,
+        )
+    ]
+
+
+def _date_positions(matrix, as_of_dates=None):
+    """Find the rows of a matrix falling on the given as_of_dates
+
+    Args:
+        matrix (pandas.DataFrame), with index 'entity_id'/'as_of_date'
+        as_of_dates (list of datetime.date, optional) Defaults to every as_of_date
+
+    Returns: (tuple) the row positions, and the as_of_date of each of them
+    """
+    dates = matrix.index.get_level_values("as_of_date").normalize()
+    if as_of_dates is None:
+        return np.arange(len(matrix)), dates
+    positions = np.flatnonzero(dates.isin(pd.to_datetime(list(as_of_dates))))
+    return positions, dates[positions]
+
+
 def _entity_feature_values(matrix, feature_name, as_of_date):
     """Finds the value of the given feature for each entity in a matrix
 
     Args:
-        matrix (pandas.DataFrame), with index either 'entity_id' or 'entity_id'/'as_of_date'
+        matrix (pandas.DataFrame), with index 'entity_id'/'as_of_date'
         feature_name (string) The name of a column in the matrix
         as_of_date (datetime.date) This must be one of the valid as_of_dates in the matrix
 
     Returns: (list) of (entity_id, feature_value) tuples
     """
-    results = []
-    index_of_entity = matrix.index.names.index("entity_id")
-    index_of_date = matrix.index.names.index("as_of_date")
+    if type(as_of_date) != datetime.date:
+        raise TypeError(
+            "Types of date in matrix and input must match, "
+            f"Matrix was {matrix.index.get_level_values('as_of_date').dtype} "
+            f"(compared as {datetime.date}), Input was {type(as_of_date)}"
+        )
+    positions, _ = _date_positions(matrix, [as_of_date])
+    entity_ids = matrix.index.get_level_values("entity_id")[positions]
     if feature_name == NO_FEATURE_IMPORTANCE:
-        zipped_iter = zip(matrix.index.values, [None] * len(matrix.index.values))
+        feature_values = [None] * len(positions)
     else:
-        zipped_iter = zip(matrix.index.values, matrix[feature_name].tolist())
-    for row in zipped_iter:
-        index_values, feature_value = row
-        entity_id = index_values[index_of_entity]
-        if type(index_values[index_of_date].date()) != type(as_of_date):
-            raise TypeError("Types of date in matrix and input must match, "
-                            f"Matrix was {type(index_values[index_of_date].date())}",
-                            f"Input was {type(as_of_date)}")
-        if index_values[index_of_date].date() == as_of_date:
-            results.append((entity_id, feature_value))
-    return results
+        feature_values = matrix[feature_name].to_numpy()[positions].tolist()
+    return list(zip(entity_ids.tolist(), feature_values))
+
+
+def uniform_distribution_frame(
+    db_engine,
+    model_id,
+    test_matrix_store,
+    n_ranks,
+    as_of_dates=None,
+    model_storage_engine=None,
+    n_jobs=1,
+):
+    """Calculates individual feature importances based on the global feature importances,
+    for every entity and as_of_date at once
+
+    Args:
+        db_engine (sqlalchemy.engine)
+        model_id (int) A model id, expected to be present in triage_metadata.models
+        test_matrix_store (catwalk.storage.MatrixStore) The test matrix
+        n_ranks (int) Number of ranks to calculate and save
+        as_of_dates (list of datetime.date, optional) The dates to produce individual
+            importances as of. Defaults to all of the matrix's as_of_dates
+        model_storage_engine, n_jobs: not needed by this method, which only reads the
+            global importances and the matrix
+
+    Returns: (pandas.DataFrame) with columns entity_id, as_of_date, feature_name,
+        feature_value and score, one row per entity, as_of_date and feature
+    """
+    global_feature_importances = _top_feature_importances(db_engine, model_id, n_ranks)
+    design_matrix = test_matrix_store.design_matrix
+    positions, dates = _date_positions(design_matrix, as_of_dates)
+    entity_ids = design_matrix.index.get_level_values("entity_id")[positions].to_numpy()
+
+    feature_values = [
+        np.full(len(positions), np.nan)
+        if feature_name == NO_FEATURE_IMPORTANCE
+        else design_matrix[feature_name].to_numpy(dtype=float)[positions]
+        for feature_name, _ in global_feature_importances
+    ]
+    num_features = len(global_feature_importances)
+    return pd.DataFrame({
+        "entity_id": np.tile(entity_ids, num_features),
+        "as_of_date": np.tile(dates.to_numpy(), num_features),
+        "feature_name": np.repeat(
+            [feature_name for feature_name, _ in global_feature_importances], len(positions)
+        ).astype(object),
+        "feature_value": np.concatenate(feature_values) if feature_values else [],
+        "score": np.repeat(
+            [float(feature_importance) for _, feature_importance in global_feature_importances],
+            len(positions),
+        ),
+    })
 
 
 def uniform_distribution(db_engine, model_id, as_of_date, test_matrix_store, n_ranks):
@@ -42,16 +124,7 @@ def uniform_distribution(db_engine, model_id, as_of_date, test_matrix_store, n_r
 
     Returns: (list) dicts with entity_id, feature_value, feature_name, score
     """
-    global_feature_importances = [
-        row
-        for row in db_engine.execute(
-            """select feature, feature_importance
-        from train_results.feature_importances where model_id = %s
-        order by feature_importance desc limit %s""",
-            model_id,
-            n_ranks,
-        )
-    ]
+    global_feature_importances = _top_feature_importances(db_engine, model_id, n_ranks)
 
     results = []
 
@@ -1,3 +1,4 @@
+import hashlib
 import json
 import verboselogs, logging
 logger = verboselogs.VerboseLogger(__name__)
@@ -21,6 +22,10 @@ class ModelGrouper:
     The role of this class is mainly to provide data conversion, sensible defaults, and
     an abstraction layer over the database.
 
+    Model group ids are remembered once resolved, so each distinct set of model group
+    arguments only reaches the database once per grouper (and the grouper travels with
+    the model trainer to worker processes).
+
     Args:
         model_group_keys (list) A list of matrix metadata keys to uniquely define a model group.'
             In addition, the non-matrix attributes 'class_path' and 'parameters', referring to
@@ -29,6 +34,8 @@ class ModelGrouper:
 
     def __init__(self, model_group_keys=()):
         self.model_group_keys = frozenset(model_group_keys)
+        self._model_group_ids = {}
+        self._procedure_exists = False
 
     def _final_model_group_args(self, class_path, parameters, matrix_metadata):
         """Generates model grouping arguments based on input.
@@ -97,6 +104,38 @@ class ModelGrouper:
                 model_config=model_config,
             )
 
+    @staticmethod
+    def _cache_key(model_group_args):
+        """A hashable key identifying a set of model group arguments
+
+        The stored procedure sorts the feature list, so the feature names are
+        hashed in sorted order to avoid keeping every feature list in memory.
+        """
+        feature_names_hash = hashlib.md5(
+            "\n".join(sorted(model_group_args["feature_names"])).encode("utf-8")
+        ).hexdigest()
+        return (
+            model_group_args["class_path"],
+            json.dumps(model_group_args["parameters"], sort_keys=True),
+            feature_names_hash,
+            json.dumps(model_group_args["model_config"], sort_keys=True),
+        )
+
+    def _check_procedure(self, cursor):
+        """Whether the get_model_group_id stored procedure exists
+
+        A positive answer is remembered so the catalog is only probed once.
+        """
+        if not self._procedure_exists:
+            cursor.execute(
+                "SELECT EXISTS ( "
+                "       SELECT * "
+                "       FROM pg_catalog.pg_proc "
+                "       WHERE proname = 'get_model_group_id' ) "
+            )
+            self._procedure_exists = cursor.fetchone()[0]
+        return self._procedure_exists
+
     def get_model_group_id(self, class_path, parameters, matrix_metadata, db_engine):
         """
         Returns model group id using store procedure 'get_model_group_id' which will
@@ -112,43 +151,78 @@ class ModelGrouper:
 
         Returns: (int) a database id for the model group id
         """
-        model_group_args = self._final_model_group_args(
-            class_path, parameters, matrix_metadata
-        )
-        db_conn = db_engine.raw_connection()
-        cur = db_conn.cursor()
-        cur.execute(
-            "SELECT EXISTS ( "
-            "       SELECT * "
-            "       FROM pg_catalog.pg_proc "
-            "       WHERE proname = 'get_model_group_id' ) "
-        )
-        condition = cur.fetchone()
+        return self.get_model_group_ids(
+            [(class_path, parameters)], matrix_metadata, db_engine
+        )[0]
+
+    def get_model_group_ids(self, classifiers, matrix_metadata, db_engine):
+        """
+        Returns model group ids for several classifiers trained on the same matrix,
+        resolving all of the ones not seen before by this grouper in one query
 
-        if condition:
-            query = (
+        Args:
+            classifiers (list) of (class_path, parameters) tuples
+            matrix_metadata (dict) stored metadata about the train matrix
+            db_engine (sqlalchemy.engine) A database engine pointing to a database with
+             a results.model_groups table and get_model_group_id stored procedure
+
+        Returns: (list) database ids for the model groups, in the order of classifiers
+        """
+        all_args = [
+            self._final_model_group_args(class_path, parameters, matrix_metadata)
+            for class_path, parameters in classifiers
+        ]
+        keys = [self._cache_key(model_group_args) for model_group_args in all_args]
+        missing = {
+            key: model_group_args
+            for key, model_group_args in zip(keys, all_args)
+            if key not in self._model_group_ids
+        }
+        if missing:
+            self._model_group_ids.update(self._resolve(missing, db_engine))
+        return [self._model_group_ids.get(key) for key in keys]
+
+    def _resolve(self, model_group_args_by_key, db_engine):
+        """Calls the stored procedure for each set of model group arguments
+
+        Returns: (dict) cache keys to model group ids, empty if the stored
+            procedure could not be found
+        """
+        keys = list(model_group_args_by_key.keys())
+        all_args = list(model_group_args_by_key.values())
+        db_conn = db_engine.raw_connection()
+        try:
+            cur = db_conn.cursor()
+            if not self._check_procedure(cur):
+                logger.warning("Could not found stored procedure public.model_group_id")
+                return {}
+            logger.spam(f"Getting {len(all_args)} model groups")
+            # every classifier is trained on the same matrix, so the feature
+            # list is shared and only sent once
+            cur.execute(
                 "SELECT get_model_group_id( "
-                "            '{class_path}'::TEXT, "
-                "            '{parameters}'::JSONB, "
-                "             ARRAY{feature_names}::TEXT [] , "
-                "            '{model_config}'::JSONB )".format(
-                    class_path=model_group_args["class_path"],
-                    parameters=json.dumps(model_group_args["parameters"]),
-                    feature_names=list(model_group_args["feature_names"]),
-                    model_config=json.dumps(
-                        model_group_args["model_config"], sort_keys=True
-                    ),
-                )
+                "            args.class_path, "
+                "            args.parameters, "
+                "            %(feature_names)s::TEXT [], "
+                "            args.model_config ) "
+                "FROM unnest( "
+                "            %(class_paths)s::TEXT [], "
+                "            %(parameters)s::JSONB [], "
+                "            %(model_configs)s::JSONB [] "
+                "     ) WITH ORDINALITY AS args(class_path, parameters, model_config, position) "
+                "ORDER BY args.position",
+                {
+                    "feature_names": list(all_args[0]["feature_names"]),
+                    "class_paths": [args["class_path"] for args in all_args],
+                    "parameters": [json.dumps(args["parameters"]) for args in all_args],
+                    "model_configs": [
+                        json.dumps(args["model_config"], sort_keys=True)
+                        for args in all_args
+                    ],
+                },
             )
-            logger.spam(f"Getting model group from query {query}")
-            cur.execute(query)
+            model_group_ids = [row[0] for row in cur.fetchall()]
             db_conn.commit()
-            model_group_id = cur.fetchone()
-            model_group_id = model_group_id[0]
-
-        else:
-            logger.warning("Could not found stored procedure public.model_group_id")
-            model_group_id = None
-        db_conn.close()
-
-        return model_group_id
+        finally:
+            db_conn.close()
+        return dict(zip(keys, model_group_ids))
@@ -6,7 +6,7 @@ import verboselogs, logging
 logger = verboselogs.VerboseLogger(__name__)
 
 import random
-import sys
+import time
 from contextlib import contextmanager
 
 import numpy as np
@@ -30,6 +30,7 @@ from .utils import (
     save_db_objects,
     retrieve_existing_model_random_seeds,
     retrieve_experiment_seed_from_run_id,
+    estimator_input,
 )
 
 NO_FEATURE_IMPORTANCE = (
@@ -126,7 +127,9 @@ class ModelTrainer:
         # using a threading backend because the default loky backend doesn't
         # allow for nested parallelization (e.g., multiprocessing at triage level)
         with parallel_backend('threading'):
-            fitted = instance.fit(matrix_store.design_matrix, matrix_store.labels)
+            fitted = instance.fit(
+                estimator_input(matrix_store.design_matrix, instance), matrix_store.labels
+            )
 
         return fitted
 
@@ -192,6 +195,7 @@ class ModelTrainer:
         trained_model,
         model_group_id,
         model_size,
+        model_write_time,
         misc_db_parameters,
         retrain,
     ):
@@ -214,6 +218,7 @@ class ModelTrainer:
             trained_model (object) a trained model object
             model_group_id (int) the unique id for the model group
             model_size (float) the size of the stored model in kB
+            model_write_time (float) the seconds taken to store the model
             misc_db_parameters (dict) params to pass through to the database
         """
         model_id = retrieve_model_id_from_hash(self.db_engine, model_hash)
@@ -233,6 +238,7 @@ class ModelTrainer:
                     # built_by_retrain=self.experiment_hash,
                     built_in_triage_run=self.run_id,
                     model_size=model_size,
+                    model_write_time=model_write_time,
                     **misc_db_parameters,
                 )
 
@@ -245,6 +251,7 @@ class ModelTrainer:
                     # built_by_experiment=self.experiment_hash,
                     built_in_triage_run=self.run_id,
                     model_size=model_size,
+                    model_write_time=model_write_time,
                     **misc_db_parameters,
                 )    
             session = self.sessionmaker()
@@ -297,20 +304,22 @@ class ModelTrainer:
             if not model_group_id:
                 raise ValueError("model_group_id should be provided when retrain") 
             
-        else:
+        elif not model_group_id:
             model_group_id = self.model_grouper.get_model_group_id(
                 class_path, unique_parameters, matrix_store.metadata, self.db_engine
             )
 
-        # Writing th model to storage, then getting its size in kilobytes.
-        self.model_storage_engine.write(trained_model, model_hash)
+        # Writing the model to storage, timing it and getting its stored size in kilobytes.
+        write_start = time.perf_counter()
+        model_bytes = self.model_storage_engine.write(trained_model, model_hash)
+        model_write_time = time.perf_counter() - write_start
         
         logger.debug(
             f"Trained model: hash {model_hash}, model group {model_group_id} "
         )
         logger.spam(f"Cached model: {model_hash}")
  
-        model_size = sys.getsizeof(trained_model) / (1024.0)
+        model_size = model_bytes / (1024.0)
 
         model_id = self._write_model_to_db(
             class_path,
@@ -320,6 +329,7 @@ class ModelTrainer:
             trained_model,
             model_group_id,
             model_size,
+            model_write_time,
             misc_db_parameters,
             retrain,
         )
@@ -486,12 +496,17 @@ class ModelTrainer:
 
         tasks = []
 
-        for class_path, parameters in self.flattened_grid_config(grid_config):
+        classifiers = list(self.flattened_grid_config(grid_config))
+        model_group_ids = self.model_grouper.get_model_group_ids(
+            [
+                (class_path, self.unique_parameters(parameters))
+                for class_path, parameters in classifiers
+            ],
+            matrix_store.metadata,
+            self.db_engine,
+        )
 
-            unique_parameters = self.unique_parameters(parameters)
-            model_group_id = self.model_grouper.get_model_group_id(
-                class_path, unique_parameters, matrix_store.metadata, self.db_engine
-            )
+        for (class_path, parameters), model_group_id in zip(classifiers, model_group_ids):
             random_seed = self.get_or_generate_random_seed(
                 model_group_id, matrix_store.metadata, matrix_store.uuid
             )
@@ -523,7 +538,8 @@ class ModelTrainer:
                     "parameters": parameters,
                     "model_hash": model_hash,
                     "misc_db_parameters": misc_db_parameters,
-                    "random_seed": random_seed
+                    "random_seed": random_seed,
+                    "model_group_id": model_group_id,
                 }
             )
             logger.debug(f"Task added for model {class_path}({parameters}) [{model_hash}]")
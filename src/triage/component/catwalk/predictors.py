@@ -2,13 +2,14 @@ import verboselogs, logging
 logger = verboselogs.VerboseLogger(__name__)
 
 import math
+import time
 
 import numpy as np
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy import or_
 from sklearn.utils import parallel_backend
 
-from .utils import db_retry, retrieve_model_hash_from_id, save_db_objects, sort_predictions_and_labels, AVAILABLE_TIEBREAKERS
+from .utils import db_retry, estimator_input, retrieve_model_hash_from_id, save_db_objects, AVAILABLE_TIEBREAKERS, RankedPredictions
 from triage.component.results_schema import Model
 from triage.util.db import scoped_session
 from triage.util.random import generate_python_random_seed
@@ -42,6 +43,8 @@ class Predictor:
         self.rank_order = rank_order
         self.replace = replace
         self.save_predictions = save_predictions
+        # models whose load time this predictor has already recorded
+        self.load_time_recorded = set()
 
     @property
     def sessionmaker(self):
@@ -59,9 +62,22 @@ class Predictor:
         """
 
         model_hash = retrieve_model_hash_from_id(self.db_engine, model_id)
+        # models loaded from memory are neither checked for in storage nor timed
+        if self.model_storage_engine.is_cached(model_hash):
+            return self.model_storage_engine.load(model_hash)
         logger.spam(f"Checking for model_hash {model_hash} in store")
         if self.model_storage_engine.exists(model_hash):
-            return self.model_storage_engine.load(model_hash)
+            load_start = time.perf_counter()
+            model = self.model_storage_engine.load(model_hash)
+            load_time = time.perf_counter() - load_start
+            # once per model, rather than an update for every load
+            if model_id not in self.load_time_recorded:
+                with scoped_session(self.db_engine) as session:
+                    session.query(Model).filter_by(model_id=model_id).update(
+                        {"model_load_time": load_time}
+                    )
+                self.load_time_recorded.add(model_id)
+            return model
 
     @db_retry
     def delete_model(self, model_id):
@@ -240,6 +256,20 @@ class Predictor:
         Returns:
             (np.Array) the generated prediction values
         """
+        return self.predict_ranked(
+            model_id, matrix_store, misc_db_parameters, train_matrix_columns
+        ).predictions_proba
+
+    def predict_ranked(self, model_id, matrix_store, misc_db_parameters, train_matrix_columns):
+        """Generate predictions and store them in the database, keeping their sort
+        by score for evaluations to reuse
+
+        Takes the same arguments as predict
+
+        Returns:
+            (catwalk.utils.RankedPredictions) the generated prediction values, with
+                the matrix's labels
+        """
         # Setting the Prediction object type - TrainPrediction or TestPrediction
         matrix_type = matrix_store.matrix_type
 
@@ -258,7 +288,11 @@ class Predictor:
                     logger.info(
                         f"Found old predictions for model id {model_id}, matrix {matrix_store.uuid}, returning saved versions"
                     )
-                    return self._load_saved_predictions(existing_predictions, matrix_store)
+                    return RankedPredictions(
+                        self._load_saved_predictions(existing_predictions, matrix_store),
+                        matrix_store.labels,
+                        matrix_store.index,
+                    )
             finally:
                 session.close()
 
@@ -274,40 +308,26 @@ class Predictor:
         # allow for nested parallelization (e.g., multiprocessing at triage level)
         with parallel_backend('threading'):
             predictions = model.predict_proba(
-                matrix_store.matrix_with_sorted_columns(train_matrix_columns)
+                estimator_input(
+                    matrix_store.matrix_with_sorted_columns(train_matrix_columns), model
+                )
             )[:, 1]  # Returning only the scores for the label == 1
 
 
         logger.debug(
             f"Generated predictions for model {model_id} on {matrix_store.matrix_type.string_name} matrix {matrix_store.uuid}"
         )
+        ranked_predictions = RankedPredictions(predictions, labels, matrix_store.index)
+        sort_seed = None
         if self.save_predictions:
-            df = pd.DataFrame(data=None, columns=None, index=matrix_store.index)
-            df['label_value'] = matrix_store.labels
-            df['score'] = predictions
-
-
             logger.spam(f"Sorting predictions for model {model_id} using {self.rank_order}")
-
-            if self.rank_order == 'best':
-                df.sort_values(by=["score", "label_value"], inplace=True, ascending=[False,False], na_position='last')
-            elif self.rank_order == 'worst':
-                df.sort_values(by=["score", "label_value"], inplace=True, ascending=[False,True], na_position='first')
-            elif self.rank_order == 'random':
-                df['random'] = np.random.rand(len(df))
-                df.sort_values(by=['score', 'random'], inplace=True, ascending=[False, False])
-                df.drop('random', axis=1)
-            else:
+            if self.rank_order not in self.available_tiebreakers:
                 raise ValueError(f"Rank order specified in condiguration file not recognized: {self.rank_order} ")
+            if self.rank_order == 'random':
+                sort_seed = generate_python_random_seed()
 
-            df['rank_abs_no_ties'] = df['score'].rank(ascending=False, method='first')
-            # uses the lowest rank in the group
-            df['rank_abs_with_ties'] = df['score'].rank(ascending=False, method='min')
-            # No gaps between groups (so it reaches 1.0). We are using rank_abs_no_ties so we can
-            # respect that order (instead of using the mathematical formula,  as was done before)
-            df['rank_pct_no_ties'] = df['rank_abs_no_ties'].rank(ascending=True, method='dense', pct=True)
-            df['rank_pct_with_ties'] = df['score'].rank(ascending=False, method='dense', pct=True)
-
+            # sorted by score and the rank order, with the ranks read off the sort
+            df = ranked_predictions.ranks(self.rank_order, sort_seed=sort_seed)
             df.reset_index(inplace=True)
             logger.debug(f"Predictions on {matrix_store.matrix_type.string_name} matrix {matrix_store.uuid} from model {model_id} sorted using {self.rank_order}")
 
@@ -335,7 +355,7 @@ class Predictor:
             model_id=model_id,
             matrix_uuid=matrix_store.uuid,
             matrix_type=matrix_type,
-            random_seed=None,
+            random_seed=sort_seed,
         )
 
-        return predictions
+        return ranked_predictions
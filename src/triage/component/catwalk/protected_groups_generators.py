@@ -2,6 +2,7 @@ import verboselogs, logging
 logger = verboselogs.VerboseLogger(__name__)
 
 import textwrap
+from collections import OrderedDict
 
 import pandas as pd
 from sqlalchemy import text
@@ -9,6 +10,10 @@ from sqlalchemy import text
 from triage.database_reflection import table_exists
 from triage.component.catwalk.storage import MatrixStore
 
+# number of protected groups dataframes kept in memory by each process
+PROTECTED_GROUPS_CACHE_SIZE = 16
+_protected_groups_cache = OrderedDict()
+
 
 class ProtectedGroupsGeneratorNoOp:
     def generate_all_dates(self, *args, **kwargs):
@@ -37,6 +42,8 @@ class ProtectedGroupsGenerator:
         self.attribute_columns = attribute_columns
         self.entity_id_column = entity_id_column
         self.knowledge_date_column = knowledge_date_column
+        # the generation stamp of each cohort's rows as this generator last wrote them
+        self.generations = {}
 
     def generate_all_dates(self, as_of_dates, cohort_table_name, cohort_hash):
         logger.spam("Creating protected groups table")
@@ -61,37 +68,32 @@ class ProtectedGroupsGenerator:
                 f"delete from {self.protected_groups_table_name} where cohort_hash = '{cohort_hash}'"
             )
             logger.debug(f"Removed from {self.protected_groups_table_name} all rows from cohort {cohort_hash}")
+        clear_protected_groups_cache(self.protected_groups_table_name)
 
         logger.spam(
             f"Creating protected_groups for {len(as_of_dates)} as of dates",
         )
 
-        for as_of_date in as_of_dates:
-            if not self.replace:
-                logger.spam(
-                    "Looking for existing protected_groups for as of date {as_of_date}"
-                )
-                any_existing_rows = list(self.db_engine.execute(
-                    f"""select 1 from {self.protected_groups_table_name}
-                    where as_of_date = '{as_of_date}'
-                    and cohort_hash = '{cohort_hash}'
-                    limit 1
-                    """
-                ))
-                if len(any_existing_rows) == 1:
-                    logger.debug("Since nonzero existing protected_groups found, skipping")
-                    continue
+        if self.replace or table_is_new:
+            missing_dates = list(as_of_dates)
+        else:
+            missing_dates = self.missing_as_of_dates(as_of_dates, cohort_hash)
 
+        if missing_dates:
             logger.debug(
-                "Generating protected groups for as of date {as_of_date} "
+                f"Generating protected groups for {len(missing_dates)} as of dates"
             )
-            self.generate(
-                start_date=as_of_date,
+            self.generate_dates(
+                as_of_dates=missing_dates,
                 cohort_table_name=cohort_table_name,
                 cohort_hash=cohort_hash
             )
+        else:
+            logger.debug("Since nonzero existing protected_groups found for all as of dates, skipping")
+
         if table_is_new:
             self.db_engine.execute(f"create index on {self.protected_groups_table_name} (cohort_hash, as_of_date)")
+        self.generations[cohort_hash] = self._generation_stamp(cohort_hash)
         nrows = self.db_engine.execute(
             "select count(*) from {}".format(self.protected_groups_table_name)
         ).scalar()
@@ -102,25 +104,67 @@ class ProtectedGroupsGenerator:
                            f"{self.protected_groups_table_name} successfully")
             logger.spam(f"Protected groups table has {nrows} rows")
 
-    def generate(self, start_date, cohort_table_name, cohort_hash):
+    def missing_as_of_dates(self, as_of_dates, cohort_hash):
+        """Find the as of dates without protected groups for the given cohort
+
+        Uses a single anti-join against the protected groups table instead of
+        probing the table once per date.
+
+        Args:
+            as_of_dates (list) the as_of_dates to look for
+            cohort_hash (str) the cohort the protected groups belong to
+
+        Returns: (list) of the given as_of_dates that have no rows, in their given order
+        """
+        as_of_dates = list(as_of_dates)
+        if not as_of_dates:
+            return as_of_dates
+        logger.spam(
+            f"Looking for existing protected_groups for {len(as_of_dates)} as of dates"
+        )
+        missing_date_nums = self.db_engine.execute(
+            f"""select requested.date_num
+            from unnest({_sql_date_array(as_of_dates)}) with ordinality as requested (as_of_date, date_num)
+            where not exists (
+                select 1 from {self.protected_groups_table_name} as existing
+                where existing.as_of_date = requested.as_of_date
+                and existing.cohort_hash = '{cohort_hash}'
+            )
+            order by requested.date_num
+            """
+        )
+        missing_dates = [as_of_dates[row[0] - 1] for row in missing_date_nums]
+        logger.debug(
+            f"Nonzero existing protected_groups found for "
+            f"{len(as_of_dates) - len(missing_dates)} as of dates, skipping them"
+        )
+        return missing_dates
+
+    def generate_dates(self, as_of_dates, cohort_table_name, cohort_hash):
+        """Insert the protected groups of all the given as of dates in one set-based query
+
+        Each cohort member gets the attributes of the latest from_obj row
+        known before the as of date.
+        """
         full_insert_query = text(textwrap.dedent(
             """
             insert into {protected_groups_table}
             select distinct on (cohort.entity_id, cohort.as_of_date)
                 cohort.entity_id,
-                '{as_of_date}'::date as as_of_date,
+                cohort.as_of_date::date as as_of_date,
                 {attribute_columns},
                 \'{cohort_hash}\' as cohort_hash
             from {cohort_table_name} cohort
+            join unnest({as_of_dates}) as dates (as_of_date)
+                on cohort.as_of_date = dates.as_of_date
             left join (select * from {from_obj}) from_obj  on
                 cohort.entity_id = from_obj.{entity_id_column} and
                 cohort.as_of_date > from_obj.{knowledge_date_column}
-            where cohort.as_of_date = '{as_of_date}'::date
             order by cohort.entity_id, cohort.as_of_date, {knowledge_date_column} desc
         """
         ).format(
             protected_groups_table=self.protected_groups_table_name,
-            as_of_date=start_date,
+            as_of_dates=_sql_date_array(as_of_dates),
             attribute_columns=", ".join([str(col) for col in self.attribute_columns]),
             cohort_hash=cohort_hash,
             cohort_table_name=cohort_table_name,
@@ -131,15 +175,72 @@ class ProtectedGroupsGenerator:
         logger.debug("Running protected_groups creation query")
         logger.spam(full_insert_query)
         self.db_engine.execute(full_insert_query)
+        # until generate_all_dates records the new generation, read it from the table
+        self.generations.pop(cohort_hash, None)
+
+    def generate(self, start_date, cohort_table_name, cohort_hash):
+        self.generate_dates(
+            as_of_dates=[start_date],
+            cohort_table_name=cohort_table_name,
+            cohort_hash=cohort_hash
+        )
 
     def as_dataframe(self, as_of_dates, cohort_hash):
         """Queries the protected groups table to retrieve the protected attributes for each date
+
+        Results are kept in a process-local LRU cache keyed on the table, the
+        dates and the cohort, since every model tested on the same matrix
+        needs the same protected groups. A cached dataframe is only used for
+        the generation of the rows it was read from: the one this generator
+        (or the copy it was made from, in a worker process) last wrote, or
+        if it wrote none, the current one (see _generation_stamp).
+
         Args:
-            db_engine (sqlalchemy.engine) a database engine
             as_of_dates (list) the as_of_Dates to query
+            cohort_hash (str) the cohort the protected groups belong to
+
+        Returns: (pd.DataFrame) a dataframe with protected attributes for the given dates,
+            stored as categorical columns. It is shared with later calls, so must not
+            be modified
+        """
+        cache_key = (
+            str(self.db_engine.url),
+            self.protected_groups_table_name,
+            tuple(sorted(as_of_dates)),
+            cohort_hash,
+        )
+        generation_stamp = self.generations.get(cohort_hash)
+        if generation_stamp is None:
+            generation_stamp = self._generation_stamp(cohort_hash)
+        cached = _protected_groups_cache.get(cache_key)
+        if cached is not None and cached[0] == generation_stamp:
+            logger.spam(f"Protected groups for {len(as_of_dates)} as of dates found in cache")
+            _protected_groups_cache.move_to_end(cache_key)
+        else:
+            _protected_groups_cache[cache_key] = (
+                generation_stamp,
+                self._query_dataframe(as_of_dates, cohort_hash),
+            )
+            _protected_groups_cache.move_to_end(cache_key)
+            while len(_protected_groups_cache) > PROTECTED_GROUPS_CACHE_SIZE:
+                _protected_groups_cache.popitem(last=False)
+        return _protected_groups_cache[cache_key][1]
 
-        Returns: (pd.DataFrame) a dataframe with protected attributes for the given dates
+    def _generation_stamp(self, cohort_hash):
+        """Identify the generation of a cohort's protected groups rows
+
+        The number of rows and the latest transaction that wrote them, which any
+        regeneration (in this process or another) changes. Read through the
+        (cohort_hash, as_of_date) index, without transferring the rows.
         """
+        return tuple(self.db_engine.execute(
+            f"""select count(*), max(xmin::text::bigint)
+            from {self.protected_groups_table_name}
+            where cohort_hash = '{cohort_hash}'
+            """
+        ).first())
+
+    def _query_dataframe(self, as_of_dates, cohort_hash):
         as_of_dates_sql = "[{}]".format(
             ", ".join("'{}'".format(date.strftime("%Y-%m-%d %H:%M:%S.%f")) for date in as_of_dates)
         )
@@ -158,6 +259,21 @@ class ProtectedGroupsGenerator:
             parse_dates=["as_of_date"],
             index_col=MatrixStore.indices,
         )
-        protected_df[self.attribute_columns] = protected_df[self.attribute_columns].astype(str)
+        protected_df[self.attribute_columns] = (
+            protected_df[self.attribute_columns].astype(str).astype("category")
+        )
         del protected_df['cohort_hash']
         return protected_df
+
+
+def clear_protected_groups_cache(protected_groups_table_name=None):
+    """Drop cached protected groups dataframes, either all of them or a single table's"""
+    for cache_key in list(_protected_groups_cache):
+        if protected_groups_table_name is None or cache_key[1] == protected_groups_table_name:
+            del _protected_groups_cache[cache_key]
+
+
+def _sql_date_array(as_of_dates):
+    return "array[{}]::date[]".format(
+        ", ".join(f"'{as_of_date}'" for as_of_date in as_of_dates)
+    )
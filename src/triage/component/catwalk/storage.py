@@ -1,20 +1,27 @@
 # coding: utf-8
 
-import itertools
+from collections import OrderedDict
 
 import verboselogs, logging
 logger = verboselogs.VerboseLogger(__name__)
 
+import hashlib
+import io
 import os
 import pathlib
+import shutil
+import tempfile
 from contextlib import contextmanager
 from os.path import dirname
 from urllib.parse import urlparse
 
 import gzip
+import numpy as np
 import pandas as pd
+import scipy.sparse
 import s3fs
 import wrapt
+from boto3.s3.transfer import TransferConfig
 import yaml
 import joblib
 
@@ -30,7 +37,35 @@ from triage.component.results_schema import (
     TestAequitas,
     TrainAequitas
 )
-from triage.util.pandas import downcast_matrix
+from triage.util.pandas import downcast_matrix, to_sparse_matrix
+
+
+DEFAULT_MODEL_COMPRESSION = "zlib:3"
+DEFAULT_LOCAL_CACHE_SIZE = 10 * 2 ** 30  # bytes
+DEFAULT_S3_PART_SIZE = 64 * 2 ** 20  # bytes
+DEFAULT_S3_MAX_CONCURRENCY = 10
+CSV_WRITE_CHUNK_CELLS = 5 * 10 ** 6
+
+
+def model_compression(compression):
+    """Convert a model compression setting into joblib's `compress` argument
+
+    Args:
+        compression (string) 'none', a joblib codec name (e.g. 'zlib', 'lz4'),
+            or a codec name and compression level separated by a colon (e.g. 'lz4:1')
+
+    Returns: (bool or tuple) False for no compression, else a (codec, level) tuple
+    """
+    if compression in (None, "", "none"):
+        return False
+    codec, _, level = compression.partition(":")
+    try:
+        compress = (codec, int(level or 3))
+        # fails for codecs joblib does not know about or whose library is missing
+        joblib.dump(None, io.BytesIO(), compress=compress)
+    except (ValueError, ImportError) as exc:
+        raise ValueError(f"Unusable model compression '{compression}': {exc}") from exc
+    return compress
 
 
 class Store:
@@ -71,6 +106,10 @@ class Store:
     def exists(self):
         raise NotImplementedError
 
+    def filenames(self):
+        """The names of the files in this store's path, treated as a directory"""
+        raise NotImplementedError
+
     def load(self):
         with self.open("rb") as fd:
             return fd.read()
@@ -79,6 +118,24 @@ class Store:
         with self.open("wb") as fd:
             fd.write(bytestream)
 
+    def download(self, fileobj):
+        """Copy the whole file into a writable binary file object"""
+        with self.open("rb") as fd:
+            shutil.copyfileobj(fd, fileobj)
+
+    @contextmanager
+    def local_file(self):
+        """Open the whole file for reading from the local disk, for reads
+        that need all of it rather than just its beginning"""
+        with self.open("rb") as fd:
+            yield fd
+
+    def link_from(self, other):
+        """Make this store hold the same bytes as another store of the same medium,
+        as cheaply as the medium allows"""
+        with self.open("wb") as fd:
+            other.download(fd)
+
     def open(self, *args, **kwargs):
         raise NotImplementedError
 
@@ -96,34 +153,71 @@ class S3Store(Store):
         path_head, *path_parts: one or more path components,
             (to be joined by PurePosixPath to create the final path).
 
+        cache (LocalStoreCache, optional): a local cache to read the object through
+
+        part_size (int, optional): the size in bytes of the parts that whole objects are
+            uploaded and downloaded in. Defaults to 64MiB
+
+        max_concurrency (int, optional): how many parts to upload or download at once.
+            Defaults to 10
+
         **config: arguments to be passed to the S3Fs client constructor.
 
     """
-    class S3FileWrapper(wrapt.ObjectProxy):
+    class UploadOnClose(wrapt.ObjectProxy):
+        """A local temporary file that is uploaded to S3 when closed"""
+
+        def __init__(self, store):
+            super().__init__(tempfile.TemporaryFile())
+            self._self_store = store
 
-        # don't allow wrapped object to take wrapper's place
-        # upon __enter__
         def __enter__(self):
             return self
 
-        def write(self, data, block_size=(5 * 2 ** 20)):
-            out = 0
-
-            for offset in itertools.count(0, block_size):
-                chunk = data[offset:(offset + block_size)]
-
-                if not chunk:
-                    return out
+        def __exit__(self, exc_type, exc_value, traceback):
+            if exc_type is None:
+                self.close()
+            else:
+                # don't upload partially written files
+                self.__wrapped__.close()
 
-                out += self.__wrapped__.write(chunk)
+        def close(self):
+            if not self.__wrapped__.closed:
+                self.__wrapped__.seek(0)
+                self._self_store.upload(self.__wrapped__)
+                self.__wrapped__.close()
 
-    def __init__(self, path_head, *path_parts, **config):
+    def __init__(
+        self,
+        path_head,
+        *path_parts,
+        cache=None,
+        part_size=DEFAULT_S3_PART_SIZE,
+        max_concurrency=DEFAULT_S3_MAX_CONCURRENCY,
+        **config
+    ):
         self.path = str(
             pathlib.PurePosixPath(path_head.replace('s3://', ''),
                                   *path_parts)
         )
+        self.cache = cache
+        self.part_size = part_size
+        self.max_concurrency = max_concurrency
         self.config = config
 
+    @property
+    def transfer_config(self):
+        return TransferConfig(
+            multipart_threshold=self.part_size,
+            multipart_chunksize=self.part_size,
+            max_concurrency=self.max_concurrency,
+        )
+
+    @property
+    def bucket_and_key(self):
+        bucket, _, key = self.path.partition("/")
+        return bucket, key
+
     @property
     def client(self):
         return s3fs.S3FileSystem(**self.config)
@@ -131,15 +225,164 @@ class S3Store(Store):
     def exists(self):
         return self.client.exists(self.path)
 
+    def filenames(self):
+        # one listing request per 1000 objects, instead of one request per object
+        try:
+            return [
+                pathlib.PurePosixPath(entry["name"]).name
+                for entry in self.client.ls(self.path, detail=True)
+                if entry["type"] == "file"
+            ]
+        except FileNotFoundError:
+            return []
+
+    def etag(self):
+        """The object's current ETag, which changes whenever it is rewritten"""
+        self.client.invalidate_cache(self.path)
+        return self.client.info(self.path)["ETag"].strip('"')
+
     def delete(self):
         self.client.rm(self.path)
 
-    def open(self, *args, **kwargs):
-        # NOTE: remove S3FileWrapper as soon as s3fs properly
-        # NOTE: chunks out too-large writes
-        # NOTE: see also: tests.catwalk_tests.test_storage.test_S3Store_large
-        s3file = self.client.open(self.path, *args, **kwargs)
-        return self.S3FileWrapper(s3file)
+    def upload(self, fileobj):
+        """Upload a readable binary file object, in parallel parts if it is large"""
+        self.client.s3.upload_fileobj(
+            fileobj, *self.bucket_and_key, Config=self.transfer_config
+        )
+        self.client.invalidate_cache(self.path)
+
+    def download(self, fileobj):
+        """Download the object into a writable binary file object, in parallel parts
+        if it is large"""
+        self.client.s3.download_fileobj(
+            *self.bucket_and_key, fileobj, Config=self.transfer_config
+        )
+
+    def load(self):
+        if self.cache is not None:
+            return super().load()
+        bytestream = io.BytesIO()
+        self.download(bytestream)
+        return bytestream.getvalue()
+
+    def write(self, bytestream):
+        self.upload(io.BytesIO(bytestream))
+
+    def link_from(self, other):
+        # S3 has no links, but a server-side copy saves the round trip through this host
+        bucket, key = other.bucket_and_key
+        self.client.s3.copy(
+            {"Bucket": bucket, "Key": key},
+            *self.bucket_and_key,
+            Config=self.transfer_config,
+        )
+        self.client.invalidate_cache(self.path)
+
+    @contextmanager
+    def local_file(self):
+        if self.cache is not None:
+            with self.open("rb") as fd:
+                yield fd
+            return
+        with tempfile.TemporaryFile() as fd:
+            self.download(fd)
+            fd.seek(0)
+            yield fd
+
+    def open(self, mode="rb", *args, **kwargs):
+        if self.cache is not None and mode in ("r", "rb"):
+            return self.cache.open(self, mode)
+        if mode == "wb":
+            return self.UploadOnClose(self)
+        return self.client.open(self.path, mode, *args, **kwargs)
+
+
+def remove_if_exists(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class LocalStoreCache:
+    """Keep local copies of remote files read through S3Stores
+
+    Copies are named after the remote path and its ETag, so files rewritten
+    remotely are copied again, and are written to a temporary file and renamed
+    into place so processes sharing the directory never read a partial copy.
+    Once the directory holds more than max_bytes, the least recently read
+    copies are removed.
+
+    Args:
+        directory (string) A directory on the local disk to keep copies in
+        max_bytes (int, optional) How large the copies may grow in total. Defaults to 10GiB
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_LOCAL_CACHE_SIZE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def open(self, store, mode="rb"):
+        """Open a local copy of the store's file, copying it first if needed
+
+        Args:
+            store (S3Store) The remote file
+            mode (string) 'r' or 'rb'
+
+        Returns: a local file object
+        """
+        prefix = hashlib.md5(store.path.encode("utf-8")).hexdigest()
+        path = os.path.join(self.directory, f"{prefix}-{store.etag()}")
+        try:
+            fd = open(path, mode)
+        except FileNotFoundError:
+            pass
+        else:
+            # mark it as recently used
+            os.utime(path)
+            return fd
+        logger.debug(f"Copying {store} to {path}")
+        os.makedirs(self.directory, exist_ok=True)
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temporary_path, "wb") as copy_file:
+                store.download(copy_file)
+            os.replace(temporary_path, path)
+        except BaseException:
+            # eviction skips temporary files, so a failed copy must not be left behind
+            remove_if_exists(temporary_path)
+            raise
+        fd = open(path, mode)
+        self.evict(keep=path)
+        return fd
+
+    def evict(self, keep):
+        """Remove outdated copies, then the least recently used ones beyond max_bytes"""
+        copies = []
+        kept_prefix = os.path.basename(keep).split("-")[0]
+        for filename in os.listdir(self.directory):
+            path = os.path.join(self.directory, filename)
+            if filename.endswith(".tmp") or path == keep:
+                continue
+            try:
+                if filename.split("-")[0] == kept_prefix:
+                    os.remove(path)
+                    continue
+                stat = os.stat(path)
+            except FileNotFoundError:
+                # removed by another process
+                continue
+            copies.append((stat.st_mtime, stat.st_size, path))
+        total_bytes = os.path.getsize(keep) + sum(size for _, size, _ in copies)
+        for _, size, path in sorted(copies):
+            if total_bytes <= self.max_bytes:
+                break
+            logger.debug(f"Removing local copy {path}")
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
 
 
 class FSStore(Store):
@@ -165,11 +408,28 @@ class FSStore(Store):
     def exists(self):
         return os.path.isfile(self.path)
 
+    def filenames(self):
+        if not self.path.is_dir():
+            return []
+        return [path.name for path in self.path.iterdir() if path.is_file()]
+
     def delete(self):
         os.remove(self.path)
 
-    def open(self, *args, **kwargs):
-        return open(self.path, *args, **kwargs)
+    def link_from(self, other):
+        if self.exists():
+            os.remove(self.path)
+        try:
+            os.link(other.path, self.path)
+        except OSError:
+            # e.g. the filesystem does not support hard links
+            shutil.copyfile(other.path, self.path)
+
+    def open(self, mode="r", *args, **kwargs):
+        if "w" in mode and self.exists() and os.stat(self.path).st_nlink > 1:
+            # unlink first, so rewriting a file does not rewrite its hard-linked copies
+            os.remove(self.path)
+        return open(self.path, mode, *args, **kwargs)
 
 
 class ProjectStorage:
@@ -178,11 +438,35 @@ class ProjectStorage:
     Args:
         project_path (string): The base path for all files in the project.
             The scheme prefix of the path will determine the storage medium.
+        local_cache_directory (string, optional): A directory on the local disk in
+            which to keep copies of the files read from S3, so reading them again
+            from the same host does not download them again
+        local_cache_size (int, optional): How many bytes the local copies may take up.
+            Defaults to 10GiB
+        s3_part_size (int, optional): The size in bytes of the parts that whole files are
+            uploaded to and downloaded from S3 in. Defaults to 64MiB
+        s3_max_concurrency (int, optional): How many parts of a file to upload or
+            download at once. Defaults to 10
     """
 
-    def __init__(self, project_path):
+    def __init__(
+        self,
+        project_path,
+        local_cache_directory=None,
+        local_cache_size=DEFAULT_LOCAL_CACHE_SIZE,
+        s3_part_size=DEFAULT_S3_PART_SIZE,
+        s3_max_concurrency=DEFAULT_S3_MAX_CONCURRENCY,
+    ):
         self.project_path = project_path
         self.storage_class = Store.factory(self.project_path).__class__
+        self.store_kwargs = {}
+        if self.storage_class is S3Store:
+            self.store_kwargs["part_size"] = s3_part_size
+            self.store_kwargs["max_concurrency"] = s3_max_concurrency
+            if local_cache_directory:
+                self.store_kwargs["cache"] = LocalStoreCache(
+                    local_cache_directory, local_cache_size
+                )
 
     def get_store(self, directories, leaf_filename):
         """Return a storage object for one filename
@@ -194,7 +478,21 @@ class ProjectStorage:
         Returns:
             triage.component.catwalk.storage.Store object
         """
-        return self.storage_class(self.project_path, *directories, leaf_filename)
+        return self.storage_class(
+            self.project_path, *directories, leaf_filename, **self.store_kwargs
+        )
+
+    def list_filenames(self, directories):
+        """List the files in one directory
+
+        Args:
+        directories (list): A list of subdirectories
+
+        Returns: (list) of filenames without any directory information
+        """
+        return self.storage_class(
+            self.project_path, *directories, **self.store_kwargs
+        ).filenames()
 
     def matrix_storage_engine(self, matrix_storage_class=None, matrix_directory=None):
         """Return a matrix storage engine bound to this project's storage
@@ -207,15 +505,101 @@ class ProjectStorage:
         """
         return MatrixStorageEngine(self, matrix_storage_class, matrix_directory)
 
-    def model_storage_engine(self, model_directory=None):
+    def model_storage_engine(self, model_directory=None, **kwargs):
         """Return a model storage engine bound to this project's storage
 
         Args:
             model_directory (string, optional) A directory to store models
                 If not passed will allow the ModelStorageEngine to decide
+            **kwargs: compression, mmap_mode and model_cache, passed on to the
+                ModelStorageEngine
         Returns: triage.component.catwalk.storage.ModelStorageEngine
         """
-        return ModelStorageEngine(self, model_directory)
+        return ModelStorageEngine(self, model_directory, **kwargs)
+
+
+class ModelCache:
+    """Keep the most recently loaded models in memory, across tasks
+
+    Models are evicted least recently used first, once the cache holds more than
+    max_models of them or their stored sizes add up to more than max_bytes. When pickled
+    (e.g. to send a ModelStorageEngine to a worker process), the cached models are left
+    behind, and the cache is unpickled as its process's shared cache of the same size.
+
+    Args:
+        max_models (int, optional) How many models to keep
+        max_bytes (int, optional) How many bytes of stored models to keep
+    """
+
+    def __init__(self, max_models=None, max_bytes=None):
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self.models = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __reduce__(self):
+        return (shared_model_cache, (self.max_models, self.max_bytes))
+
+    def __contains__(self, key):
+        return key in self.models
+
+    def get(self, key):
+        """The cached model, or None if it is not cached"""
+        if key not in self.models:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.models.move_to_end(key)
+        return self.models[key][0]
+
+    def put(self, key, model, stored_bytes):
+        self.discard(key)
+        self.models[key] = (model, stored_bytes)
+        self.total_bytes += stored_bytes
+        while len(self.models) > 1 and (
+            (self.max_models is not None and len(self.models) > self.max_models)
+            or (self.max_bytes is not None and self.total_bytes > self.max_bytes)
+        ):
+            evicted_key, (_, evicted_bytes) = self.models.popitem(last=False)
+            logger.spam(f"Evicting model {evicted_key} from cache")
+            self.total_bytes -= evicted_bytes
+            self.evictions += 1
+
+    def discard(self, key):
+        if key in self.models:
+            _, stored_bytes = self.models.pop(key)
+            self.total_bytes -= stored_bytes
+
+    @property
+    def stats(self):
+        return {
+            "models": len(self.models),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+_shared_model_caches = {}
+
+
+def shared_model_cache(max_models=None, max_bytes=None):
+    """The process's ModelCache of the given size, shared by every caller asking for it
+
+    Args:
+        max_models (int, optional) How many models to keep
+        max_bytes (int, optional) How many bytes of stored models to keep
+
+    Returns: (ModelCache)
+    """
+    key = (os.getpid(), max_models, max_bytes)
+    if key not in _shared_model_caches:
+        _shared_model_caches[key] = ModelCache(max_models, max_bytes)
+    return _shared_model_caches[key]
 
 
 class ModelStorageEngine:
@@ -226,10 +610,29 @@ class ModelStorageEngine:
             A project file storage engine
         model_directory (string, optional) A directory name for models.
             Defaults to 'trained_models'
+        compression (string, optional) How to compress models, either 'none' or
+            a joblib codec with an optional level, like 'lz4:1'. Defaults to 'zlib:3'.
+            Models are loaded whatever codec they were written with.
+        mmap_mode (string, optional) A numpy memory map mode (e.g. 'r') with which to
+            load the arrays inside uncompressed models stored on the local filesystem,
+            instead of reading them into memory
+        model_cache (ModelCache, optional) A cache to keep loaded models in, which can
+            be shared with other engines (see shared_model_cache). Unlike cache_models,
+            it outlives each task.
     """
-    def __init__(self, project_storage, model_directory=None):
+    def __init__(
+        self,
+        project_storage,
+        model_directory=None,
+        compression=DEFAULT_MODEL_COMPRESSION,
+        mmap_mode=None,
+        model_cache=None,
+    ):
         self.project_storage = project_storage
         self.directories = [model_directory or "trained_models"]
+        self.compress = model_compression(compression)
+        self.mmap_mode = mmap_mode
+        self.model_cache = model_cache
         self.should_cache = False
         self.reset_cache()
 
@@ -256,12 +659,18 @@ class ModelStorageEngine:
         Args:
             obj  (object) A picklable model object
             model_hash (string) An identifier, unique within this project, for the model
+
+        Returns: (int) The number of bytes stored
         """
         if self.should_cache:
             logger.spam(f"Caching model {model_hash}")
             self.cache[model_hash] = obj
-        with self._get_store(model_hash).open("wb") as fd:
-            joblib.dump(obj, fd, compress=True)
+        store = self._get_store(model_hash)
+        if self.model_cache is not None:
+            self.model_cache.discard(str(store.path))
+        with store.open("wb") as fd:
+            joblib.dump(obj, fd, compress=self.compress)
+            return fd.tell()
 
     def load(self, model_hash):
         """Load a model object using joblib
@@ -274,8 +683,36 @@ class ModelStorageEngine:
         if self.should_cache and model_hash in self.cache:
             logger.spam(f"Returning model {model_hash} from cache")
             return self.cache[model_hash]
-        with self._get_store(model_hash).open("rb") as fd:
-            return joblib.load(fd)
+        store = self._get_store(model_hash)
+        if self.model_cache is not None:
+            model = self.model_cache.get(str(store.path))
+            if model is not None:
+                logger.spam(f"Returning model {model_hash} from model cache")
+                return model
+        if self.mmap_mode and not self.compress and isinstance(store, FSStore):
+            # memory mapping needs a filename, and does not apply to compressed arrays
+            model = joblib.load(str(store.path), mmap_mode=self.mmap_mode)
+            stored_bytes = os.path.getsize(store.path)
+        else:
+            with store.local_file() as fd:
+                model = joblib.load(fd)
+                stored_bytes = os.fstat(fd.fileno()).st_size
+        if self.model_cache is not None:
+            self.model_cache.put(str(store.path), model, stored_bytes)
+        return model
+
+    def is_cached(self, model_hash):
+        """Whether loading the model would return it from memory rather than storage
+
+        Args:
+            model_hash (string) An identifier, unique within this project, for the model
+
+        Returns: (bool)
+        """
+        return (self.should_cache and model_hash in self.cache) or (
+            self.model_cache is not None
+            and str(self._get_store(model_hash).path) in self.model_cache
+        )
 
     def exists(self, model_hash):
         """Check whether the model is persisted
@@ -287,13 +724,23 @@ class ModelStorageEngine:
         """
         return self._get_store(model_hash).exists()
 
+    def stored_model_hashes(self):
+        """List every persisted model at once, instead of checking them one by one
+
+        Returns: (set) of the identifiers of the models in project storage
+        """
+        return set(self.project_storage.list_filenames(self.directories))
+
     def delete(self, model_hash):
         """Delete the model identified by this hash from project storage
 
         Args:
             model_hash (string) An identifier, unique within this project, for the model
         """
-        return self._get_store(model_hash).delete()
+        store = self._get_store(model_hash)
+        if self.model_cache is not None:
+            self.model_cache.discard(str(store.path))
+        return store.delete()
 
     def _get_store(self, model_hash):
         return self.project_storage.get_store(self.directories, model_hash)
@@ -476,10 +923,10 @@ class MatrixStore:
     @property
     def as_of_dates(self):
         """All as-of-dates in the matrix. Will be converted to datetime.date"""
-        return sorted(set(
+        return sorted(
             as_of_date.date() if hasattr(as_of_date, 'date') else as_of_date
-            for entity_id, as_of_date in self.design_matrix.index
-        ))
+            for as_of_date in self.design_matrix.index.get_level_values("as_of_date").unique()
+        )
 
     @property
     def num_entities(self):
@@ -561,6 +1008,33 @@ class MatrixStore:
     def save(self):
         raise NotImplementedError
 
+    def save_metadata(self):
+        with self.metadata_base_store.open("wb") as fd:
+            yaml.dump(self.metadata, fd, encoding="utf-8")
+
+    def link_from(self, other):
+        """Store this matrix's metadata, pointing at the data already stored for
+        another matrix of the same format, rather than writing the data again
+
+        Args:
+            other (MatrixStore) A stored matrix whose data is identical to this one's
+        """
+        self.matrix_base_store.link_from(other.matrix_base_store)
+        self.save_metadata()
+
+    def save_blocks(self, feature_blocks, labels):
+        """Save a matrix given as column blocks, without building the design matrix
+        where the storage format does not need it
+
+        Args:
+            feature_blocks (list) of pandas.DataFrames holding the features, sharing the
+                same entity_id/as_of_date index in the same order
+            labels (pandas.Series) The labels, in the same order
+        """
+        design_matrix = pd.concat(feature_blocks, axis=1, copy=False)
+        self.matrix_label_tuple = design_matrix, labels
+        self.save()
+
     def clear_cache(self):
         self._matrix_label_tuple = None
 
@@ -592,13 +1066,130 @@ class CSVMatrixStore(MatrixStore):
         return head_of_matrix
 
     def _load(self):
-        with self.matrix_base_store.open("rb") as fd:
+        with self.matrix_base_store.local_file() as fd:
             return pd.read_csv(fd, compression="gzip", parse_dates=["as_of_date"])
 
     def save(self):
-        self.matrix_base_store.write(gzip.compress(self.full_matrix_for_saving.to_csv(None).encode("utf-8")))
-        with self.metadata_base_store.open("wb") as fd:
-            yaml.dump(self.metadata, fd, encoding="utf-8")
+        self.save_blocks(*self.matrix_label_tuple)
+
+    def save_blocks(self, feature_blocks, labels):
+        """Write the matrix a chunk of rows at a time, straight into the compressed file
+
+        Only one chunk of rows (of CSV_WRITE_CHUNK_CELLS values) is copied at a time,
+        the label column being added to each chunk, rather than the whole matrix.
+        """
+        if isinstance(feature_blocks, pd.DataFrame):
+            feature_blocks = [feature_blocks]
+        num_rows = len(feature_blocks[0])
+        num_columns = sum(len(block.columns) for block in feature_blocks) + 1
+        chunk_rows = max(1, CSV_WRITE_CHUNK_CELLS // num_columns)
+        with self.matrix_base_store.open("wb") as fd:
+            with gzip.GzipFile(fileobj=fd, mode="wb") as compressed:
+                with io.TextIOWrapper(compressed, encoding="utf-8", newline="") as text:
+                    # the header is written along with the first, possibly empty, chunk
+                    for start in range(0, max(num_rows, 1), chunk_rows):
+                        chunk = [block.iloc[start:start + chunk_rows] for block in feature_blocks]
+                        if labels is not None:
+                            chunk.append(
+                                labels.iloc[start:start + chunk_rows].rename(self.label_column_name)
+                            )
+                        pd.concat(chunk, axis=1).to_csv(text, header=(start == 0))
+        self.save_metadata()
+
+
+class SparseMatrixStore(MatrixStore):
+    """Store and access matrices as compressed sparse columns
+
+    Suited to wide matrices that are mostly zeros, like those with many
+    categorical features. The features are loaded as sparse pandas columns,
+    which stay sparse through downcasting and can be given to estimators
+    as a scipy.sparse matrix.
+    """
+
+    suffix = "npz"
+
+    @contextmanager
+    def _open_arrays(self):
+        # from a real file, np.load only reads the members that are asked for
+        with self.matrix_base_store.local_file() as fd:
+            with np.load(fd, allow_pickle=False) as arrays:
+                yield arrays
+
+    def _load_arrays(self, *names):
+        with self._open_arrays() as arrays:
+            return {name: arrays[name] for name in names if name in arrays.files}
+
+    @property
+    def head_of_matrix(self):
+        try:
+            matrix = self._load()
+        except FileNotFoundError:
+            logger.exception(f"Matrix {self.uuid} not found Returning Empty data frame")
+            return pd.DataFrame()
+        return matrix.head(1)
+
+    @property
+    def empty(self):
+        if not self.matrix_base_store.exists():
+            return True
+        return self._load_arrays("shape")["shape"][0] == 0
+
+    def columns(self, include_label=False):
+        """The matrix's column list, read without loading the matrix itself"""
+        with self._open_arrays() as arrays:
+            columns = arrays["columns"].tolist()
+            if include_label and "label" in arrays.files:
+                columns.append(self.label_column_name)
+        return columns
+
+    def _load(self):
+        arrays = self._load_arrays(
+            "data", "indices", "indptr", "shape", "columns", "entity_id", "as_of_date", "label"
+        )
+        features = scipy.sparse.csc_matrix(
+            (arrays["data"], arrays["indices"], arrays["indptr"]),
+            shape=tuple(arrays["shape"]),
+        )
+        matrix = pd.DataFrame.sparse.from_spmatrix(
+            features,
+            index=pd.MultiIndex.from_arrays(
+                [arrays["entity_id"], arrays["as_of_date"]], names=self.indices
+            ),
+            columns=arrays["columns"].tolist(),
+        )
+        if "label" in arrays:
+            matrix[self.label_column_name] = arrays["label"]
+        return matrix
+
+    def save(self):
+        design_matrix, labels = self.matrix_label_tuple
+        if design_matrix.index.names != self.indices:
+            design_matrix = design_matrix.set_index(self.indices)
+            if labels is not None:
+                labels = labels.set_axis(design_matrix.index)
+        features = to_sparse_matrix(design_matrix, sparse_format="csc")
+        if features.dtype == np.float64:
+            # mixing int32 and float32 columns gives float64. Store float32 like every
+            # column used to get: it rounds integers beyond 2**24, which float64 would
+            # hold exactly. Loading compacts whole-number columns again
+            features = features.astype(np.float32)
+        arrays = {
+            "data": features.data,
+            "indices": features.indices,
+            "indptr": features.indptr,
+            "shape": np.array(features.shape),
+            "columns": np.array(design_matrix.columns, dtype=str),
+            "entity_id": design_matrix.index.get_level_values("entity_id").to_numpy(),
+            "as_of_date": design_matrix.index.get_level_values("as_of_date").to_numpy(
+                dtype="datetime64[ns]"
+            ),
+        }
+        if labels is not None:
+            arrays["label"] = labels.to_numpy()
+        matrix_bytes = io.BytesIO()
+        np.savez_compressed(matrix_bytes, **arrays)
+        self.matrix_base_store.write(matrix_bytes.getvalue())
+        self.save_metadata()
 
 
 class TestMatrixType:
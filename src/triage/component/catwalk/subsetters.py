@@ -1,6 +1,8 @@
 import verboselogs, logging
 logger = verboselogs.VerboseLogger(__name__)
 
+from collections import OrderedDict
+
 from sqlalchemy.orm import sessionmaker
 
 from triage.component.architect.entity_date_table_generators import EntityDateTableGenerator
@@ -26,6 +28,17 @@ class SubsetterNoOp:
             "No subsets configuration is available, so subset task  will not be created"
         )
 
+    def generate_query_tasks(self, tasks):
+        logger.notice(
+            "No subsets configuration is available, so subsets will not be created"
+        )
+        return {}
+
+    def finish_task(self, subset_config, subset_hash, subset_table_generator):
+        logger.notice(
+            "No subsets configuration is available, so subset task  will not be created"
+        )
+
     def save_subset_to_db(self, subset_hash, subset_config):
         logger.notice(
             "No subsets configuration is available, so subsets will not be created"
@@ -79,6 +92,34 @@ class Subsetter:
         self.save_subset_to_db(subset_hash, subset_config)
         logger.debug(f"Subset {subset_config['name']}-{subset_hash} created successfully")
 
+    def generate_query_tasks(self, tasks):
+        """SQL commands for creating and populating the tables of all given subsets
+
+        The inserts of each table cover batches of as-of-dates and can be
+        spread across database processes. Each subset must be finished with
+        `finish_task` once its commands have run.
+
+        Args:
+            tasks (list) subset tasks, as returned by generate_tasks
+
+        Returns: (dict) keys are subset table names, values are dicts with
+            prepare, inserts and finalize lists of SQL commands
+        """
+        query_tasks = OrderedDict()
+        for task in tasks:
+            query_tasks.update(
+                task["subset_table_generator"].generate_entity_date_table_tasks(
+                    as_of_dates=self.as_of_times
+                )
+            )
+        return query_tasks
+
+    def finish_task(self, subset_config, subset_hash, subset_table_generator):
+        """Check a subset table populated through generate_query_tasks and record it"""
+        subset_table_generator.check_entity_date_table(as_of_dates=self.as_of_times)
+        self.save_subset_to_db(subset_hash, subset_config)
+        logger.debug(f"Subset {subset_config['name']}-{subset_hash} created successfully")
+
     def save_subset_to_db(self, subset_hash, subset_config):
         session = sessionmaker(bind=self.db_engine)()
         session.merge(Subset(subset_hash=subset_hash, config=subset_config))
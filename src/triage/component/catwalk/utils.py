@@ -19,6 +19,19 @@ import sqlalchemy
 from retrying import retry
 from sqlalchemy.orm import sessionmaker
 from ohio import PipeTextIO
+from sklearn.dummy import DummyClassifier
+from sklearn.ensemble import (
+    AdaBoostClassifier,
+    ExtraTreesClassifier,
+    GradientBoostingClassifier,
+    RandomForestClassifier,
+)
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.naive_bayes import BernoulliNB, MultinomialNB
+from sklearn.neighbors import KNeighborsClassifier
+from sklearn.tree import DecisionTreeClassifier
+
+from triage.util.pandas import is_sparse_matrix, to_sparse_matrix
 
 from triage.component.results_schema import (
     Experiment,
@@ -41,6 +54,38 @@ def filename_friendly_hash(inputs):
     ).hexdigest()
 
 
+def matrix_data_fingerprint(feature_blocks, labels):
+    """A hash of a matrix's data alone, ignoring the metadata that goes into its uuid
+
+    Combines a hash of the entity_id/as_of_date index with a checksum of each column
+    (name and values), in column order, so matrices get the same fingerprint exactly
+    when their stored data would be the same.
+
+    Args:
+        feature_blocks (list) of pandas.DataFrames holding the features, sharing one index
+        labels (pandas.Series) The labels
+
+    Returns: (string) a hex digest
+    """
+    fingerprint = hashlib.md5()
+    fingerprint.update(
+        pd.util.hash_pandas_object(feature_blocks[0].index, index=False).values.tobytes()
+    )
+    columns = [
+        (name, column)
+        for block in feature_blocks
+        for (name, column) in block.items()
+    ]
+    columns.append((labels.name, labels))
+    for name, column in columns:
+        fingerprint.update(str(name).encode("utf-8"))
+        fingerprint.update(str(column.dtype).encode("utf-8"))
+        fingerprint.update(
+            pd.util.hash_pandas_object(column, index=False).values.tobytes()
+        )
+    return fingerprint.hexdigest()
+
+
 def get_subset_table_name(subset_config):
     return "subset_{}_{}".format(
         subset_config.get("name", "default"),
@@ -164,6 +209,202 @@ class Batch:
 AVAILABLE_TIEBREAKERS = {"random", "best", "worst"}
 
 
+# estimators known to fit and predict on scipy.sparse matrices. Other estimators
+# can opt in by setting an `accepts_sparse = True` attribute
+SPARSE_INPUT_ESTIMATORS = (
+    AdaBoostClassifier,
+    BernoulliNB,
+    DecisionTreeClassifier,
+    DummyClassifier,
+    ExtraTreesClassifier,
+    GradientBoostingClassifier,
+    KNeighborsClassifier,
+    LogisticRegression,
+    MultinomialNB,
+    RandomForestClassifier,
+    SGDClassifier,
+)
+
+
+def accepts_sparse(estimator):
+    """Whether an estimator can be given a scipy.sparse matrix"""
+    return getattr(estimator, "accepts_sparse", isinstance(estimator, SPARSE_INPUT_ESTIMATORS))
+
+
+def accepts_compact_dtypes(estimator):
+    """Whether an estimator can be given integer columns as they are stored, rather
+    than converted to floats. Estimators can opt in by setting an
+    `accepts_compact_dtypes = True` attribute"""
+    return getattr(estimator, "accepts_compact_dtypes", False)
+
+
+def _float_input(matrix, estimator):
+    if accepts_compact_dtypes(estimator) or all(
+        np.issubdtype(dtype, np.floating) for dtype in matrix.dtypes
+    ):
+        return matrix
+    # estimators would convert the integer columns themselves, but through whatever
+    # common type they have with the others (float64 alongside int32 and float32)
+    return matrix.astype(np.float32)
+
+
+def estimator_input(matrix, estimator):
+    """Prepare a design matrix to be given to an estimator's fit or predict methods
+
+    Matrices with sparse columns are converted to a CSR matrix for estimators that
+    accept them, and densified for those that don't. The compact integer columns of
+    dense matrices are converted to float32, unless the estimator accepts them as is.
+    Matrices of floats are returned as is.
+
+    Args:
+        matrix (pandas.DataFrame) a design matrix
+        estimator (object) the estimator the matrix will be given to
+
+    Returns: (pandas.DataFrame or scipy.sparse.csr_matrix)
+    """
+    if not is_sparse_matrix(matrix):
+        return _float_input(matrix, estimator)
+    if accepts_sparse(estimator):
+        return to_sparse_matrix(matrix, sparse_format="csr")
+    logger.debug(f"{estimator.__class__.__name__} does not accept sparse input, densifying matrix")
+    dense_matrix = matrix.copy(deep=False)
+    for column, dtype in matrix.dtypes.items():
+        if isinstance(dtype, pd.SparseDtype):
+            dense_matrix[column] = matrix[column].sparse.to_dense()
+    return _float_input(dense_matrix, estimator)
+
+
+class RankedPredictions:
+    """Predictions and their labels, sorted by score once for every tiebreaking rule
+
+    The scores are sorted a single time, on first use, and the blocks of tied scores
+    remembered. Each tiebreaker then only reorders the rows within those blocks, so the
+    predictions table's ranks, the evaluations' worst, best and random sorts and the
+    bias audits all share one sort of the scores.
+
+    Args:
+        predictions_proba (np.array) The predicted scores
+        labels (np.array) The numeric labels (1/0, not True/False)
+        df_index (pd.MultiIndex) Index (generally entity_id, as_of_date tuples) of the
+            labels/scores
+    """
+
+    def __init__(self, predictions_proba, labels, df_index):
+        self.predictions_proba = np.asarray(predictions_proba)
+        self.labels = np.asarray(labels)
+        self.df_index = pd.Index(df_index)
+        self._score_order = None
+
+    def __len__(self):
+        return len(self.predictions_proba)
+
+    def _set_score_order(self, score_order):
+        sorted_scores = self.predictions_proba[score_order]
+        starts_block = np.ones(len(sorted_scores), dtype=bool)
+        starts_block[1:] = sorted_scores[1:] != sorted_scores[:-1]
+        self._score_order = score_order
+        self._block_starts = np.flatnonzero(starts_block)
+        # the tie block of each row, in score order
+        self._tie_blocks = np.cumsum(starts_block) - 1
+
+    def _sort_by_score(self):
+        if self._score_order is None:
+            self._set_score_order(np.argsort(-self.predictions_proba, kind="stable"))
+        return self._score_order, self._tie_blocks
+
+    def _label_values(self):
+        return self.labels.astype(float)
+
+    def order(self, tiebreaker="random", sort_seed=None):
+        """The positions of the rows, sorted by score descending and the tiebreaking rule
+
+        Args:
+            tiebreaker (string) The tiebreaking method ('best', 'worst', 'random')
+            sort_seed (signed int) The sort seed. Needed if 'random' tiebreaking is picked.
+
+        Returns: (np.array) a permutation of the rows
+        """
+        score_order, tie_blocks = self._sort_by_score()
+        if tiebreaker == "random":
+            if not sort_seed:
+                raise ValueError("If random tiebreaker is used, a sort seed must be given")
+            random.seed(sort_seed)
+            np.random.seed(sort_seed)
+            tiebreak_keys = -np.random.rand(len(score_order))[score_order]
+        elif tiebreaker == "worst":
+            # negative labels first, and null labels before them
+            label_values = self._label_values()[score_order]
+            tiebreak_keys = np.where(np.isnan(label_values), -np.inf, label_values)
+        elif tiebreaker == "best":
+            # positive labels first, and null labels last
+            label_values = self._label_values()[score_order]
+            tiebreak_keys = np.where(np.isnan(label_values), np.inf, -label_values)
+        else:
+            raise ValueError(f"Unknown tiebreaker: {tiebreaker}")
+
+        # only the rows sharing their score with others need reordering
+        block_sizes = np.diff(np.append(self._block_starts, len(score_order)))
+        tied = np.flatnonzero(block_sizes[tie_blocks] > 1)
+        if not len(tied):
+            return score_order
+        order = score_order.copy()
+        order[tied] = score_order[tied][np.lexsort((tiebreak_keys[tied], tie_blocks[tied]))]
+        return order
+
+    def sorted(self, tiebreaker="random", sort_seed=None):
+        """Sort the predictions and labels with a tiebreaking rule
+
+        Returns:
+            (tuple) (predictions_proba, labels, df_index), sorted
+        """
+        order = self.order(tiebreaker, sort_seed)
+        return [self.predictions_proba[order], self.labels[order], self.df_index[order]]
+
+    def ranks(self, tiebreaker="random", sort_seed=None):
+        """The predictions, sorted with a tiebreaking rule, with their ranks
+
+        Returns: (pd.DataFrame) indexed like the predictions, with columns label_value,
+            score, rank_abs_no_ties, rank_abs_with_ties, rank_pct_no_ties and
+            rank_pct_with_ties
+        """
+        order = self.order(tiebreaker, sort_seed)
+        _, tie_blocks = self._sort_by_score()
+        num_rows, num_blocks = len(order), len(self._block_starts)
+        positions = np.arange(1, num_rows + 1)
+        return pd.DataFrame(
+            {
+                "label_value": self._label_values()[order],
+                "score": self.predictions_proba[order],
+                "rank_abs_no_ties": positions,
+                # tied rows share the lowest rank of their block
+                "rank_abs_with_ties": self._block_starts[tie_blocks] + 1,
+                "rank_pct_no_ties": positions / max(num_rows, 1),
+                # no gaps between blocks, so the last one reaches 1.0
+                "rank_pct_with_ties": (tie_blocks + 1) / max(num_blocks, 1),
+            },
+            index=self.df_index[order],
+        )
+
+    def subset(self, positions):
+        """The ranked predictions of some of the rows, without sorting them again
+
+        Args:
+            positions (np.array) the positions of the rows to keep, in the order to keep them
+
+        Returns: (RankedPredictions)
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        subset = RankedPredictions(
+            self.predictions_proba[positions], self.labels[positions], self.df_index[positions]
+        )
+        score_order, _ = self._sort_by_score()
+        subset_positions = np.full(len(self), -1, dtype=np.int64)
+        subset_positions[positions] = np.arange(len(positions))
+        subset_order = subset_positions[score_order]
+        subset._set_score_order(subset_order[subset_order >= 0])
+        return subset
+
+
 def sort_predictions_and_labels(
     predictions_proba, labels, df_index, tiebreaker="random", sort_seed=None
 ):
@@ -183,36 +424,7 @@ def sort_predictions_and_labels(
         logger.notice("No labels present, skipping predictions sorting .")
         return (predictions_proba, labels, df_index)
 
-    df = pd.DataFrame(predictions_proba, columns=["score"])
-    df["label_value"] = labels
-    df.set_index(df_index, inplace=True)
-
-    if tiebreaker == "random":
-        if not sort_seed:
-            raise ValueError("If random tiebreaker is used, a sort seed must be given")
-        random.seed(sort_seed)
-        np.random.seed(sort_seed)
-        df["random"] = np.random.rand(len(df))
-        df.sort_values(by=["score", "random"], inplace=True, ascending=[False, False])
-        df.drop("random", axis=1)
-    elif tiebreaker == "worst":
-        df.sort_values(
-            by=["score", "label_value"],
-            inplace=True,
-            ascending=[False, True],
-            na_position="first",
-        )
-    elif tiebreaker == "best":
-        df.sort_values(
-            by=["score", "label_value"],
-            inplace=True,
-            ascending=[False, False],
-            na_position="last",
-        )
-    else:
-        raise ValueError(f"Unknown tiebreaker: {tiebreaker}")
-
-    return [df["score"].to_numpy(), df["label_value"].to_numpy(), df.index]
+    return RankedPredictions(predictions_proba, labels, df_index).sorted(tiebreaker, sort_seed)
 
 
 @db_retry
@@ -233,6 +445,27 @@ def retrieve_model_id_from_hash(db_engine, model_hash):
         session.close()
 
 
+@db_retry
+def retrieve_model_ids_from_hashes(db_engine, model_hashes):
+    """Retrieves the ids of the models that match any of the given hashes in one query
+
+    Args:
+        db_engine (sqlalchemy.engine) A database engine
+        model_hashes (collection) The model hashes to lookup
+
+    Returns: (dict) The model ids keyed on model hash, for the hashes found in the DB
+    """
+    session = sessionmaker(bind=db_engine)()
+    try:
+        return dict(
+            session.query(Model.model_hash, Model.model_id)
+            .filter(Model.model_hash.in_(list(model_hashes)))
+            .all()
+        )
+    finally:
+        session.close()
+
+
 @db_retry
 def retrieve_model_hash_from_id(db_engine, model_id):
     """Retrieves the model hash associated with a given model id
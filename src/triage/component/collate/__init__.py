@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from .collate import available_imputations, Aggregation, Aggregate, Compare, Categorical
 from .from_obj import FromObj
+from .index_advisor import IndexAdvisor, IndexReport
 from .spacetime import SpacetimeAggregation
 
 __all__ = [
@@ -8,6 +9,8 @@ __all__ = [
     "Aggregation",
     "Aggregate",
     "FromObj",
+    "IndexAdvisor",
+    "IndexReport",
     "Compare",
     "Categorical",
     "SpacetimeAggregation",
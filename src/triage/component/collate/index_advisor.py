@@ -0,0 +1,195 @@
+import verboselogs, logging
+logger = verboselogs.VerboseLogger(__name__)
+
+from collections import namedtuple
+
+import sqlalchemy
+import sqlparse
+
+
+# table kinds postgres can build indexes on: tables, partitioned tables and materialized views
+INDEXABLE_RELKINDS = ("r", "p", "m")
+
+IndexReport = namedtuple(
+    "IndexReport",
+    [
+        "table",  # the source table found in the from_obj, None if it has none
+        "usable_indexes",  # names of existing indexes able to serve the date range filter
+        "missing_index_sql",  # create index statement to run if no usable index exists
+        "scan_cost",  # estimated total cost of scanning the source for one as of date
+        "seq_scan",  # whether the planner picks a sequential scan of the source
+    ],
+)
+
+
+class IndexAdvisor:
+    """Checks that the sources of SpacetimeAggregations are indexed for collate queries
+
+    Every collate insert filters its from_obj on a window of the knowledge date
+    column (and, when joining with the cohort, on the entity id), so each source
+    table should have a btree index led by the date column or by a group column
+    followed by the date column, or a BRIN index covering the date column.
+
+    Args:
+        db_engine (sqlalchemy.engine)
+        create_missing (bool) Whether to create the recommended index (and
+            analyze the table) when no usable one is found
+    """
+    def __init__(self, db_engine, create_missing=False):
+        self.db_engine = db_engine
+        self.create_missing = create_missing
+
+    def source_table(self, from_obj):
+        """The table a from_obj reads from, or None for subqueries"""
+        try:
+            (statement,) = sqlparse.parse(str(from_obj))
+        except ValueError:
+            return None
+        first_token = statement.token_first(skip_ws=True, skip_cm=True)
+        if not isinstance(first_token, sqlparse.sql.Identifier):
+            # a bare table name that sqlparse also knows as a keyword, e.g. events
+            if first_token is not None and first_token.ttype in (
+                sqlparse.tokens.Name, sqlparse.tokens.Keyword
+            ):
+                return first_token.value
+            return None
+        if first_token.has_alias() and first_token.get_alias() == first_token.get_real_name():
+            # a subquery with an alias, nothing to index
+            return None
+        if first_token.get_parent_name():
+            return f"{first_token.get_parent_name()}.{first_token.get_real_name()}"
+        return first_token.get_real_name()
+
+    def _relkind(self, table):
+        return self.db_engine.execute(
+            f"select relkind from pg_class where oid = to_regclass('{table}')"
+        ).scalar()
+
+    def existing_indexes(self, table):
+        """All indexes on the table
+
+        Returns: (list) of (index name, access method, list of column names) tuples,
+            with None standing in for expression columns
+        """
+        return [
+            (index_name, access_method, list(columns))
+            for index_name, access_method, columns in self.db_engine.execute(
+                f"""
+                select index_class.relname, am.amname,
+                    array_agg(attribute.attname order by index_key.ord)
+                from pg_index as index
+                join pg_class as index_class on index_class.oid = index.indexrelid
+                join pg_am as am on am.oid = index_class.relam
+                cross join lateral unnest(index.indkey) with ordinality as index_key (attnum, ord)
+                left join pg_attribute as attribute
+                    on attribute.attrelid = index.indrelid and attribute.attnum = index_key.attnum
+                where index.indrelid = to_regclass('{table}')
+                group by index_class.relname, am.amname
+                """
+            )
+        ]
+
+    @staticmethod
+    def is_usable(access_method, columns, group_columns, date_column):
+        """Whether an index can serve the knowledge date window of collate queries"""
+        if access_method == "brin":
+            return date_column in columns
+        if access_method != "btree" or not columns:
+            return False
+        return columns[0] == date_column or (
+            len(columns) > 1 and columns[0] in group_columns and columns[1] == date_column
+        )
+
+    def usable_indexes(self, table, group_columns, date_column):
+        """Names of the indexes on the table usable by collate queries"""
+        # catalog column names are unquoted
+        date_column = date_column.strip('"')
+        return [
+            index_name
+            for index_name, access_method, columns in self.existing_indexes(table)
+            if self.is_usable(access_method, columns, group_columns, date_column)
+        ]
+
+    def recommended_index_sql(self, table, group_columns, date_column, join_with_cohort_table):
+        # queries joined with the cohort look up each entity's rows within the window,
+        # the others scan the whole window for every entity
+        if join_with_cohort_table:
+            # only plain columns, group expressions would need an expression index
+            columns = [column for column in group_columns if column.isidentifier()] + [date_column]
+        else:
+            columns = [date_column]
+        return f"create index on {table} ({', '.join(columns)})"
+
+    def explain_scan(self, table, aggregation):
+        """Estimate the cost of reading the source rows for the last as of date
+
+        Returns: (tuple) of total plan cost and whether the source is sequentially scanned,
+            both None if the aggregation has no dates or the query can not be explained
+        """
+        if not aggregation.dates:
+            return None, None
+        date = max(aggregation.dates)
+        intervals = set(
+            interval for intervals in aggregation.intervals.values() for interval in intervals
+        )
+        query = (
+            f"select {', '.join(aggregation.groups.values())} "
+            f"from {aggregation.from_obj} "
+            f"where {aggregation.where(date, intervals)}"
+        )
+        try:
+            ((plan,),) = self.db_engine.execute(f"explain (format json) {query}")
+        except sqlalchemy.exc.SQLAlchemyError:
+            # the estimate is only informational, any real problem with the
+            # query will surface when the features are built
+            logger.warning(f"Could not explain the {aggregation.prefix} feature query: {query}")
+            return None, None
+        plan = plan[0]["Plan"]
+        return plan["Total Cost"], self._has_seq_scan(plan, table.split(".")[-1])
+
+    def _has_seq_scan(self, plan, relation_name):
+        if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") == relation_name:
+            return True
+        return any(self._has_seq_scan(subplan, relation_name) for subplan in plan.get("Plans", []))
+
+    def check(self, aggregation):
+        """Check the source of a SpacetimeAggregation, creating a missing index if configured to
+
+        Args:
+            aggregation (collate.SpacetimeAggregation)
+
+        Returns: (IndexReport)
+        """
+        table = self.source_table(aggregation.from_obj)
+        if table is None or self._relkind(table) not in INDEXABLE_RELKINDS:
+            logger.debug(
+                f"from_obj of {aggregation.prefix} is not a table, so it can not be checked for indexes"
+            )
+            return IndexReport(table, [], None, None, None)
+
+        group_columns = list(aggregation.groups.values())
+        usable_indexes = self.usable_indexes(table, group_columns, aggregation.date_column)
+        missing_index_sql = None
+        if not usable_indexes:
+            missing_index_sql = self.recommended_index_sql(
+                table, group_columns, aggregation.date_column, aggregation.join_with_cohort_table
+            )
+            if self.create_missing:
+                logger.notice(f"No usable index found on {table}, creating one: {missing_index_sql}")
+                self.db_engine.execute(missing_index_sql)
+                self.db_engine.execute(f"analyze {table}")
+                usable_indexes = self.usable_indexes(table, group_columns, aggregation.date_column)
+                missing_index_sql = None
+            else:
+                logger.notice(
+                    f"No usable index found on {table} for {aggregation.prefix} features, "
+                    f"consider running: {missing_index_sql}"
+                )
+
+        scan_cost, seq_scan = self.explain_scan(table, aggregation)
+        if scan_cost is not None:
+            logger.verbose(
+                f"Expected cost of scanning {table} for one as of date of {aggregation.prefix} features: "
+                f"{scan_cost}{' (sequential scan)' if seq_scan else ''}"
+            )
+        return IndexReport(table, usable_indexes, missing_index_sql, scan_cost, seq_scan)
@@ -69,7 +69,7 @@ def _summary_of_models(models_df):
         logging.warning('There are model groups with more than one model per train_end_time. See below: \n {}'.format(time_cts[msk].reset_index()))
         
     
-def add_predictions(db_engine, model_groups, project_path, experiment_hashes=None, train_end_times_range=None, rank_order='worst', replace=True):
+def add_predictions(db_engine, model_groups, project_path, experiment_hashes=None, train_end_times_range=None, rank_order='worst', replace=True, model_cache=None):
     """ For a set of modl_groups generate test predictions and write to DB
         Args:
             db_engine: Sqlalchemy engine
@@ -81,6 +81,8 @@ def add_predictions(db_engine, model_groups, project_path, experiment_hashes=Non
                                         A dictionary with two possible keys 'range_start_date' and 'range_end_date'. Either or both could be set
             rank_order (str) : How to deal with ties in the scores. 
             replace (bool) : Whether to overwrite the preditctions for a model_id, if already found in the DB.
+            model_cache (catwalk.storage.ModelCache) : Optional. A cache to keep loaded models in, so models
+                                        tested on several matrices are only loaded once.
 
         Returns: None
             This directly writes to the test_results.predictions table
@@ -126,7 +128,7 @@ def add_predictions(db_engine, model_groups, project_path, experiment_hashes=Non
     
     # Storage objects to handle already stored models and matrices
     project_storage = ProjectStorage(project_path)
-    model_storage_engine = project_storage.model_storage_engine()
+    model_storage_engine = project_storage.model_storage_engine(model_cache=model_cache)
     matrix_storage_engine = project_storage.matrix_storage_engine()
 
     # Prediction generation is handled by the Predictor class in catwalk
@@ -169,3 +171,5 @@ def add_predictions(db_engine, model_groups, project_path, experiment_hashes=Non
             )
 
     logging.info('Successfully generated predictions for {} models!'.format(len(model_matrix_info)))
+    if model_cache is not None:
+        logging.info('Model cache statistics: {}'.format(model_cache.stats))
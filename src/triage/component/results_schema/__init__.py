@@ -23,6 +23,9 @@ from .schema import (
     RetrainModel,
     TriageRun,
     TriageRunStatus,
+    TriageRunSpan,
+    QueryStats,
+    SlowQuery,
     Model,
     ModelGroup,
     Subset,
@@ -51,6 +54,9 @@ __all__ = (
     "ExperimentModel",
     "TriageRun",
     "TriageRunStatus",
+    "TriageRunSpan",
+    "QueryStats",
+    "SlowQuery",
     "Model",
     "ModelGroup",
     "Subset",
@@ -0,0 +1,26 @@
+"""add matrix data fingerprint
+
+Revision ID: 4f8b2c6e1d93
+Revises: e3a9c5d17f62
+Create Date: 2026-10-19 18:02:41.317864
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f8b2c6e1d93'
+down_revision = 'e3a9c5d17f62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('matrices', sa.Column('data_fingerprint', sa.String(), nullable=True), schema='triage_metadata')
+    op.create_index(op.f('ix_triage_metadata_matrices_data_fingerprint'), 'matrices', ['data_fingerprint'], unique=False, schema='triage_metadata')
+
+
+def downgrade():
+    op.drop_index(op.f('ix_triage_metadata_matrices_data_fingerprint'), table_name='matrices', schema='triage_metadata')
+    op.drop_column('matrices', 'data_fingerprint', schema='triage_metadata')
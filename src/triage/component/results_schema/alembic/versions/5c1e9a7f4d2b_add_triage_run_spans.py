@@ -0,0 +1,43 @@
+"""add triage run spans
+
+Revision ID: 5c1e9a7f4d2b
+Revises: 8a3f1c2d9b4e
+Create Date: 2026-10-19 14:02:17.531220
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '5c1e9a7f4d2b'
+down_revision = '8a3f1c2d9b4e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('triage_run_spans',
+    sa.Column('span_id', sa.Integer(), nullable=False),
+    sa.Column('run_id', sa.Integer(), nullable=True),
+    sa.Column('name', sa.String(), nullable=True),
+    sa.Column('start_time', sa.DateTime(), nullable=True),
+    sa.Column('wall_time', sa.Float(), nullable=True),
+    sa.Column('cpu_time', sa.Float(), nullable=True),
+    sa.Column('db_time', sa.Float(), nullable=True),
+    sa.Column('peak_rss', sa.BigInteger(), nullable=True),
+    sa.Column('rows_processed', sa.BigInteger(), nullable=True),
+    sa.Column('pid', sa.Integer(), nullable=True),
+    sa.Column('thread_id', sa.BigInteger(), nullable=True),
+    sa.Column('attributes', postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+    sa.ForeignKeyConstraint(['run_id'], ['triage_metadata.triage_runs.id'], ),
+    sa.PrimaryKeyConstraint('span_id'),
+    schema='triage_metadata'
+    )
+    op.create_index(op.f('ix_triage_metadata_triage_run_spans_run_id'), 'triage_run_spans', ['run_id'], unique=False, schema='triage_metadata')
+
+
+def downgrade():
+    op.drop_index(op.f('ix_triage_metadata_triage_run_spans_run_id'), table_name='triage_run_spans', schema='triage_metadata')
+    op.drop_table('triage_run_spans', schema='triage_metadata')
@@ -0,0 +1,28 @@
+"""record span rss at start and end
+
+Revision ID: 7d4e2a9c5b18
+Revises: 4f8b2c6e1d93
+Create Date: 2026-10-19 21:14:05.682113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d4e2a9c5b18'
+down_revision = '4f8b2c6e1d93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('triage_run_spans', sa.Column('rss_start', sa.BigInteger(), nullable=True), schema='triage_metadata')
+    op.add_column('triage_run_spans', sa.Column('rss_end', sa.BigInteger(), nullable=True), schema='triage_metadata')
+    op.drop_column('triage_run_spans', 'peak_rss', schema='triage_metadata')
+
+
+def downgrade():
+    op.add_column('triage_run_spans', sa.Column('peak_rss', sa.BigInteger(), nullable=True), schema='triage_metadata')
+    op.drop_column('triage_run_spans', 'rss_end', schema='triage_metadata')
+    op.drop_column('triage_run_spans', 'rss_start', schema='triage_metadata')
@@ -0,0 +1,26 @@
+"""add throughput to runs
+
+Revision ID: 8a3f1c2d9b4e
+Revises: 3ce027594a5c
+Create Date: 2026-10-19 10:12:41.118203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a3f1c2d9b4e'
+down_revision = '3ce027594a5c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('triage_runs', sa.Column('matrices_per_minute', sa.Float(), nullable=True), schema='triage_metadata')
+    op.add_column('triage_runs', sa.Column('models_per_minute', sa.Float(), nullable=True), schema='triage_metadata')
+
+
+def downgrade():
+    op.drop_column('triage_runs', 'models_per_minute', schema='triage_metadata')
+    op.drop_column('triage_runs', 'matrices_per_minute', schema='triage_metadata')
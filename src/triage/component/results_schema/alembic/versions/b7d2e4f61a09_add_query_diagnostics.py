@@ -0,0 +1,56 @@
+"""add query diagnostics
+
+Revision ID: b7d2e4f61a09
+Revises: 5c1e9a7f4d2b
+Create Date: 2026-10-19 16:40:52.204731
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d2e4f61a09'
+down_revision = '5c1e9a7f4d2b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('query_stats',
+    sa.Column('query_stats_id', sa.Integer(), nullable=False),
+    sa.Column('recorded_time', sa.DateTime(), nullable=True),
+    sa.Column('pid', sa.Integer(), nullable=True),
+    sa.Column('fingerprint', sa.String(), nullable=True),
+    sa.Column('component', sa.String(), nullable=True),
+    sa.Column('statement', sa.Text(), nullable=True),
+    sa.Column('calls', sa.Integer(), nullable=True),
+    sa.Column('total_duration', sa.Float(), nullable=True),
+    sa.Column('max_duration', sa.Float(), nullable=True),
+    sa.Column('rows', sa.BigInteger(), nullable=True),
+    sa.PrimaryKeyConstraint('query_stats_id'),
+    schema='triage_metadata'
+    )
+    op.create_index(op.f('ix_triage_metadata_query_stats_fingerprint'), 'query_stats', ['fingerprint'], unique=False, schema='triage_metadata')
+    op.create_table('slow_queries',
+    sa.Column('slow_query_id', sa.Integer(), nullable=False),
+    sa.Column('recorded_time', sa.DateTime(), nullable=True),
+    sa.Column('pid', sa.Integer(), nullable=True),
+    sa.Column('fingerprint', sa.String(), nullable=True),
+    sa.Column('component', sa.String(), nullable=True),
+    sa.Column('statement', sa.Text(), nullable=True),
+    sa.Column('duration', sa.Float(), nullable=True),
+    sa.Column('rows', sa.BigInteger(), nullable=True),
+    sa.Column('query_plan', postgresql.JSONB(astext_type=sa.Text()), nullable=True),
+    sa.PrimaryKeyConstraint('slow_query_id'),
+    schema='triage_metadata'
+    )
+    op.create_index(op.f('ix_triage_metadata_slow_queries_fingerprint'), 'slow_queries', ['fingerprint'], unique=False, schema='triage_metadata')
+
+
+def downgrade():
+    op.drop_index(op.f('ix_triage_metadata_slow_queries_fingerprint'), table_name='slow_queries', schema='triage_metadata')
+    op.drop_table('slow_queries', schema='triage_metadata')
+    op.drop_index(op.f('ix_triage_metadata_query_stats_fingerprint'), table_name='query_stats', schema='triage_metadata')
+    op.drop_table('query_stats', schema='triage_metadata')
@@ -0,0 +1,26 @@
+"""add model storage timings
+
+Revision ID: e3a9c5d17f62
+Revises: b7d2e4f61a09
+Create Date: 2026-10-19 17:26:08.640521
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3a9c5d17f62'
+down_revision = 'b7d2e4f61a09'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('models', sa.Column('model_write_time', sa.Float(), nullable=True), schema='triage_metadata')
+    op.add_column('models', sa.Column('model_load_time', sa.Float(), nullable=True), schema='triage_metadata')
+
+
+def downgrade():
+    op.drop_column('models', 'model_load_time', schema='triage_metadata')
+    op.drop_column('models', 'model_write_time', schema='triage_metadata')
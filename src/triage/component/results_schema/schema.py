@@ -122,6 +122,8 @@ class TriageRun(Base):
     models_made = Column(Integer, default=0)
     models_skipped = Column(Integer, default=0)
     models_errored = Column(Integer, default=0)
+    matrices_per_minute = Column(Float)
+    models_per_minute = Column(Float)
     last_updated_time = Column(DateTime, onupdate=datetime.datetime.now)
     current_status = Column(Enum(TriageRunStatus))
     stacktrace = Column(Text)
@@ -129,7 +131,67 @@ class TriageRun(Base):
     cohort_table_name = Column(String)
     labels_table_name = Column(String)
     bias_hash = Column(String)
-        
+
+
+class TriageRunSpan(Base):
+    """The time and resources one unit of work (a stage, a matrix build, a model
+    training...) of a run took, in the process that did it"""
+
+    __tablename__ = "triage_run_spans"
+    __table_args__ = {"schema": "triage_metadata"}
+
+    span_id = Column(Integer, primary_key=True)
+    run_id = Column(
+        Integer, ForeignKey("triage_metadata.triage_runs.id"), index=True
+    )
+    name = Column(String)
+    start_time = Column(DateTime)
+    wall_time = Column(Float)
+    cpu_time = Column(Float)
+    db_time = Column(Float)
+    rss_start = Column(BigInteger)
+    rss_end = Column(BigInteger)
+    rows_processed = Column(BigInteger)
+    pid = Column(Integer)
+    thread_id = Column(BigInteger)
+    attributes = Column(JSONB)
+
+
+class QueryStats(Base):
+    """How often and how long a kind of statement (by fingerprint) was executed from a
+    component of one process, since the previous row for the same process"""
+
+    __tablename__ = "query_stats"
+    __table_args__ = {"schema": "triage_metadata"}
+
+    query_stats_id = Column(Integer, primary_key=True)
+    recorded_time = Column(DateTime)
+    pid = Column(Integer)
+    fingerprint = Column(String, index=True)
+    component = Column(String)
+    statement = Column(Text)
+    calls = Column(Integer)
+    total_duration = Column(Float)
+    max_duration = Column(Float)
+    rows = Column(BigInteger)
+
+
+class SlowQuery(Base):
+    """A statement that took longer than the slow query threshold, with its query plan"""
+
+    __tablename__ = "slow_queries"
+    __table_args__ = {"schema": "triage_metadata"}
+
+    slow_query_id = Column(Integer, primary_key=True)
+    recorded_time = Column(DateTime)
+    pid = Column(Integer)
+    fingerprint = Column(String, index=True)
+    component = Column(String)
+    statement = Column(Text)
+    duration = Column(Float)
+    rows = Column(BigInteger)
+    query_plan = Column(JSONB)
+
 
 class Subset(Base):
 
@@ -219,6 +281,7 @@ class Matrix(Base):
         String, ForeignKey("triage_metadata.experiments.experiment_hash")
     )
     feature_dictionary = Column(JSONB)
+    data_fingerprint = Column(String, index=True)
 
 
 class Model(Base):
@@ -246,6 +309,8 @@ class Model(Base):
     train_matrix_uuid = Column(Text, ForeignKey("triage_metadata.matrices.matrix_uuid"))
     training_label_timespan = Column(Interval)
     model_size = Column(Float)
+    model_write_time = Column(Float)
+    model_load_time = Column(Float)
     random_seed = Column(Integer)
 
     model_group_rel = relationship("ModelGroup")
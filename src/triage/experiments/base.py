@@ -58,6 +58,10 @@ from triage.component.catwalk.utils import (
     filename_friendly_hash,
 )
 from triage.component.catwalk.storage import (
+    DEFAULT_LOCAL_CACHE_SIZE,
+    DEFAULT_MODEL_COMPRESSION,
+    DEFAULT_S3_MAX_CONCURRENCY,
+    DEFAULT_S3_PART_SIZE,
     CSVMatrixStore,
     ModelStorageEngine,
     ProjectStorage,
@@ -66,6 +70,11 @@ from triage.component.catwalk.storage import (
 
 from triage.experiments import CONFIG_VERSION
 from triage.experiments.validate import ExperimentValidator
+from triage.experiments.pipeline import (
+    MATRIX_BUILD,
+    TRAIN_TEST,
+    matrix_and_model_graph,
+)
 from triage.tracking import (
     initialize_tracking_and_get_run_id,
     experiment_entrypoint,
@@ -108,10 +117,27 @@ class ExperimentBase(ABC):
         materialize_subquery_fromobjs (bool, default True) Whether or not to create and index
             tables for feature "from objects" that are subqueries. Can speed up performance
             when building features for many as-of-dates.
+        create_fromobj_indexes (bool, default False) Whether or not to create an index on
+            each feature "from object" table that lacks one usable by the feature queries,
+            before the feature inserts begin. Missing indexes are logged either way.
+        pipeline (bool, default False) Whether or not to start training and testing models
+            as soon as their train and test matrices are built, instead of waiting for all
+            matrices. Subsets and protected groups are then generated before the matrices.
         additional_bigtrain_classnames (list) Any additional class names to perform in the second batch
             of training, which focuses on large modeling algorithms that tend to run with less parallelization
             as there is generally parallelization and high memory requirements built into the algorithm.
         profile (bool)
+        model_compression (string, default 'zlib:3') How to compress stored models, either
+            'none' or a joblib codec with an optional level, like 'lz4:1'
+        mmap_models (bool, default False) Whether or not to memory map the arrays of
+            uncompressed models stored on the local filesystem when loading them
+        local_cache_directory (string, optional) A local directory in which to keep copies
+            of the matrices and models read from an S3 project path, so each host only
+            downloads them once
+        local_cache_size (int, default 10GiB) How many bytes those copies may take up
+        s3_part_size (int, default 64MiB) The size in bytes of the parts in which matrices
+            and models are uploaded to and downloaded from an S3 project path
+        s3_max_concurrency (int, default 10) How many of those parts to transfer at once
     """
 
     cleanup_timeout = 60  # seconds
@@ -127,11 +153,19 @@ class ExperimentBase(ABC):
         cleanup_timeout=None,
         materialize_subquery_fromobjs=True,
         features_ignore_cohort=False,
+        create_fromobj_indexes=False,
+        pipeline=False,
         additional_bigtrain_classnames=None,
         profile=False,
         save_predictions=True,
         skip_validation=False,
         partial_run=False,
+        model_compression=DEFAULT_MODEL_COMPRESSION,
+        mmap_models=False,
+        local_cache_directory=None,
+        local_cache_size=DEFAULT_LOCAL_CACHE_SIZE,
+        s3_part_size=DEFAULT_S3_PART_SIZE,
+        s3_max_concurrency=DEFAULT_S3_MAX_CONCURRENCY,
     ):
         # For a partial run, skip validation and avoid cleaning up
         # we'll also skip filling default config values below
@@ -160,8 +194,18 @@ class ExperimentBase(ABC):
                 self.config["label_config"]
             )
 
-        self.project_storage = ProjectStorage(project_path)
-        self.model_storage_engine = ModelStorageEngine(self.project_storage)
+        self.project_storage = ProjectStorage(
+            project_path,
+            local_cache_directory,
+            local_cache_size,
+            s3_part_size,
+            s3_max_concurrency,
+        )
+        self.model_storage_engine = ModelStorageEngine(
+            self.project_storage,
+            compression=model_compression,
+            mmap_mode="r" if mmap_models else None,
+        )
         self.matrix_storage_engine = MatrixStorageEngine(
             self.project_storage, matrix_storage_class
         )
@@ -207,6 +251,9 @@ class ExperimentBase(ABC):
                 "The from_objs will be calculated on the fly every time."
             )
 
+        self.create_fromobj_indexes = create_fromobj_indexes
+        self.pipeline = pipeline
+
         self.features_ignore_cohort = features_ignore_cohort
         if self.features_ignore_cohort:
             logger.notice(
@@ -384,6 +431,7 @@ class ExperimentBase(ABC):
             feature_start_time=split_config["feature_start_time"],
             materialize_subquery_fromobjs=self.materialize_subquery_fromobjs,
             features_ignore_cohort=self.features_ignore_cohort,
+            create_fromobj_indexes=self.create_fromobj_indexes,
         )
 
         self.feature_group_creator = FeatureGroupCreator(
@@ -461,6 +509,8 @@ class ExperimentBase(ABC):
                     "methods", ["uniform"]
                 ),
                 replace=self.replace,
+                model_storage_engine=self.model_storage_engine,
+                n_jobs=self.config.get("individual_importance", {}).get("n_jobs", 1),
             )
         else:
             self.individual_importance_calculator = IndividualImportanceCalculatorNoOp()
@@ -748,9 +798,12 @@ class ExperimentBase(ABC):
         Results are stored in the database, not returned
         """
         logger.info("Setting up labels")
-        self.label_generator.generate_all_labels(
-            self.labels_table_name, self.all_as_of_times, self.all_label_timespans
+        self.process_query_tasks(
+            self.label_generator.generate_all_label_tasks(
+                self.labels_table_name, self.all_as_of_times, self.all_label_timespans
+            )
         )
+        self.label_generator.check_labels_table(self.labels_table_name)
         logger.success(
             f"Labels set up in the table {self.labels_table_name} successfully "
         )
@@ -758,7 +811,12 @@ class ExperimentBase(ABC):
     @experiment_entrypoint
     def generate_cohort(self):
         logger.info("Setting up cohort")
-        self.cohort_table_generator.generate_entity_date_table(
+        self.process_query_tasks(
+            self.cohort_table_generator.generate_entity_date_table_tasks(
+                as_of_dates=self.all_as_of_times
+            )
+        )
+        self.cohort_table_generator.check_entity_date_table(
             as_of_dates=self.all_as_of_times
         )
         logger.success(
@@ -820,7 +878,7 @@ class ExperimentBase(ABC):
             f"successfully"
         )
 
-    def build_matrices(self):
+    def _start_matrix_building(self):
         associate_matrices_with_experiment(
             self.experiment_hash, self.matrix_build_tasks.keys(), self.db_engine
         )
@@ -831,6 +889,9 @@ class ExperimentBase(ABC):
         with self.get_for_update() as experiment:
             experiment.matrices_needed = len(self.matrix_build_tasks.keys())
         record_matrix_building_started(self.run_id, self.db_engine)
+
+    def build_matrices(self):
+        self._start_matrix_building()
         self.process_matrix_build_tasks(self.matrix_build_tasks)
         logger.success(
             f"Matrices were stored in {self.project_path}/matrices successfully"
@@ -838,19 +899,28 @@ class ExperimentBase(ABC):
 
     @experiment_entrypoint
     def generate_matrices(self):
+        self._generate_matrix_inputs()
+        self.build_matrices()
+
+    def _generate_matrix_inputs(self):
+        """Generate the labels, cohort and features that matrices are built from"""
         self.all_as_of_times  # Forcing the calculation of all the as of times, so the logging makes more sense
         self.generate_labels()
         self.generate_cohort()
         self.generate_preimputation_features()
         self.impute_missing_features()
-        self.build_matrices()
 
     @experiment_entrypoint
     def generate_subsets(self):
         self.process_subset_tasks(self.subset_tasks)
 
-    def _all_train_test_batches(self):
-        """A batch is a model_group to be train, test and evaluated"""
+    def _all_train_test_batches(self, matrix_metadata=None):
+        """A batch is a model_group to be train, test and evaluated
+
+        Args:
+            matrix_metadata (dict, optional) metadata of matrices that are not
+                built yet, keyed on matrix uuid
+        """
         if "grid_config" not in self.config:
             logger.warning(
                 "No grid_config was passed in the experiment config. No models will be trained"
@@ -861,15 +931,10 @@ class ExperimentBase(ABC):
             splits=self.full_matrix_definitions,
             grid_config=self.config.get("grid_config"),
             model_comment=self.config.get("model_comment", None),
+            matrix_metadata=matrix_metadata,
         )
 
-    @experiment_entrypoint
-    def train_and_test_models(self):
-        batches = self._all_train_test_batches()
-        if not batches:
-            logger.notice("No train/test tasks found, so no training to do")
-            return
-
+    def _start_model_building(self, batches):
         with self.get_for_update() as experiment:
             experiment.grid_size = sum(
                 1
@@ -894,9 +959,77 @@ class ExperimentBase(ABC):
         with self.get_for_update() as experiment:
             experiment.models_needed = len(model_hashes)
         record_model_building_started(self.run_id, self.db_engine)
-        self.process_train_test_batches(batches)
+
+    @experiment_entrypoint
+    def train_and_test_models(self):
+        batches = self._all_train_test_batches()
+        if not batches:
+            logger.notice("No train/test tasks found, so no training to do")
+            return
+
+        self._start_model_building(batches)
+        self.process_train_test_batches(
+            self.model_train_tester.skip_completed_tasks(batches)
+        )
         logger.success("Training, testing and evaluating models completed")
 
+    @experiment_entrypoint
+    def build_matrices_and_train_models(self):
+        """Build matrices and train, test and evaluate models as one pipeline
+
+        Each train/test task starts as soon as its train and test matrices exist,
+        so models train while later matrices are still being built. Labels,
+        cohort, features, subsets and protected groups have to exist already.
+        """
+        self._start_matrix_building()
+        # the train/test tasks are planned before their matrices are stored
+        batches = self._all_train_test_batches(
+            matrix_metadata={
+                matrix_uuid: build_task["matrix_metadata"]
+                for matrix_uuid, build_task in self.matrix_build_tasks.items()
+            }
+        )
+        if batches:
+            self._start_model_building(batches)
+            batches = self.model_train_tester.skip_completed_tasks(batches)
+        else:
+            logger.notice("No train/test tasks found, so no training to do")
+        self.process_pipelined_tasks(
+            matrix_and_model_graph(self.matrix_build_tasks, batches or [])
+        )
+        logger.success(
+            f"Matrices were stored in {self.project_path}/matrices and models were "
+            f"trained, tested and evaluated successfully"
+        )
+
+    def pipeline_task_runner(self, pipeline_task):
+        """The function that runs a task of the matrix and model pipeline"""
+        if pipeline_task.kind == MATRIX_BUILD:
+            return self.matrix_builder.build_matrix
+        elif pipeline_task.kind == TRAIN_TEST:
+            return self.model_train_tester.process_task
+        raise ValueError(f"Unknown pipeline task kind {pipeline_task.kind}")
+
+    def process_pipelined_tasks(self, task_graph):
+        """Run the tasks of a matrix and model pipeline one at a time
+
+        Ready train/test tasks run before any more matrices are built, so the
+        first models are evaluated as early as possible. Subclasses may override
+        this to run the tasks concurrently.
+
+        Args:
+            task_graph (triage.experiments.pipeline.TaskGraph) of PipelineTasks
+        """
+        ready_tasks = []
+        while True:
+            ready_tasks.extend(task_graph.ready())
+            if not ready_tasks:
+                break
+            ready_tasks.sort(key=lambda key_and_task: key_and_task[1].kind != TRAIN_TEST)
+            key, pipeline_task = ready_tasks.pop(0)
+            self.pipeline_task_runner(pipeline_task)(**pipeline_task.kwargs)
+            task_graph.complete(key)
+
     def validate(self, strict=True):
         ExperimentValidator(self.db_engine, strict=strict).run(self.config)
 
@@ -905,10 +1038,16 @@ class ExperimentBase(ABC):
             self.validate()
 
         try:
-            self.generate_matrices()
-            self.generate_subsets()
-            self.generate_protected_groups()
-            self.train_and_test_models()
+            if self.pipeline:
+                self._generate_matrix_inputs()
+                self.generate_subsets()
+                self.generate_protected_groups()
+                self.build_matrices_and_train_models()
+            else:
+                self.generate_matrices()
+                self.generate_subsets()
+                self.generate_protected_groups()
+                self.train_and_test_models()
             self._log_end_of_run_report()
         except Exception:
             logger.error("Uh oh... Houston we have a problem")
@@ -0,0 +1,131 @@
+import verboselogs, logging
+logger = verboselogs.VerboseLogger(__name__)
+
+
+# estimators are given matrix values as float32 (see catwalk.utils.estimator_input),
+# and loaded matrices hold them in float32 or smaller dtypes
+BYTES_PER_VALUE = 4
+
+# rough peak memory of training and testing a model, as a multiple of the
+# in-memory size of its train and test matrices
+DEFAULT_MEMORY_FACTOR = 3
+ESTIMATOR_MEMORY_FACTORS = {
+    'sklearn.ensemble.RandomForestClassifier': 8,
+    'sklearn.ensemble.ExtraTreesClassifier': 8,
+    'sklearn.ensemble.AdaBoostClassifier': 4,
+    'sklearn.ensemble.GradientBoostingClassifier': 4,
+    'xgboost.XGBClassifier': 4,
+    'lightgbm.LGBMClassifier': 4,
+    'sklearn.dummy.DummyClassifier': 2,
+    'sklearn.tree.DecisionTreeClassifier': 2,
+}
+
+
+def system_available_memory():
+    """How many bytes the host can give to new work without swapping, None if unknown"""
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    # reported in kilobytes
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class TrainTestMemoryEstimator:
+    """Estimates the peak memory of a train/test task from its matrices and estimator
+
+    The shape of each matrix comes from its metadata (the feature names) and the
+    number of observations recorded when it was built.
+
+    Args:
+        db_engine (sqlalchemy.engine)
+    """
+    def __init__(self, db_engine):
+        self.db_engine = db_engine
+        self.num_observations = {}
+
+    def matrix_rows(self, matrix_uuid):
+        if matrix_uuid not in self.num_observations:
+            num_observations = self.db_engine.execute(
+                "select num_observations from triage_metadata.matrices where matrix_uuid = %s",
+                matrix_uuid,
+            ).scalar()
+            if num_observations is None:
+                logger.debug(f"No observation count recorded for matrix {matrix_uuid}")
+                return 0
+            self.num_observations[matrix_uuid] = num_observations
+        return self.num_observations[matrix_uuid]
+
+    def matrix_bytes(self, matrix_store):
+        # the features and the label
+        num_columns = len(matrix_store.metadata["feature_names"]) + 1
+        return self.matrix_rows(matrix_store.uuid) * num_columns * BYTES_PER_VALUE
+
+    def __call__(self, task):
+        factor = ESTIMATOR_MEMORY_FACTORS.get(
+            task["train_kwargs"]["class_path"], DEFAULT_MEMORY_FACTOR
+        )
+        return int(
+            factor * (self.matrix_bytes(task["train_store"]) + self.matrix_bytes(task["test_store"]))
+        )
+
+
+class MemoryBudget:
+    """Admits tasks only while their memory fits within a budget
+
+    Memory in use is the larger of the estimates of admitted tasks and the live
+    RSS of the worker processes, and headroom is further capped by the memory
+    the host has available. A task is always admitted when nothing else is, so
+    one bigger than the whole budget still runs, on its own.
+
+    Args:
+        limit (int) The budget in bytes
+        estimate (function) Given a task, returns its estimated peak memory in bytes
+        live_rss (function, optional) Returns the current total RSS of the workers in bytes
+    """
+    def __init__(self, limit, estimate, live_rss=None):
+        if limit < 1:
+            raise ValueError("A memory budget must be 1 byte or greater")
+        self.limit = limit
+        self.estimate = estimate
+        self.live_rss = live_rss
+        self.reserved = {}
+
+    def in_use(self):
+        estimated = sum(self.reserved.values())
+        live = self.live_rss() if self.live_rss else 0
+        return max(estimated, live)
+
+    def headroom(self):
+        headroom = self.limit - self.in_use()
+        available = system_available_memory()
+        if available is not None:
+            headroom = min(headroom, available)
+        return headroom
+
+    def reserve(self, key, task):
+        """Reserve the estimated memory of a task if it fits
+
+        Args:
+            key (hashable) identifies the task when releasing its memory
+            task the task, as passed to the estimate function
+
+        Returns: (bool) whether the task was admitted
+        """
+        needed = self.estimate(task)
+        if self.reserved:
+            if needed > self.headroom():
+                return False
+        elif needed > self.limit:
+            logger.warning(
+                f"A task is estimated to need {needed} bytes, over the memory budget "
+                f"of {self.limit}. Running it with nothing else"
+            )
+        self.reserved[key] = needed
+        return True
+
+    def release(self, key):
+        self.reserved.pop(key, None)
@@ -1,7 +1,12 @@
 import verboselogs, logging
 logger = verboselogs.VerboseLogger(__name__)
 
+import math
+import os
+import resource
 import traceback
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
 from functools import partial
 from pebble import ProcessPool
 from multiprocessing.reduction import ForkingPickler
@@ -10,10 +15,30 @@ from triage.component.catwalk.utils import Batch
 from triage.component.catwalk import BatchKey
 
 from triage.experiments import ExperimentBase
+from triage.tracking import add_progress, flush_progress, spans_over, take_progress
+from triage.util.db import flush_query_stats
+from triage.util.introspection import process_rss
+from triage.experiments.memory import MemoryBudget, TrainTestMemoryEstimator
+from triage.experiments.pipeline import MATRIX_BUILD
+
+
+DEFAULT_MAX_TASKS_PER_WORKER = 100
 
 
 class MultiCoreExperiment(ExperimentBase):
-    def __init__(self, config, db_engine, *args, n_processes=1, n_bigtrain_processes=1, n_db_processes=1, **kwargs):
+    def __init__(
+        self,
+        config,
+        db_engine,
+        *args,
+        n_processes=1,
+        n_bigtrain_processes=1,
+        n_db_processes=1,
+        max_tasks_per_worker=DEFAULT_MAX_TASKS_PER_WORKER,
+        max_worker_rss=None,
+        memory_budget=None,
+        **kwargs
+    ):
         """
         Args:
             config (dict)
@@ -26,6 +51,16 @@ class MultiCoreExperiment(ExperimentBase):
                 Usually good to start at 1, but can be increased if you have available memory.
             n_db_processes (int) How many parallel processes to use for database IO-intensive tasks.
                 Cohort creation, label creation, and feature creation fall under this category. 
+            max_tasks_per_worker (int) How many tasks a worker process runs before it is
+                replaced by a fresh one. Worker processes are otherwise kept for the whole
+                run, so 0 means they are never replaced.
+            max_worker_rss (int, optional) A peak resident memory size, in bytes. Once a
+                worker goes over it, its pool is replaced by fresh worker processes.
+            memory_budget (int, optional) How many bytes of memory training may use.
+                If given, train/test tasks of every classifier share n_processes
+                processes, and each only starts once its estimated memory (from the
+                shape of its matrices and its classifier) fits in the budget,
+                instead of heavyweight classifiers using n_bigtrain_processes processes.
         """
         try:
             ForkingPickler.dumps(db_engine)
@@ -52,11 +87,53 @@ class MultiCoreExperiment(ExperimentBase):
         self.n_processes = n_processes
         self.n_db_processes = n_db_processes
         self.n_bigtrain_processes = n_bigtrain_processes
+        if max_tasks_per_worker < 0:
+            raise ValueError("max_tasks_per_worker must be 0 or greater")
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.max_worker_rss = max_worker_rss
         self.n_processes_lookup = {
             BatchKey.QUICKTRAIN: self.n_processes,
             BatchKey.BIGTRAIN: self.n_bigtrain_processes,
             BatchKey.MAYBETRAIN: self.n_processes
         }
+        self.worker_pools = {}
+        self.memory_budget = None
+        if memory_budget is not None:
+            self.memory_budget = MemoryBudget(
+                memory_budget,
+                TrainTestMemoryEstimator(self.db_engine),
+                live_rss=self.worker_rss,
+            )
+
+    def worker_pool(self, name, n_processes):
+        """The long-lived worker pool of the given name, created on first use
+
+        Args:
+            name (string) What the pool is used for, e.g. 'db' or 'train'
+            n_processes (int) How many worker processes the pool should have
+        """
+        if name not in self.worker_pools:
+            self.worker_pools[name] = WorkerPool(
+                n_processes,
+                max_tasks_per_worker=self.max_tasks_per_worker,
+                max_worker_rss=self.max_worker_rss,
+            )
+        return self.worker_pools[name]
+
+    def worker_rss(self):
+        """The current total RSS of the workers of all pools, in bytes"""
+        return sum(pool.live_rss() for pool in self.worker_pools.values())
+
+    def close_worker_pools(self):
+        for pool in self.worker_pools.values():
+            pool.close()
+        self.worker_pools = {}
+
+    def _run(self):
+        try:
+            super()._run()
+        finally:
+            self.close_worker_pools()
 
 
     def generated_chunked_parallelized_results(
@@ -81,25 +158,56 @@ class MultiCoreExperiment(ExperimentBase):
             run_task_with_splatted_arguments, self.model_train_tester.process_task
         )
 
+        if self.memory_budget:
+            tasks = [task for batch in batches for task in batch.tasks]
+            logger.info(
+                f"Starting parallel train/testing with {len(tasks)} tasks, {self.n_processes} processes "
+                f"and a memory budget of {self.memory_budget.limit} bytes",
+            )
+            parallelize(
+                partial_test,
+                tasks,
+                self.n_processes,
+                pool=self.worker_pool("train", self.n_processes),
+                memory_budget=self.memory_budget,
+            )
+            return
+
         for batch in batches:
             logger.info(
                 f"Starting parallelizable batch train/testing with {len(batch.tasks)} tasks, {self.n_processes_lookup[batch.key]} processes",
             )
-            parallelize(partial_test, batch.tasks, self.n_processes_lookup[batch.key])
+            parallelize(
+                partial_test,
+                batch.tasks,
+                self.n_processes_lookup[batch.key],
+                pool=self.worker_pool(
+                    "bigtrain" if batch.key == BatchKey.BIGTRAIN else "train",
+                    self.n_processes_lookup[batch.key],
+                ),
+            )
 
     def process_query_tasks(self, query_tasks):
         logger.info("Processing query tasks with %s processes", self.n_db_processes)
-        for table_name, tasks in query_tasks.items():
+        for table_name, tasks in spans_over("table_task", query_tasks.items(), "table"):
             logger.info("Processing features for %s", table_name)
             self.feature_generator.run_commands(tasks.get("prepare", []))
             partial_insert = partial(
                 insert_into_table, feature_generator=self.feature_generator
             )
 
+            inserts = tasks.get("inserts", [])
+            # spread short insert lists over all processes, up to 25 inserts per batch
+            batch_size = max(1, min(25, math.ceil(len(inserts) / self.n_db_processes)))
             insert_batches = [
-                list(task_batch) for task_batch in Batch(tasks.get("inserts", []), 25)
+                list(task_batch) for task_batch in Batch(inserts, batch_size)
             ]
-            parallelize(partial_insert, insert_batches, n_processes=self.n_db_processes)
+            parallelize(
+                partial_insert,
+                insert_batches,
+                n_processes=self.n_db_processes,
+                pool=self.worker_pool("db", self.n_db_processes),
+            )
             self.feature_generator.run_commands(tasks.get("finalize", []))
             logger.info(f"{table_name} completed")
 
@@ -111,20 +219,86 @@ class MultiCoreExperiment(ExperimentBase):
             f"Starting parallel matrix building: {len(self.matrix_build_tasks.keys())} matrices, {self.n_processes} processes",
         )
         parallelize(
-            partial_build_matrix, self.matrix_build_tasks.values(), self.n_processes
+            partial_build_matrix,
+            self.matrix_build_tasks.values(),
+            self.n_processes,
+            pool=self.worker_pool("train", self.n_processes),
         )
 
-    def process_subset_tasks(self, subset_tasks):
-        partial_subset = partial(
-            run_task_with_splatted_arguments, self.subsetter.process_task
+    def process_pipelined_tasks(self, task_graph):
+        """Run matrix builds and train/test tasks concurrently as their dependencies complete
+
+        Matrices are built by n_db_processes processes, while ready train/test
+        tasks go to n_processes (or, for heavyweight classifiers,
+        n_bigtrain_processes) processes at the same time. With a memory budget,
+        all train/test tasks share the n_processes processes and wait for
+        enough memory to start.
+        """
+        logger.info(
+            f"Starting pipelined matrix building and training: {len(task_graph)} tasks, "
+            f"{self.n_db_processes} matrix processes, {self.n_processes} training processes, "
+            f"{self.n_bigtrain_processes} bigtrain processes"
         )
+        num_successes = 0
+        num_failures = 0
+        matrix_pool = self.worker_pool("db", self.n_db_processes)
+        train_pool = self.worker_pool("train", self.n_processes)
+        bigtrain_pool = self.worker_pool("bigtrain", self.n_bigtrain_processes)
+        running = {}
+        waiting_for_memory = deque()
+        num_training = 0
 
+        def schedule(key, pipeline_task, pool):
+            future = pool.schedule(
+                run_task_with_splatted_arguments,
+                args=(self.pipeline_task_runner(pipeline_task), pipeline_task.kwargs),
+            )
+            running[future] = key
+
+        while True:
+            for key, pipeline_task in task_graph.ready():
+                if pipeline_task.kind == MATRIX_BUILD:
+                    schedule(key, pipeline_task, matrix_pool)
+                elif self.memory_budget:
+                    waiting_for_memory.append((key, pipeline_task))
+                elif pipeline_task.batch_key == BatchKey.BIGTRAIN:
+                    schedule(key, pipeline_task, bigtrain_pool)
+                else:
+                    schedule(key, pipeline_task, train_pool)
+            while waiting_for_memory and num_training < train_pool.n_processes:
+                key, pipeline_task = waiting_for_memory[0]
+                if not self.memory_budget.reserve(key, pipeline_task.kwargs):
+                    break
+                waiting_for_memory.popleft()
+                schedule(key, pipeline_task, train_pool)
+                num_training += 1
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = running.pop(future)
+                WorkerPool.collect_progress(future)
+                try:
+                    future.result()
+                except Exception:
+                    logger.exception('Child failure')
+                    num_failures += 1
+                else:
+                    num_successes += 1
+                if self.memory_budget and key in self.memory_budget.reserved:
+                    self.memory_budget.release(key)
+                    num_training -= 1
+                # dependents still run after a failure, and skip empty matrices themselves
+                task_graph.complete(key)
+        logger.info("Done. successes: %s, failures: %s", num_successes, num_failures)
+
+    def process_subset_tasks(self, subset_tasks):
         logger.info(
             f"Starting parallel subset creation: {len(subset_tasks)} subsets, {self.n_db_processes} processes",
         )
-        parallelize(
-            partial_subset, subset_tasks, self.n_db_processes
-        )
+        self.process_query_tasks(self.subsetter.generate_query_tasks(subset_tasks))
+        for subset_task in subset_tasks:
+            run_task_with_splatted_arguments(self.subsetter.finish_task, subset_task)
 
 
 def insert_into_table(insert_statements, feature_generator):
@@ -137,28 +311,179 @@ def insert_into_table(insert_statements, feature_generator):
         return False
 
 
-def parallelize(partially_bound_function, tasks, n_processes):
+class WorkerPool:
+    """A pool of worker processes kept alive across batches of tasks
+
+    Workers are only replaced after max_tasks_per_worker tasks, or all at once
+    after one reports a peak RSS over max_worker_rss, so the cost of starting
+    a process (imports, database engines and connections) is not paid per task.
+
+    Args:
+        n_processes (int) How many worker processes to run
+        max_tasks_per_worker (int) How many tasks a worker runs before being
+            replaced, 0 for never
+        max_worker_rss (int, optional) A peak resident memory size in bytes over
+            which the workers are replaced
+    """
+    def __init__(self, n_processes, max_tasks_per_worker=0, max_worker_rss=None):
+        self.n_processes = n_processes
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.max_worker_rss = max_worker_rss
+        self._pool = None
+        self._retired_pools = []
+        self._needs_recycling = False
+        self.worker_pids = set()
+
+    @property
+    def pool(self):
+        if self._needs_recycling and self._pool is not None:
+            logger.verbose("Replacing the worker processes of a pool over its memory limit")
+            # tasks already given to the old workers still finish there
+            self._pool.close()
+            self._retired_pools.append(self._pool)
+            self._pool = None
+            self.worker_pids = set()
+        self._needs_recycling = False
+        if self._pool is None:
+            self._pool = ProcessPool(self.n_processes, max_tasks=self.max_tasks_per_worker)
+        return self._pool
+
+    def schedule(self, function, args=()):
+        """Run the function with the given arguments in a worker
+
+        Returns: (concurrent.futures.Future) of the function's return value
+        """
+        future = Future()
+        worker_future = self.pool.schedule(run_and_measure, args=(function, args))
+        worker_future.add_done_callback(partial(self._task_done, future))
+        return future
+
+    def _task_done(self, future, worker_future):
+        try:
+            result, peak_rss, pid, progress = worker_future.result()
+        except Exception as exc:
+            future.set_exception(exc)
+            return
+        self.worker_pids.add(pid)
+        # merged by the thread waiting on the future: this is pebble's result thread,
+        # which should neither write to the database nor hold locks while workers fork
+        future.progress = progress
+        if self.max_worker_rss and peak_rss > self.max_worker_rss:
+            logger.notice(
+                f"A worker reached {peak_rss} bytes of memory, "
+                f"over the limit of {self.max_worker_rss}, so the pool will be recycled"
+            )
+            self._needs_recycling = True
+        future.set_result(result)
+
+    @staticmethod
+    def collect_progress(future):
+        """Buffer the run progress sent back with a finished task, in the calling thread"""
+        add_progress(getattr(future, 'progress', {}))
+
+    def live_rss(self):
+        """The current total RSS of the pool's known workers, in bytes"""
+        total = 0
+        for pid in list(self.worker_pids):
+            rss = process_rss(pid)
+            if rss is None:
+                # the worker has exited, e.g. after max_tasks_per_worker tasks
+                self.worker_pids.discard(pid)
+            else:
+                total += rss
+        return total
+
+    def close(self):
+        for pool in self._retired_pools + [self._pool]:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        self._pool = None
+        self._retired_pools = []
+        self.worker_pids = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def run_and_measure(function, args):
+    """Run a function in a worker
+
+    Returns: (tuple) of the function's result, the peak RSS of the process in bytes,
+        its pid and the run progress it buffered, to be written by the parent process
+    """
+    try:
+        result = function(*args)
+    except Exception:
+        # the parent never receives the progress of a failed task
+        flush_progress()
+        raise
+    finally:
+        # workers end without running atexit handlers, and may sit idle for long
+        flush_query_stats()
+    # ru_maxrss is in kilobytes on linux
+    return (
+        result,
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        os.getpid(),
+        take_progress(),
+    )
+
+
+def parallelize(partially_bound_function, tasks, n_processes, pool=None, memory_budget=None):
+    """Run the function on each task in parallel, logging any failures
+
+    Args:
+        partially_bound_function (function) called with each task as its only argument
+        tasks (iterable) the tasks
+        n_processes (int) How many processes to use, if no pool is given
+        pool (WorkerPool, optional) A long-lived pool to run the tasks in.
+            If not given, a pool of single-use processes is created for these tasks.
+        memory_budget (MemoryBudget, optional) Tasks wait to start until the
+            budget admits them
+
+    Returns: (list) of the results of successful tasks, in task order
+    """
+    if pool is None:
+        with WorkerPool(n_processes, max_tasks_per_worker=1) as single_use_pool:
+            return parallelize(
+                partially_bound_function, tasks, n_processes, single_use_pool, memory_budget
+            )
+
     num_successes = 0
     num_failures = 0
-    results = []
-    with ProcessPool(n_processes, max_tasks=1) as pool:
-        future = pool.map(partially_bound_function, tasks)
-        iterator = future.result()
-        results = []
-        while True:
-            try:
-                result = next(iterator)
-            except StopIteration:
+    results = {}
+    running = {}
+    remaining_tasks = deque(enumerate(tasks))
+    while True:
+        # only keep every worker busy, so a recycled pool takes over the remaining tasks
+        while remaining_tasks and len(running) < pool.n_processes:
+            task_num, task = remaining_tasks[0]
+            if memory_budget and not memory_budget.reserve(task_num, task):
                 break
+            remaining_tasks.popleft()
+            running[pool.schedule(partially_bound_function, args=(task,))] = task_num
+        if not running:
+            break
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            task_num = running.pop(future)
+            pool.collect_progress(future)
+            if memory_budget:
+                memory_budget.release(task_num)
+            try:
+                results[task_num] = future.result()
             except Exception:
                 logger.exception('Child failure')
                 num_failures += 1
             else:
-                results.append(result)
                 num_successes += 1
 
-        logger.info("Done. successes: %s, failures: %s", num_successes, num_failures)
-        return results
+    logger.info("Done. successes: %s, failures: %s", num_successes, num_failures)
+    return [results[task_num] for task_num in sorted(results)]
 
 
 def run_task_with_splatted_arguments(task_runner, task):
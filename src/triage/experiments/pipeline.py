@@ -0,0 +1,94 @@
+import verboselogs, logging
+logger = verboselogs.VerboseLogger(__name__)
+
+from collections import OrderedDict, defaultdict, namedtuple
+
+
+MATRIX_BUILD = "matrix_build"
+TRAIN_TEST = "train_test"
+
+PipelineTask = namedtuple("PipelineTask", ["kind", "batch_key", "kwargs"])
+
+
+class TaskGraph:
+    """Tasks that can only start once the tasks they depend on have completed
+
+    Dependencies have to be added to the graph before their dependents. A
+    dependency on a key that is not in the graph (e.g. a matrix that does not
+    need building) is treated as already satisfied.
+    """
+    def __init__(self):
+        self.tasks = OrderedDict()
+        self.remaining_dependencies = {}
+        self.dependents = defaultdict(list)
+        self.ready_keys = []
+        self.completed = set()
+
+    def add(self, key, task, depends_on=()):
+        if key in self.tasks:
+            raise ValueError(f"Task {key} was already added to the graph")
+        self.tasks[key] = task
+        remaining = set(
+            dependency for dependency in depends_on
+            if dependency in self.tasks and dependency not in self.completed
+        )
+        self.remaining_dependencies[key] = remaining
+        for dependency in remaining:
+            self.dependents[dependency].append(key)
+        if not remaining:
+            self.ready_keys.append(key)
+
+    def ready(self):
+        """Release the tasks whose dependencies have all completed since the last call
+
+        Returns: (list) of (key, task) tuples
+        """
+        ready_tasks = [(key, self.tasks[key]) for key in self.ready_keys]
+        self.ready_keys = []
+        return ready_tasks
+
+    def complete(self, key):
+        self.completed.add(key)
+        for dependent in self.dependents.pop(key, []):
+            self.remaining_dependencies[dependent].discard(key)
+            if not self.remaining_dependencies[dependent]:
+                self.ready_keys.append(dependent)
+
+    @property
+    def done(self):
+        return len(self.completed) == len(self.tasks)
+
+    def __len__(self):
+        return len(self.tasks)
+
+
+def matrix_and_model_graph(matrix_build_tasks, train_test_batches):
+    """Build the graph of an experiment's matrices and the train/test tasks that use them
+
+    Each train/test task depends on the build tasks of its train and test matrices,
+    so it can start as soon as those two are built.
+
+    Args:
+        matrix_build_tasks (dict) matrix build keyword arguments, keyed on matrix uuid
+        train_test_batches (list) of catwalk.TaskBatch
+
+    Returns: (TaskGraph) of PipelineTasks
+    """
+    graph = TaskGraph()
+    for matrix_uuid, build_task in matrix_build_tasks.items():
+        graph.add((MATRIX_BUILD, matrix_uuid), PipelineTask(MATRIX_BUILD, None, build_task))
+    for batch in train_test_batches:
+        for task_num, task in enumerate(batch.tasks):
+            graph.add(
+                (TRAIN_TEST, batch.key, task_num),
+                PipelineTask(TRAIN_TEST, batch.key, task),
+                depends_on=[
+                    (MATRIX_BUILD, task["train_store"].uuid),
+                    (MATRIX_BUILD, task["test_store"].uuid),
+                ],
+            )
+    logger.debug(
+        f"Built a task graph of {len(matrix_build_tasks)} matrices "
+        f"and {len(graph) - len(matrix_build_tasks)} train/test tasks"
+    )
+    return graph
@@ -1,11 +1,19 @@
 import verboselogs, logging
 logger = verboselogs.VerboseLogger(__name__)
+import hashlib
+import os
 import time
+import uuid
+from functools import partial
+from triage.component.catwalk.storage import ProjectStorage, remove_if_exists
 from triage.component.catwalk.utils import Batch
 from triage.experiments import ExperimentBase
+from triage.experiments.pipeline import MATRIX_BUILD
+from triage.tracking import flush_progress, recording_run, spans_over
+from triage.util.db import flush_query_stats
 
 try:
-    from rq import Queue
+    from rq import Queue, get_current_job
 except ImportError:
     logger.error(
         "rq not available. To use RQExperiment, install triage with the RQ extension: "
@@ -18,6 +26,11 @@ DEFAULT_TIMEOUT = (
     "365d"
 )  # We want to basically invalidate RQ's timeouts by setting them each to one year
 
+# how long, in seconds, the list of completed job ids is kept after the last job reports to it
+COMPLETION_KEY_TTL = 24 * 60 * 60
+
+DEFAULT_MAX_LOCAL_MATRICES = 10
+
 
 class RQExperiment(ExperimentBase):
     """An experiment that uses the python-rq library to enqueue tasks and wait for them to finish.
@@ -28,23 +41,126 @@ class RQExperiment(ExperimentBase):
     (either on the same machine as the experiment or elsewhere),
     and a Redis instance that both the experiment process and RQ workers can access.
 
+    Workers push the id of each job they finish onto a Redis list, which the experiment
+    blocks on, so it learns of completed jobs as soon as they happen.
+
+    To keep train/test tasks that use the same train matrix on the same worker, give each
+    worker its own queue, listened to before the shared one (e.g. `rq worker triage-0 default`)
+    and pass those queue names as affinity_queues. With a local_matrix_directory, workers
+    then keep copies of the matrices they use there and only download each one once.
+
     Args:
         redis_connection (redis.connection): A connection to a Redis instance that
             some rq workers can also access
-        sleep_time (int, default 5) How many seconds the process should sleep while
-            waiting for RQ results
+        sleep_time (int, default 5) How many seconds to wait for a job to report completion
+            before checking the status of every job, in case a worker died while running one
         queue_kwargs (dict, default {}) Any extra keyword arguments to pass to Queue creation
+        affinity_queues (list, optional) Names of per-worker queues to route train/test
+            tasks to by their train matrix. If not given, all tasks go to the shared queue
+        local_matrix_directory (string, optional) A path on each worker's local disk
+            to keep copies of the matrices used by train/test tasks in
+        max_local_matrices (int, default 10) How many matrices to keep in each worker's
+            local_matrix_directory, least recently used ones being removed first
     """
 
     def __init__(
-        self, redis_connection, sleep_time=5, queue_kwargs=None, *args, **kwargs
+        self,
+        redis_connection,
+        sleep_time=5,
+        queue_kwargs=None,
+        *args,
+        affinity_queues=None,
+        local_matrix_directory=None,
+        max_local_matrices=DEFAULT_MAX_LOCAL_MATRICES,
+        **kwargs
     ):
         super().__init__(*args, **kwargs)
         self.redis_connection = redis_connection
         if queue_kwargs is None:
             queue_kwargs = {}
         self.queue = Queue(connection=self.redis_connection, **queue_kwargs)
+        self.affinity_queues = [
+            Queue(name, connection=self.redis_connection, **queue_kwargs)
+            for name in affinity_queues or []
+        ]
+        self.local_matrix_directory = local_matrix_directory
+        self.max_local_matrices = max_local_matrices
         self.sleep_time = sleep_time
+        self.completion_key = f"triage:completed_jobs:{uuid.uuid4().hex}"
+
+    def enqueue(self, function, *args, queue=None, **kwargs):
+        """Enqueue a job that reports its completion to this experiment
+
+        Args:
+            function (function) The function to run in the worker
+            *args, **kwargs: arguments to the function
+            queue (rq.Queue, optional) The queue to use, the shared queue if not given
+
+        Returns: (rq.Job)
+        """
+        return (queue or self.queue).enqueue(
+            run_and_report_completion,
+            self.completion_key,
+            (self.run_id, self.db_engine),
+            function,
+            *args,
+            job_timeout=DEFAULT_TIMEOUT,
+            result_ttl=DEFAULT_TIMEOUT,
+            ttl=DEFAULT_TIMEOUT,
+            **kwargs
+        )
+
+    def train_test_queue(self, task):
+        """The queue for a train/test task, the same for every task with the same train matrix"""
+        if not self.affinity_queues:
+            return self.queue
+        train_uuid = task["train_store"].uuid
+        queue_number = int(hashlib.md5(train_uuid.encode("utf-8")).hexdigest(), 16)
+        return self.affinity_queues[queue_number % len(self.affinity_queues)]
+
+    def enqueue_train_test_task(self, task):
+        task_runner = self.model_train_tester.process_task
+        if self.local_matrix_directory:
+            task_runner = partial(
+                run_with_local_matrices,
+                task_runner,
+                self.local_matrix_directory,
+                self.max_local_matrices,
+            )
+        return self.enqueue(task_runner, queue=self.train_test_queue(task), **task)
+
+    def completed_job_ids(self, jobs):
+        """Wait until some of the given jobs have finished or failed
+
+        Args:
+            jobs (dict) of rq.Job objects keyed on job id
+
+        Returns: (list) of ids of the jobs that finished or failed
+        """
+        reported = self.redis_connection.blpop(self.completion_key, timeout=self.sleep_time)
+        if reported is None:
+            # nothing reported, check for jobs whose worker died before it could report them
+            return [job_id for job_id, job in jobs.items() if job.is_finished or job.is_failed]
+        reported_ids = set([reported[1].decode("utf-8")])
+        while True:
+            job_id = self.redis_connection.lpop(self.completion_key)
+            if job_id is None:
+                break
+            reported_ids.add(job_id.decode("utf-8"))
+        # ids of jobs from earlier waits that were already found by a status check are ignored
+        return [
+            job_id for job_id in reported_ids
+            if job_id in jobs and self._wait_for_status(jobs[job_id])
+        ]
+
+    def _wait_for_status(self, job):
+        # jobs report completion just before the worker stores their status and result
+        deadline = time.monotonic() + self.sleep_time
+        while not (job.is_finished or job.is_failed):
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.05)
+        return True
 
     def wait_for(self, jobs):
         """Wait for a list of jobs to complete
@@ -56,21 +172,15 @@ class RQExperiment(ExperimentBase):
 
         Returns: (list) of job return values
         """
-        while True:
-            num_done = sum(1 for job in jobs if job.is_finished)
-            num_failed = sum(1 for job in jobs if job.is_failed)
-            num_pending = sum(
-                1 for job in jobs if not job.is_finished and not job.is_failed
-            )
+        pending = dict((job.id, job) for job in jobs)
+        while pending:
+            for job_id in self.completed_job_ids(pending):
+                del pending[job_id]
             logger.debug(
-                f"Report: jobs {num_done} done, {num_failed} failed, {num_pending} pending",
+                f"Report: jobs {len(jobs) - len(pending)} done or failed, {len(pending)} pending",
             )
-            if num_pending == 0:
-                logger.verbose("All jobs completed or failed, returning")
-                return [job.result for job in jobs]
-            else:
-                logger.spam("Sleeping for {self.sleep_time} seconds")
-                time.sleep(self.sleep_time)
+        logger.verbose("All jobs completed or failed, returning")
+        return [job.result for job in jobs]
 
     def process_query_tasks(self, query_tasks):
         """Run queries by table
@@ -96,7 +206,7 @@ class RQExperiment(ExperimentBase):
                 }
             }
         """
-        for table_name, tasks in query_tasks.items():
+        for table_name, tasks in spans_over("table_task", query_tasks.items(), "table"):
             logger.spam(f"Processing features for {table_name}")
             self.feature_generator.run_commands(tasks.get("prepare", []))
 
@@ -105,13 +215,7 @@ class RQExperiment(ExperimentBase):
             ]
 
             jobs = [
-                self.queue.enqueue(
-                    self.feature_generator.run_commands,
-                    insert_batch,
-                    job_timeout=DEFAULT_TIMEOUT,
-                    result_ttl=DEFAULT_TIMEOUT,
-                    ttl=DEFAULT_TIMEOUT,
-                )
+                self.enqueue(self.feature_generator.run_commands, insert_batch)
                 for insert_batch in insert_batches
             ]
 
@@ -131,13 +235,7 @@ class RQExperiment(ExperimentBase):
         Returns: (list) of job results for each given task
         """
         jobs = [
-            self.queue.enqueue(
-                self.matrix_builder.build_matrix,
-                job_timeout=DEFAULT_TIMEOUT,
-                result_ttl=DEFAULT_TIMEOUT,
-                ttl=DEFAULT_TIMEOUT,
-                **build_task
-            )
+            self.enqueue(self.matrix_builder.build_matrix, **build_task)
             for build_task in matrix_build_tasks.values()
         ]
         return self.wait_for(jobs)
@@ -145,40 +243,145 @@ class RQExperiment(ExperimentBase):
     def process_train_test_batches(self, train_test_batches):
         """Run train tasks using RQ
 
+        Tasks are routed to the affinity queue of their train matrix, if there are any.
+
         Args:
-            train_tasks (list) of dictionaries, each representing kwargs suitable
-                for self.trainer.process_train_task
+            train_test_batches (list) of catwalk.TaskBatch, whose tasks are dictionaries
+                of kwargs suitable for self.model_train_tester.process_task
         Returns: (list) of job results for each given task
         """
         jobs = [
-            self.queue.enqueue(
-                self.model_train_tester.process_task,
-                job_timeout=DEFAULT_TIMEOUT,
-                result_ttl=DEFAULT_TIMEOUT,
-                ttl=DEFAULT_TIMEOUT,
-                **task
-            )
+            self.enqueue_train_test_task(task)
             for batch in train_test_batches
             for task in batch.tasks
         ]
         return self.wait_for(jobs)
 
+    def process_pipelined_tasks(self, task_graph):
+        """Run matrix builds and train/test tasks using RQ as their dependencies complete
+
+        Args:
+            task_graph (triage.experiments.pipeline.TaskGraph) of PipelineTasks
+        Returns: (list) of job results for each task, in completion order
+        """
+        running = {}
+        keys = {}
+        results = []
+        while True:
+            for key, pipeline_task in task_graph.ready():
+                if pipeline_task.kind == MATRIX_BUILD:
+                    job = self.enqueue(
+                        self.pipeline_task_runner(pipeline_task), **pipeline_task.kwargs
+                    )
+                else:
+                    job = self.enqueue_train_test_task(pipeline_task.kwargs)
+                running[job.id] = job
+                keys[job.id] = key
+            if not running:
+                logger.verbose("All jobs completed or failed, returning")
+                return results
+            for job_id in self.completed_job_ids(running):
+                results.append(running.pop(job_id).result)
+                task_graph.complete(keys.pop(job_id))
+            logger.debug(f"Report: {len(running)} jobs pending")
+
     def process_subset_tasks(self, subset_tasks):
-        """Run subset tasks using RQ
+        """Run subset table inserts using RQ
+
+        Subset tables are populated through process_query_tasks, so batches of
+        as-of-dates are spread over the RQ workers, then checked and recorded
+        in the main process.
 
         Args:
             subset_tasks (list) of dictionaries, each representing kwargs suitable
-                for self.subsetter.process_task
-        Returns: (list) of job results for each given task
+                for self.subsetter.finish_task
+        Returns: (list) of results for each given task
         """
-        jobs = [
-            self.queue.enqueue(
-                self.subsetter.process_task,
-                job_timeout=DEFAULT_TIMEOUT,
-                result_ttl=DEFAULT_TIMEOUT,
-                ttl=DEFAULT_TIMEOUT,
-                **task
-            )
-            for task in subset_tasks
-        ]
-        return self.wait_for(jobs)
+        self.process_query_tasks(self.subsetter.generate_query_tasks(subset_tasks))
+        return [self.subsetter.finish_task(**task) for task in subset_tasks]
+
+
+def run_and_report_completion(completion_key, run, function, *args, **kwargs):
+    """Run a function in an rq job, then push the job's id onto a Redis list
+
+    Spans opened by the function are recorded on run, a (run_id, db_engine) tuple
+    """
+    try:
+        with recording_run(*run):
+            return function(*args, **kwargs)
+    finally:
+        # workers can be on other hosts, so write their run progress themselves
+        flush_progress()
+        # work horses end without running atexit handlers
+        flush_query_stats()
+        job = get_current_job()
+        if job is not None:
+            job.connection.rpush(completion_key, job.id)
+            job.connection.expire(completion_key, COMPLETION_KEY_TTL)
+
+
+def run_with_local_matrices(task_runner, directory, max_matrices, train_store, test_store, **kwargs):
+    """Run a train/test task on local copies of its matrices"""
+    return task_runner(
+        train_store=local_matrix_store(train_store, directory, max_matrices),
+        test_store=local_matrix_store(test_store, directory, max_matrices),
+        **kwargs
+    )
+
+
+def local_matrix_store(matrix_store, directory, max_matrices=DEFAULT_MAX_LOCAL_MATRICES):
+    """A store for a copy of the matrix in a local directory, copying it there if needed
+
+    Copies are written to a temporary file and renamed into place, so
+    concurrent workers sharing the directory never read a partial copy.
+
+    Args:
+        matrix_store (catwalk.storage.MatrixStore) A stored matrix
+        directory (string) A local directory to keep matrix copies in
+        max_matrices (int) How many matrices to keep in the directory
+
+    Returns: (catwalk.storage.MatrixStore) of the same class, backed by the local copy
+    """
+    local_store = matrix_store.__class__(ProjectStorage(directory), [], matrix_store.uuid)
+    if str(local_store.matrix_base_store.path) == str(matrix_store.matrix_base_store.path):
+        return matrix_store
+    for source, copy in (
+        (matrix_store.metadata_base_store, local_store.metadata_base_store),
+        (matrix_store.matrix_base_store, local_store.matrix_base_store),
+    ):
+        if copy.exists():
+            # mark it as recently used
+            os.utime(copy.path)
+            continue
+        logger.debug(f"Copying {source} to {copy.path}")
+        temporary_path = f"{copy.path}.{os.getpid()}.tmp"
+        try:
+            with open(temporary_path, "wb") as copy_file:
+                source.download(copy_file)
+            os.replace(temporary_path, copy.path)
+        except BaseException:
+            # eviction skips temporary files, so a failed copy must not be left behind
+            remove_if_exists(temporary_path)
+            raise
+    evict_local_matrices(directory, max_matrices)
+    return local_store
+
+
+def evict_local_matrices(directory, max_matrices):
+    """Remove the files of all but the most recently used matrices from a directory"""
+    last_used = {}
+    for filename in os.listdir(directory):
+        if filename.endswith(".tmp"):
+            continue
+        matrix_uuid = filename.split(".")[0]
+        modified = os.path.getmtime(os.path.join(directory, filename))
+        last_used[matrix_uuid] = max(modified, last_used.get(matrix_uuid, modified))
+    least_recently_used = sorted(last_used, key=last_used.get, reverse=True)[max_matrices:]
+    for filename in os.listdir(directory):
+        if filename.split(".")[0] in least_recently_used and not filename.endswith(".tmp"):
+            logger.debug(f"Removing local copy {filename}")
+            try:
+                os.remove(os.path.join(directory, filename))
+            except FileNotFoundError:
+                # removed by another worker
+                pass
@@ -30,6 +30,7 @@ from triage.tracking import (
     record_labels_table_name,
     record_matrix_building_started,
     record_model_building_started,
+    flush_progress,
 )
 from .utils import (
     experiment_config_from_model_id,
@@ -60,7 +61,7 @@ logger = verboselogs.VerboseLogger(__name__)
 
 
 
-def predict_forward_with_existed_model(db_engine, project_path, model_id, as_of_date):
+def predict_forward_with_existed_model(db_engine, project_path, model_id, as_of_date, model_cache=None):
     """Predict forward given model_id and as_of_date and store the prediction in database
 
     Args:
@@ -68,6 +69,8 @@ def predict_forward_with_existed_model(db_engine, project_path, model_id, as_of_
             project_storage (catwalk.storage.ProjectStorage)
             model_id (int) The id of a given model in the database
             as_of_date (string) a date string like "YYYY-MM-DD"
+            model_cache (catwalk.storage.ModelCache, optional) A cache to keep the loaded
+                model in, so predicting with it again does not reload it
     """
     logger.spam("In PREDICT LIST................")
     upgrade_db(db_engine=db_engine)
@@ -204,7 +207,7 @@ def predict_forward_with_existed_model(db_engine, project_path, model_id, as_of_
     
     # 6. Predict the risk score for production
     predictor = Predictor(
-        model_storage_engine=project_storage.model_storage_engine(),
+        model_storage_engine=project_storage.model_storage_engine(model_cache=model_cache),
         db_engine=db_engine,
         rank_order='best'
     )
@@ -537,6 +540,7 @@ class Retrainer:
             retrain=True,
             model_group_id=self.model_group_id
         )
+        flush_progress()
 
         self.retrain_model_hash = retrieve_model_hash_from_id(self.db_engine, retrain_model_id)
         self.retrain_matrix_uuid = matrix_uuid
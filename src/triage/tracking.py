@@ -1,15 +1,22 @@
 import sys
+import atexit
 import datetime
+import json
 import platform
 import getpass
 import os
 import requests
 import subprocess
+import threading
+import time
 import verboselogs, logging
 logger = verboselogs.VerboseLogger(__name__)
+from collections import Counter
+from contextlib import contextmanager
 from functools import wraps
+import sqlalchemy
 from triage.util.db import scoped_session, get_for_update
-from triage.util.introspection import classpath
+from triage.util.introspection import classpath, process_rss
 from triage import __version__
 
 try:
@@ -21,7 +28,17 @@ except ImportError:
     pip_freeze = None
 
 
-from triage.component.results_schema import TriageRun, TriageRunStatus
+from triage.component.results_schema import TriageRun, TriageRunSpan, TriageRunStatus
+
+
+# how many seconds counter increments are buffered for before being written to the run
+DEFAULT_FLUSH_INTERVAL = 10
+
+# throughput fields of the run, each with the counter and start time it is computed from
+THROUGHPUT_FIELDS = {
+    'matrices_per_minute': ('matrices_made', 'matrix_building_started'),
+    'models_per_minute': ('models_made', 'model_building_started'),
+}
 
 
 def infer_git_hash():
@@ -162,7 +179,10 @@ def experiment_entrypoint(entrypoint_func):
     To update the database, it requires the instance of the wrapped method to have a
     db_engine and run_id.
 
-    Upon method entry, will update the TriageRun row with the wrapped method name.
+    Upon method entry, will update the TriageRun row with the wrapped method name,
+    and make the run current while the method runs, so it (and the processes it forks)
+    record spans on it.
+    The method itself is recorded as a span.
     Upon method exit, will update the TriageRun row with the status (either failed or completed)
     """
     @wraps(entrypoint_func)
@@ -172,13 +192,16 @@ def experiment_entrypoint(entrypoint_func):
             if not run_obj.start_method:
                 run_obj.start_method = entrypoint_name
         try:
-            return_value = entrypoint_func(self, *args, **kwargs)
+            with recording_run(self.run_id, self.db_engine), span(entrypoint_name):
+                return_value = entrypoint_func(self, *args, **kwargs)
         except Exception as exc:
+            flush_progress()
             with get_run_for_update(self.db_engine, self.run_id) as run_obj:
                 run_obj.current_status = TriageRunStatus.failed
                 run_obj.stacktrace = str(exc)
             raise exc
 
+        flush_progress()
         with get_run_for_update(self.db_engine, self.run_id) as run_obj:
             run_obj.current_status = TriageRunStatus.completed
 
@@ -199,13 +222,349 @@ def increment_field(field, run_id, db_engine):
         run_id (int) The identifier/primary key of the run
         db_engine (sqlalchemy.engine)
     """
+    update_counts(run_id, db_engine, {field: 1})
+
+
+class ProgressReporter:
+    """Buffers increments of a run's counters and its finished spans and writes them together
+
+    Every increment of every counter of a run since the last flush is written in
+    one update, so workers finishing many small tasks do not all contend for the
+    run's row. Each write also refreshes the run's throughput fields. Spans are
+    written in one insert per run.
+
+    Worker processes can take their buffered counts and spans and send them to
+    the parent process to be merged into its buffer. A forked process starts with
+    an empty buffer, so nothing is ever written by both a parent and its child.
+
+    Args:
+        flush_interval (int) How many seconds increments and spans are buffered for
+    """
+    def __init__(self, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self._reset()
+        # a child forked while another thread holds the lock would never see it released
+        os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def _reset_after_fork(self):
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.pid = os.getpid()
+        self.counts = {}
+        self.last_flush = time.monotonic()
+
+    def _pending(self):
+        if self.pid != os.getpid():
+            # inherited from the parent process, which still has to write them itself
+            self._reset()
+        return self.counts
+
+    def _run_pending(self, pending, run_id, db_engine):
+        return pending.setdefault(run_id, (db_engine, Counter(), []))
+
+    def increment(self, field, run_id, db_engine):
+        """Buffer an increment of one of the run's counters"""
+        with self.lock:
+            self._run_pending(self._pending(), run_id, db_engine)[1][field] += 1
+        self.flush_if_due()
+
+    def record_span(self, span_values, run_id, db_engine):
+        """Buffer a finished span of the run
+
+        Args:
+            span_values (dict) The TriageRunSpan column values, except the run id
+            run_id (int) The identifier/primary key of the run
+            db_engine (sqlalchemy.engine)
+        """
+        with self.lock:
+            self._run_pending(self._pending(), run_id, db_engine)[2].append(span_values)
+        self.flush_if_due()
+
+    def take(self):
+        """Remove and return the buffered counts and spans
+
+        Returns: (dict) of (db_engine, collections.Counter, list of span dicts)
+            tuples keyed on run id
+        """
+        with self.lock:
+            pending = self._pending()
+            self.counts = {}
+        return pending
+
+    def add(self, pending):
+        """Merge counts and spans taken from another process' reporter into this buffer"""
+        with self.lock:
+            own_pending = self._pending()
+            for run_id, (db_engine, counts, spans) in pending.items():
+                _, own_counts, own_spans = self._run_pending(own_pending, run_id, db_engine)
+                own_counts.update(counts)
+                own_spans.extend(spans)
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered counts and spans to their runs"""
+        pending = self.take()
+        self.last_flush = time.monotonic()
+        for run_id, (db_engine, counts, spans) in pending.items():
+            try:
+                if counts:
+                    update_counts(run_id, db_engine, counts)
+                if spans:
+                    insert_spans(run_id, db_engine, spans)
+            except sqlalchemy.exc.SQLAlchemyError:
+                # progress is informational, so losing it should not fail the caller
+                logger.warning(
+                    f"Could not record progress {dict(counts)} and {len(spans)} spans of run {run_id}",
+                    exc_info=True
+                )
+
+
+def update_counts(run_id, db_engine, counts):
+    """Add to an TriageRun's counters and refresh its throughput in one update
+
+    Args:
+        run_id (int) The identifier/primary key of the run
+        db_engine (sqlalchemy.engine)
+        counts (dict) How much to add to each counter, keyed on field name
+    """
+    now = datetime.datetime.now()
+    values = {
+        field: getattr(TriageRun, field) + count
+        for field, count in counts.items()
+    }
+    values['last_updated_time'] = now
+    for throughput_field, (count_field, started_field) in THROUGHPUT_FIELDS.items():
+        if count_field in counts:
+            elapsed_minutes = sqlalchemy.extract(
+                'epoch', sqlalchemy.literal(now) - getattr(TriageRun, started_field)
+            ) / 60
+            values[throughput_field] = values[count_field] / sqlalchemy.func.nullif(elapsed_minutes, 0)
     with scoped_session(db_engine) as session:
         # Use an update query instead of a session merge so it happens in one atomic query
         # and protect against race conditions
-        session.query(TriageRun).filter_by(run_id=run_id).update({
-            field: getattr(TriageRun, field) + 1,
-            'last_updated_time': datetime.datetime.now()
-        })
+        session.query(TriageRun).filter_by(run_id=run_id).update(
+            values, synchronize_session=False
+        )
+
+
+def insert_spans(run_id, db_engine, spans):
+    """Store finished spans of a run
+
+    Args:
+        run_id (int) The identifier/primary key of the run
+        db_engine (sqlalchemy.engine)
+        spans (list) of dicts of TriageRunSpan column values, except the run id
+    """
+    with scoped_session(db_engine) as session:
+        session.bulk_insert_mappings(
+            TriageRunSpan, [dict(span_values, run_id=run_id) for span_values in spans]
+        )
+
+
+progress = ProgressReporter()
+atexit.register(progress.flush)
+
+
+def flush_progress():
+    """Write the counts and spans buffered in this process to their runs"""
+    progress.flush()
+
+
+def take_progress():
+    """Remove and return the counts and spans buffered in this process, to be sent to another one"""
+    return progress.take()
+
+
+def add_progress(pending):
+    """Buffer counts and spans taken from another process, to be written from this one"""
+    progress.add(pending)
+
+
+# the run that spans in this process are recorded on, as a (run_id, db_engine) tuple.
+# forked worker processes inherit it from their parent
+current_run = None
+
+_local = threading.local()
+
+
+def set_current_run(run_id, db_engine):
+    """Record spans opened in this process (and processes it forks) on the given run
+
+    Args:
+        run_id (int) The identifier/primary key of the run
+        db_engine (sqlalchemy.engine)
+    """
+    global current_run
+    current_run = (run_id, db_engine)
+
+
+@contextmanager
+def recording_run(run_id, db_engine):
+    """Make the given run current while in the block, then restore the previous one"""
+    global current_run
+    previous_run = current_run
+    set_current_run(run_id, db_engine)
+    try:
+        yield
+    finally:
+        current_run = previous_run
+
+
+@sqlalchemy.event.listens_for(sqlalchemy.engine.Engine, "before_cursor_execute")
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    context._triage_query_start = time.perf_counter()
+
+
+@sqlalchemy.event.listens_for(sqlalchemy.engine.Engine, "after_cursor_execute")
+def _stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    _local.db_time = db_time() + time.perf_counter() - context._triage_query_start
+
+
+def db_time():
+    """How many seconds this thread has spent executing SQLAlchemy queries
+
+    Statements run through a raw DBAPI connection (e.g. a COPY) are not counted.
+    """
+    return getattr(_local, 'db_time', 0.0)
+
+
+class Span:
+    """A unit of work being timed
+
+    Args:
+        name (string) What kind of work it is, e.g. 'build_matrix' or 'train'
+        attributes (dict) Identifying details of the work, e.g. the model hash
+    """
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        self.rows = None
+
+    def add_rows(self, rows):
+        """Count rows (of a matrix, of predictions, inserted...) as processed by this span"""
+        self.rows = (self.rows or 0) + rows
+
+
+def current_span():
+    """The innermost span open in this thread, a throwaway one if there is none"""
+    spans = getattr(_local, 'spans', None)
+    if not spans:
+        return Span(None, {})
+    return spans[-1]
+
+
+@contextmanager
+def span(name, **attributes):
+    """Time the enclosed unit of work and record it on the current run
+
+    The span's wall time, CPU time of the process, time spent in SQLAlchemy
+    queries and the RSS of the process at its start and end are buffered
+    along with its attributes and the rows it processed, and stored in
+    triage_metadata.triage_run_spans. Nothing is recorded if no run is current.
+
+    Args:
+        name (string) What kind of work it is, e.g. 'build_matrix' or 'train'
+        **attributes: JSON-serializable identifying details of the work
+
+    Yields: (Span) whose rows can be counted while it runs
+    """
+    this_span = Span(name, attributes)
+    if current_run is None:
+        yield this_span
+        return
+    if not hasattr(_local, 'spans'):
+        _local.spans = []
+    _local.spans.append(this_span)
+    start_time = datetime.datetime.now()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    db_start = db_time()
+    rss_start = process_rss(os.getpid())
+    try:
+        yield this_span
+    except BaseException:
+        this_span.attributes['failed'] = True
+        raise
+    finally:
+        _local.spans.pop()
+        run_id, db_engine = current_run
+        progress.record_span(
+            dict(
+                name=name,
+                start_time=start_time,
+                wall_time=time.perf_counter() - wall_start,
+                cpu_time=time.process_time() - cpu_start,
+                db_time=db_time() - db_start,
+                rss_start=rss_start,
+                rss_end=process_rss(os.getpid()),
+                rows_processed=this_span.rows,
+                pid=os.getpid(),
+                thread_id=threading.get_ident(),
+                attributes=this_span.attributes,
+            ),
+            run_id,
+            db_engine,
+        )
+
+
+def spans_over(name, items, attribute):
+    """Iterate over (key, value) items, timing the processing of each in its own span
+
+    Each span is named name and has the item's key as the given attribute. It
+    closes when the next item is requested, or when the loop is left.
+    """
+    for key, value in items:
+        with span(name, **{attribute: key}):
+            yield key, value
+
+
+def export_chrome_trace(run_id, db_engine, fileobj):
+    """Write the spans of a run as a Chrome trace
+
+    The trace can be opened in chrome://tracing or https://ui.perfetto.dev,
+    with a row for each thread of each process that did work for the run.
+
+    Args:
+        run_id (int) The identifier/primary key of the run
+        db_engine (sqlalchemy.engine)
+        fileobj (file-like object) A text file to write the trace JSON to
+    """
+    with scoped_session(db_engine) as session:
+        spans = (
+            session.query(TriageRunSpan)
+            .filter_by(run_id=run_id)
+            .order_by(TriageRunSpan.start_time)
+            .all()
+        )
+        trace_events = [
+            {
+                "name": run_span.name,
+                "cat": "triage",
+                "ph": "X",
+                # microseconds
+                "ts": run_span.start_time.timestamp() * 1e6,
+                "dur": run_span.wall_time * 1e6,
+                "pid": run_span.pid,
+                "tid": run_span.thread_id,
+                "args": dict(
+                    run_span.attributes or {},
+                    cpu_time=run_span.cpu_time,
+                    db_time=run_span.db_time,
+                    rss_start=run_span.rss_start,
+                    rss_end=run_span.rss_end,
+                    rows_processed=run_span.rows_processed,
+                ),
+            }
+            for run_span in spans
+        ]
+    json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, fileobj, default=str)
 
 
 def record_matrix_building_started(run_id, db_engine):
@@ -273,7 +632,7 @@ def built_matrix(run_id, db_engine):
         run_id (int) The identifier/primary key of the run
         db_engine (sqlalchemy.engine)
     """
-    increment_field('matrices_made', run_id, db_engine)
+    progress.increment('matrices_made', run_id, db_engine)
 
 
 def skipped_matrix(run_id, db_engine):
@@ -283,7 +642,7 @@ def skipped_matrix(run_id, db_engine):
         run_id (int) The identifier/primary key of the run
         db_engine (sqlalchemy.engine)
     """
-    increment_field('matrices_skipped', run_id, db_engine)
+    progress.increment('matrices_skipped', run_id, db_engine)
 
 
 def errored_matrix(run_id, db_engine):
@@ -293,7 +652,7 @@ def errored_matrix(run_id, db_engine):
         run_id (int) The identifier/primary key of the run
         db_engine (sqlalchemy.engine)
     """
-    increment_field('matrices_errored', run_id, db_engine)
+    progress.increment('matrices_errored', run_id, db_engine)
 
 
 def built_model(run_id, db_engine):
@@ -303,7 +662,7 @@ def built_model(run_id, db_engine):
         run_id (int) The identifier/primary key of the run
         db_engine (sqlalchemy.engine)
     """
-    increment_field('models_made', run_id, db_engine)
+    progress.increment('models_made', run_id, db_engine)
 
 
 def skipped_model(run_id, db_engine):
@@ -313,7 +672,7 @@ def skipped_model(run_id, db_engine):
         run_id (int) The identifier/primary key of the run
         db_engine (sqlalchemy.engine)
     """
-    increment_field('models_skipped', run_id, db_engine)
+    progress.increment('models_skipped', run_id, db_engine)
 
 
 def errored_model(run_id, db_engine):
@@ -323,4 +682,4 @@ def errored_model(run_id, db_engine):
         run_id (int) The identifier/primary key of the run
         db_engine (sqlalchemy.engine)
     """
-    increment_field('models_errored', run_id, db_engine)
+    progress.increment('models_errored', run_id, db_engine)
@@ -6,8 +6,18 @@ from contextlib import contextmanager
 from sqlalchemy.orm import Session
 from sqlalchemy.engine.url import make_url
 
+import atexit
+import hashlib
 import json
 import functools
+import os
+import re
+import sys
+import threading
+import time
+import weakref
+import verboselogs, logging
+logger = verboselogs.VerboseLogger(__name__)
 
 from psycopg2.extras import DateRange, DateTimeRange
 from datetime import date, datetime
@@ -30,24 +40,283 @@ def json_dumps(d):
 
 
 
+# statements that EXPLAIN can plan without redefining anything
+EXPLAINABLE_STATEMENTS = ("select", "with", "insert", "update", "delete", "values")
+
+# modules between a caller and its statement's execution, not to be reported as its component
+DATABASE_PLUMBING_MODULES = ("sqlalchemy.", "wrapt", "contextlib", __name__)
+
+# how many seconds query statistics are aggregated for before being stored
+QUERY_STATS_FLUSH_INTERVAL = 60
+
+QUERY_STATS_INSERT = sqlalchemy.text(
+    "insert into triage_metadata.query_stats "
+    "(recorded_time, pid, fingerprint, component, statement, calls, total_duration, max_duration, rows) "
+    "values (:recorded_time, :pid, :fingerprint, :component, :statement, :calls, :total_duration, :max_duration, :rows)"
+)
+
+SLOW_QUERY_INSERT = sqlalchemy.text(
+    "insert into triage_metadata.slow_queries "
+    "(recorded_time, pid, fingerprint, component, statement, duration, rows, query_plan) "
+    "values (:recorded_time, :pid, :fingerprint, :component, :statement, :duration, :rows, :query_plan)"
+)
+
+
+def statement_fingerprint(statement):
+    """A short hash of a SQL statement that is the same whatever its literal values
+
+    String and number literals become placeholders and whitespace is collapsed,
+    so e.g. the insert of each as-of-date of a feature aggregation shares one fingerprint.
+    """
+    normalized = re.sub(r"'(?:[^']|'')*'", "?", statement)
+    normalized = re.sub(r"\b\d+(?:\.\d+)?\b", "?", normalized)
+    normalized = re.sub(r"\(\s*\?(?:\s*,\s*\?)*\s*\)", "(?)", normalized)
+    normalized = " ".join(normalized.split())
+    return hashlib.md5(normalized.encode("utf-8")).hexdigest()[:16]
+
+
+# the query instrumentations of this process' engines
+_query_instrumentations = weakref.WeakSet()
+
+
+def flush_query_stats():
+    """Store the query statistics aggregated by all of this process' instrumented engines
+
+    Worker processes end without running atexit handlers, so they call this at
+    the end of each task rather than leaving statistics to the periodic flush.
+    """
+    for instrumentation in list(_query_instrumentations):
+        instrumentation.flush()
+
+
+def calling_component():
+    """The module and function that caused a statement to be executed"""
+    frame = sys._getframe(1)
+    while frame is not None:
+        module_name = frame.f_globals.get("__name__", "")
+        if not module_name.startswith(DATABASE_PLUMBING_MODULES):
+            return f"{module_name}.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return None
+
+
+class QueryInstrumentation:
+    """Times every statement executed by an engine
+
+    Calls, durations and row counts are aggregated by statement fingerprint and
+    calling component, and periodically stored in triage_metadata.query_stats.
+    The plans of statements slower than slow_query_threshold are captured with
+    EXPLAIN and stored in triage_metadata.slow_queries.
+
+    With explain_analyze, plans are captured with EXPLAIN (ANALYZE, BUFFERS)
+    instead, which runs each slow statement a second time: it is run in a
+    savepoint that is rolled back, and data-modifying statements are not
+    explained on autocommit connections. Statements that create or drop objects
+    are never explained.
+
+    Args:
+        engine (sqlalchemy.engine) The engine to instrument
+        slow_query_threshold (float, optional) How many seconds a statement can
+            take before it is explained, none are if not given
+        explain_analyze (bool) Whether to run slow statements again to capture
+            their actual row counts, timings and buffer usage
+        flush_interval (int) How many seconds statistics are aggregated for
+    """
+    def __init__(
+        self,
+        engine,
+        slow_query_threshold=None,
+        explain_analyze=False,
+        flush_interval=QUERY_STATS_FLUSH_INTERVAL,
+    ):
+        self.engine = engine
+        self.slow_query_threshold = slow_query_threshold
+        self.explain_analyze = explain_analyze
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.recording = threading.local()
+        self._reset()
+        sqlalchemy.event.listen(engine, "before_cursor_execute", self.before_cursor_execute)
+        sqlalchemy.event.listen(engine, "after_cursor_execute", self.after_cursor_execute)
+        atexit.register(self.flush)
+        _query_instrumentations.add(self)
+
+    def _reset(self):
+        self.pid = os.getpid()
+        self.stats = {}
+        self.last_flush = time.monotonic()
+
+    def _take_stats(self):
+        with self.lock:
+            # a forked process' inherited statistics are stored by its parent
+            stats = self.stats if self.pid == os.getpid() else {}
+            self._reset()
+        return stats
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        context._instrumentation_start = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - context._instrumentation_start
+        if getattr(self.recording, "active", False):
+            # the instrumentation's own statements
+            return
+        fingerprint = statement_fingerprint(statement)
+        component = calling_component()
+        rows = max(cursor.rowcount, 0)
+        if self.pid != os.getpid():
+            self._take_stats()
+        with self.lock:
+            stats = self.stats.setdefault(
+                (fingerprint, component),
+                {"statement": statement, "calls": 0, "total_duration": 0.0, "max_duration": 0.0, "rows": 0},
+            )
+            stats["calls"] += 1
+            stats["total_duration"] += duration
+            stats["max_duration"] = max(stats["max_duration"], duration)
+            stats["rows"] += rows
+        if self.slow_query_threshold is not None and duration >= self.slow_query_threshold:
+            logger.notice(f"Statement {fingerprint} from {component} took {duration:.1f} seconds")
+            query_plan = None if executemany else self.explain(cursor, statement, parameters)
+            self.record(
+                SLOW_QUERY_INSERT,
+                [dict(
+                    recorded_time=datetime.now(),
+                    pid=os.getpid(),
+                    fingerprint=fingerprint,
+                    component=component,
+                    statement=statement,
+                    duration=duration,
+                    rows=rows,
+                    query_plan=json_dumps(query_plan) if query_plan is not None else None,
+                )],
+            )
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def explain(self, cursor, statement, parameters):
+        """The EXPLAIN plan of a statement, None if it can't be explained"""
+        words = statement.lstrip().split(None, 1)
+        if not words or words[0].lower() not in EXPLAINABLE_STATEMENTS:
+            return None
+        connection = cursor.connection
+        if connection.autocommit:
+            if self.explain_analyze and words[0].lower() not in ("select", "values"):
+                # the statement's changes could not be rolled back
+                return None
+            # nothing else is in a transaction a failed EXPLAIN would abort
+            use_savepoint = False
+        else:
+            use_savepoint = True
+        if self.explain_analyze:
+            explain_statement = "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + statement
+        else:
+            explain_statement = "EXPLAIN (FORMAT JSON) " + statement
+        explain_cursor = connection.cursor()
+        try:
+            if use_savepoint:
+                explain_cursor.execute("SAVEPOINT triage_explain")
+            try:
+                explain_cursor.execute(explain_statement, parameters or None)
+                return explain_cursor.fetchone()[0]
+            finally:
+                if use_savepoint:
+                    explain_cursor.execute("ROLLBACK TO SAVEPOINT triage_explain")
+                    explain_cursor.execute("RELEASE SAVEPOINT triage_explain")
+        except Exception:
+            logger.debug("Could not explain slow statement", exc_info=True)
+            return None
+        finally:
+            explain_cursor.close()
+
+    def flush(self):
+        """Store the statistics aggregated since the last flush"""
+        stats = self._take_stats()
+        if not stats:
+            return
+        recorded_time = datetime.now()
+        self.record(
+            QUERY_STATS_INSERT,
+            [
+                dict(
+                    statement_stats,
+                    recorded_time=recorded_time,
+                    pid=os.getpid(),
+                    fingerprint=fingerprint,
+                    component=component,
+                )
+                for (fingerprint, component), statement_stats in stats.items()
+            ],
+        )
+
+    def record(self, insert, rows):
+        self.recording.active = True
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(insert, rows)
+        except sqlalchemy.exc.SQLAlchemyError:
+            # diagnostics should not fail the statements they are about
+            logger.warning("Could not record query diagnostics", exc_info=True)
+        finally:
+            self.recording.active = False
+
+
 class SerializableDbEngine(wrapt.ObjectProxy):
     """A sqlalchemy engine that can be serialized across process boundaries.
 
     Works by saving all kwargs used to create the engine and reconstructs them later.  As a result, the state won't be saved upon serialization/deserialization.
+
+    Args:
+        url (string or sqlalchemy.engine.url.URL)
+        creator (function) Creates the underlying engine from the url and kwargs
+        instrument_queries (bool) Whether to time every statement with a QueryInstrumentation
+        slow_query_threshold (float, optional) How many seconds a statement can take
+            before its plan is captured, implies instrument_queries
+        explain_analyze (bool) Whether slow statements are run again to capture
+            their plans with EXPLAIN ANALYZE
+        **kwargs: passed to the creator
     """
 
-    __slots__ = ("url", "creator", "kwargs")
+    __slots__ = ("url", "creator", "kwargs", "instrumentation_kwargs", "query_instrumentation")
+
+    # engines reconstructed in this process, by process id, url and creation arguments,
+    # so that long-lived worker processes reuse one engine (and its connections) across tasks
+    _reconstructed_engines = {}
 
-    def __init__(self, url, *, creator=sqlalchemy.create_engine, **kwargs):
+    def __init__(
+        self,
+        url,
+        *,
+        creator=sqlalchemy.create_engine,
+        instrument_queries=False,
+        slow_query_threshold=None,
+        explain_analyze=False,
+        **kwargs
+    ):
         self.url = make_url(url)
         self.creator = creator
         self.kwargs = kwargs
+        self.instrumentation_kwargs = dict(
+            instrument_queries=instrument_queries,
+            slow_query_threshold=slow_query_threshold,
+            explain_analyze=explain_analyze,
+        )
 
         engine = creator(url, **kwargs)
         super().__init__(engine)
+        self.query_instrumentation = None
+        if instrument_queries or slow_query_threshold is not None:
+            self.query_instrumentation = QueryInstrumentation(
+                engine,
+                slow_query_threshold=slow_query_threshold,
+                explain_analyze=explain_analyze,
+            )
 
     def __reduce__(self):
-        return (self.__reconstruct__, (self.url, self.creator, self.kwargs))
+        return (
+            self.__reconstruct__,
+            (self.url, self.creator, dict(self.kwargs, **self.instrumentation_kwargs)),
+        )
 
     def __reduce_ex__(self, protocol):
         # wrapt requires reduce_ex to be implemented
@@ -55,7 +324,15 @@ class SerializableDbEngine(wrapt.ObjectProxy):
 
     @classmethod
     def __reconstruct__(cls, url, creator, kwargs):
-        return cls(url, creator=creator, **kwargs)
+        key = (os.getpid(), str(url), creator, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            # unhashable engine arguments, e.g. a connect_args dict
+            return cls(url, creator=creator, **kwargs)
+        if key not in cls._reconstructed_engines:
+            cls._reconstructed_engines[key] = cls(url, creator=creator, **kwargs)
+        return cls._reconstructed_engines[key]
 
 
 create_engine = functools.partial(SerializableDbEngine, json_serializer=json_dumps)
@@ -1,4 +1,5 @@
 import inspect
+import os
 
 
 def classpath(klass):
@@ -25,3 +26,13 @@ def bind_kwargs(kallable, **kwargs):
     else:
         passed_kwargs = call_signature
     return passed_kwargs
+
+
+def process_rss(pid):
+    """The current resident memory size of a process in bytes, None if it is unknown"""
+    try:
+        with open(f"/proc/{pid}/statm") as statm:
+            resident_pages = int(statm.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return resident_pages * os.sysconf("SC_PAGE_SIZE")
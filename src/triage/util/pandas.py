@@ -1,17 +1,60 @@
 from functools import partial
 import pandas as pd
 import numpy as np
+import scipy.sparse
 
 import verboselogs, logging
 logger = verboselogs.VerboseLogger(__name__)
 
+def compact_dtype(values):
+    """The smallest dtype that holds a column's values exactly, as far as float32 did
+
+    0/1 flags (like imputation flags and one-hot categoricals) are uint8, other
+    whole numbers without nulls the smallest signed integer type that holds them,
+    and everything else float32.
+
+    Args:
+        values (numpy.ndarray) the column's values, without any sparse fill value
+
+    Returns: (numpy.dtype)
+    """
+    if values.dtype == np.bool_:
+        return np.dtype(np.uint8)
+    if not np.issubdtype(values.dtype, np.number) or values.size == 0:
+        return np.dtype(np.float32)
+    if np.issubdtype(values.dtype, np.floating):
+        if not np.isfinite(values).all() or not (values == np.trunc(values)).all():
+            return np.dtype(np.float32)
+    minimum, maximum = values.min(), values.max()
+    if minimum >= 0 and maximum <= 1:
+        return np.dtype(np.uint8)
+    for dtype in (np.int8, np.int16, np.int32):
+        if np.iinfo(dtype).min <= minimum and maximum <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    # past int32, keep the float32 every column used to get. It rounds integers
+    # beyond 2**24, which int64 would hold exactly
+    return np.dtype(np.float32)
+
+
+def _downcast_column(column):
+    if isinstance(column.dtype, pd.SparseDtype):
+        # keep sparse columns sparse, astype(np.float32) would densify them.
+        # only flags are compacted, the explicit values being all there is to check
+        fill_value = column.dtype.fill_value
+        dtype = np.float32
+        if fill_value in (0, 1) and compact_dtype(column.array.sp_values) == np.uint8:
+            dtype = np.uint8
+        return column.astype(pd.SparseDtype(dtype, fill_value))
+    return column.astype(compact_dtype(column.to_numpy()))
+
+
 def downcast_matrix(df):
     """Downcast the numeric values of a matrix.
 
-    This will make the matrix use less memory by turning, for instance,
-    int64 columns into int32 columns.
-
-    First converts floats and then integers.
+    This will make the matrix use less memory by giving each column the
+    smallest type that holds its values (see compact_dtype): 0/1 flags
+    are stored as uint8, whole numbers as the smallest integer type, and
+    only other values as float32. Sparse columns stay sparse.
 
     Operates on the dataframe as passed, without doing anything to the index.
     Callers may pass an index-less dataframe if they wish to re-add the index afterwards
@@ -20,10 +63,42 @@ def downcast_matrix(df):
     logger.spam("Downcasting matrix.")
     logger.spam(f"Starting memory usage: {df.memory_usage(deep=True).sum()} bytes")
     logger.spam(f"Initial types: \n {df.dtypes}")
-    new_df = df.apply(lambda x: x.astype(np.float32))
+    new_df = df.apply(_downcast_column)
 
     logger.spam("Downcasting matrix completed.")
     logger.spam(f"Final memory usage: {new_df.memory_usage(deep=True).sum()} bytes")
     logger.spam(f"Final data types: \n {new_df.dtypes}")
 
     return new_df
+
+
+def is_sparse_matrix(df):
+    """Whether any column of the dataframe is stored sparsely"""
+    return any(isinstance(dtype, pd.SparseDtype) for dtype in df.dtypes)
+
+
+def to_sparse_matrix(df, sparse_format="csr"):
+    """Convert a dataframe to a scipy sparse matrix, without densifying sparse columns
+
+    Any dense columns (and sparse columns not filled with zeros) are converted first. The index and column names are
+    dropped, so callers should keep the dataframe around if they need them.
+
+    Args:
+        df (pandas.DataFrame) with numeric columns, sparse or dense
+        sparse_format (string) the scipy.sparse format to return, e.g. 'csr' or 'csc'
+
+    Returns: (scipy.sparse.spmatrix)
+    """
+    if df.shape[1] == 0:
+        return scipy.sparse.csr_matrix(df.shape, dtype=np.float32).asformat(sparse_format)
+    # to_coo leaves out every fill value, so they all need to be zeros
+    unconverted_columns = [
+        column
+        for column, dtype in df.dtypes.items()
+        if not isinstance(dtype, pd.SparseDtype) or dtype.fill_value != 0
+    ]
+    if unconverted_columns:
+        df = df.copy(deep=False)
+        for column in unconverted_columns:
+            df[column] = pd.arrays.SparseArray(df[column].to_numpy(), fill_value=0)
+    return df.sparse.to_coo().asformat(sparse_format)